@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for build_food_database.py.
+
+Each subcommand times one part of the USDA -> SQLite build against the
+implementation it replaced, on the same input files, and checks that both
+produce the same result.
+
+Usage:
+    python3 benchmark_food_database.py loaders usda_data/branded
+    python3 benchmark_food_database.py loaders usda_data/foundation.zip --repeat 3
+    python3 benchmark_food_database.py zipio usda_data
+    python3 benchmark_food_database.py dedup --sizes 100000 1000000 5000000
+    python3 benchmark_food_database.py categorize usda_data/branded.zip usda_data/foundation.zip
+    python3 benchmark_food_database.py dbload --sizes 100000 500000
+    python3 benchmark_food_database.py fts-profiles food_database.sqlite --profiles baseline prefix
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+import build_food_database as builder
+
+
+def time_call(fn, *args, repeat: int = 1):
+    """Run fn(*args) `repeat` times. Returns (best_seconds, last_result)."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def print_comparison(title: str, timings: list):
+    """Print a small table of (label, seconds, rows) with speedup vs the first entry."""
+    print(f"\n  {title}")
+    baseline = timings[0][1]
+    for label, seconds, rows in timings:
+        speedup = baseline / seconds if seconds > 0 else float("inf")
+        rate = rows / seconds if seconds > 0 else float("inf")
+        print(f"    {label:<28} {seconds:8.3f}s  {rows:>12,} rows  {rate:>14,.0f} rows/s  x{speedup:.2f}")
+
+
+def bench_loaders(args) -> int:
+    """Compare the csv.DictReader nutrient loader with the columnar one."""
+    base_dir = Path(args.dataset_dir)
+    csv_path = builder.find_csv(base_dir, "food_nutrient.csv")
+    if not csv_path:
+        print(f"food_nutrient.csv not found in {base_dir}")
+        return 1
+
+    size_mb = builder.csv_size(csv_path) / (1024 * 1024)
+    print(f"Benchmarking nutrient loaders on {csv_path} ({size_mb:.1f} MB)")
+
+    dict_s, dict_result = time_call(builder.load_nutrients_dictreader, base_dir, repeat=args.repeat)
+    col_s, table = time_call(builder.load_nutrients, base_dir, repeat=args.repeat)
+
+    dict_rows = sum(len(v) for v in dict_result.values())
+    col_rows = int((table.values == table.values).sum())
+    print_comparison("load_nutrients", [
+        ("csv.DictReader", dict_s, dict_rows),
+        ("columnar (pyarrow)", col_s, col_rows),
+    ])
+    print(f"\n  NutrientTable: {len(table):,} foods x {len(builder.NUTRIENT_KEYS)} nutrients, "
+          f"{table.nbytes / (1024 * 1024):.1f} MB")
+
+    if dict_result != table.to_dict():
+        print("\n  MISMATCH: columnar loader output differs from DictReader output!")
+        return 1
+    print(f"  Outputs identical ({len(table):,} foods).")
+    return 0
+
+
+def process_dataset(data_type: str, base_dir: Path) -> list:
+    """Run the builder's processor for one dataset with its progress output silenced."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return builder.process_dataset(data_type, base_dir)
+
+
+def bench_zipio(args) -> int:
+    """Compare extract-then-read with reading CSVs straight out of each dataset zip."""
+    data_dir = Path(args.data_dir)
+    status = 0
+    print(f"Benchmarking zip streaming vs extraction in {data_dir}")
+    print(f"\n    {'dataset':<12} {'written MB':>11} {'extract s':>10} {'read dir s':>11} {'read zip s':>11} {'saved s':>8}")
+    for data_type in builder.USDA_DOWNLOADS:
+        zip_path = data_dir / f"{data_type}.zip"
+        if not zip_path.is_file():
+            print(f"    {data_type:<12} (no {zip_path.name}, skipped)")
+            continue
+
+        with tempfile.TemporaryDirectory(dir=data_dir) as tmp:
+            start = time.perf_counter()
+            with zipfile.ZipFile(zip_path, "r") as zf:
+                zf.extractall(tmp)
+                written = sum(info.file_size for info in zf.infolist())
+            extract_s = time.perf_counter() - start
+            dir_s, dir_foods = time_call(process_dataset, data_type, Path(tmp))
+
+        zip_s, zip_foods = time_call(process_dataset, data_type, zip_path)
+        saved = extract_s + dir_s - zip_s
+        print(f"    {data_type:<12} {written / (1024 * 1024):>11.1f} {extract_s:>10.2f} {dir_s:>11.2f} {zip_s:>11.2f} {saved:>8.2f}")
+        if dir_foods != zip_foods:
+            print(f"    MISMATCH: {data_type} output differs between extracted and zip input!")
+            status = 1
+    return status
+
+
+def legacy_dedup(all_foods: list) -> list:
+    """The original list.index()-based dedup from main(), kept as the reference."""
+    seen = {}
+    unique_foods = []
+    for food in all_foods:
+        key = food["name"].lower()
+        if food["brand"]:
+            key += f"|{food['brand'].lower()}"
+        if key not in seen:
+            seen[key] = food
+            unique_foods.append(food)
+        else:
+            existing = seen[key]
+            new_score = sum(1 for k in ["calories", "protein", "carbs", "fat", "fiber", "sugar", "sodium"] if food.get(k))
+            old_score = sum(1 for k in ["calories", "protein", "carbs", "fat", "fiber", "sugar", "sodium"] if existing.get(k))
+            if new_score > old_score:
+                idx = unique_foods.index(existing)
+                unique_foods[idx] = food
+                seen[key] = food
+    return unique_foods
+
+
+def synthetic_foods(n: int, duplicate_ratio: float = 0.3, seed: int = 0) -> list:
+    """
+    `n` food dicts shaped like the processors' output (only the fields dedup
+    reads), where roughly `duplicate_ratio` of them repeat an earlier
+    name/brand with different nutrient completeness.
+    """
+    rng = random.Random(seed)
+    brands = [None] * 8 + [f"Brand {i}" for i in range(200)]
+    distinct = max(1, int(n * (1 - duplicate_ratio)))
+    foods = []
+    for i in range(n):
+        j = i if i < distinct else rng.randrange(distinct)
+        food = {"fdcId": i, "name": f"Food {j}", "brand": brands[j % len(brands)]}
+        for k in builder.COMPLETENESS_FIELDS:
+            food[k] = rng.random() * 100 if rng.random() < 0.7 else 0
+        foods.append(food)
+    rng.shuffle(foods)
+    return foods
+
+
+def bench_dedup(args) -> int:
+    """Compare the legacy list.index() dedup with builder.dedup_foods on synthetic rows."""
+    status = 0
+    for n in args.sizes:
+        foods = synthetic_foods(n, args.duplicate_ratio)
+        timings = []
+        legacy = None
+        if n <= args.legacy_max:
+            legacy_s, legacy = time_call(legacy_dedup, foods)
+            timings.append(("legacy list.index()", legacy_s, n))
+        new_s, unique = time_call(builder.dedup_foods, foods)
+        timings.append(("indexed dedup_foods", new_s, n))
+        print_comparison(f"dedup {n:,} foods -> {len(unique):,} unique", timings)
+        if legacy is None:
+            print(f"    (legacy skipped above --legacy-max {args.legacy_max:,}: quadratic)")
+        elif [id(f) for f in legacy] != [id(f) for f in unique]:
+            print("    MISMATCH: dedup_foods kept different foods than the legacy dedup!")
+            status = 1
+        del foods
+    return status
+
+
+# The baseline keyword tests, copied unchanged (including their own term
+# list) so the builder's tables can't drift without the comparison noticing.
+LEGACY_COMMON_FOOD_TERMS = {
+    "apple", "banana", "orange", "chicken breast", "rice", "eggs", "egg",
+    "milk", "bread", "yogurt", "cheese", "salmon", "broccoli", "potato",
+    "pasta", "oatmeal", "avocado", "spinach", "tomato", "coffee",
+    "peanut butter", "almonds", "steak", "ground beef", "turkey",
+    "tuna", "shrimp", "tofu", "beans", "lentils", "quinoa",
+    "butter", "olive oil", "honey", "pizza", "hamburger", "french fries",
+    "ice cream", "cookie", "chocolate", "cereal", "granola",
+    "bacon", "sausage", "ham", "salad", "soup", "sandwich",
+    "pancake", "waffle", "bagel", "muffin", "croissant",
+    "orange juice", "latte", "cappuccino", "smoothie",
+    "protein shake", "protein bar", "greek yogurt",
+    "sweet potato", "corn", "carrot", "lettuce", "cucumber",
+    "strawberries", "blueberries", "grapes", "watermelon", "mango",
+    "pineapple", "peach", "pear", "cherry", "raspberry",
+    "flat white", "espresso", "americano", "mocha",
+}
+
+
+def legacy_is_common_food(name: str) -> bool:
+    """The baseline is_common_food, verbatim: the reference for the KeywordMatcher version."""
+    name_lower = name.lower()
+    for term in LEGACY_COMMON_FOOD_TERMS:
+        if term in name_lower:
+            return True
+    return False
+
+
+def legacy_categorize_food(name: str, food_category: str = "") -> str:
+    """The baseline categorize_food, verbatim: the reference for the KeywordMatcher version."""
+    name_lower = name.lower()
+    cat_lower = food_category.lower() if food_category else ""
+
+    # Check category first
+    if any(t in cat_lower for t in ["fruit", "berry", "citrus"]):
+        return "Fruits"
+    if any(t in cat_lower for t in ["vegetable", "legume"]):
+        return "Vegetables"
+    if any(t in cat_lower for t in ["grain", "cereal", "bread", "baked", "pasta"]):
+        return "Grains & Cereals"
+    if any(t in cat_lower for t in ["meat", "poultry", "fish", "seafood", "egg", "nut", "seed"]):
+        return "Protein Foods"
+    if any(t in cat_lower for t in ["dairy", "milk", "cheese", "yogurt", "cream"]):
+        return "Dairy"
+    if any(t in cat_lower for t in ["beverage", "drink", "water", "juice", "coffee", "tea"]):
+        return "Beverages"
+    if any(t in cat_lower for t in ["snack", "chip", "cracker", "pretzel", "popcorn"]):
+        return "Snacks"
+    if any(t in cat_lower for t in ["dessert", "candy", "chocolate", "cookie", "cake", "ice cream"]):
+        return "Desserts"
+    if any(t in cat_lower for t in ["fast food", "restaurant"]):
+        return "Fast Food"
+    if any(t in cat_lower for t in ["sauce", "condiment", "dressing", "spice", "seasoning"]):
+        return "Condiments & Sauces"
+    if any(t in cat_lower for t in ["oil", "fat", "butter", "margarine"]):
+        return "Oils & Fats"
+
+    # Fallback: check name
+    if any(t in name_lower for t in ["apple", "banana", "orange", "berry", "fruit", "grape", "melon", "peach", "pear", "mango", "pineapple", "cherry", "plum", "lemon", "lime", "kiwi"]):
+        return "Fruits"
+    if any(t in name_lower for t in ["broccoli", "carrot", "spinach", "tomato", "potato", "lettuce", "cabbage", "celery", "pepper", "onion", "corn", "pea", "bean", "vegetable"]):
+        return "Vegetables"
+    if any(t in name_lower for t in ["rice", "bread", "pasta", "noodle", "oat", "cereal", "wheat", "flour", "tortilla", "bagel", "muffin", "pancake", "waffle"]):
+        return "Grains & Cereals"
+    if any(t in name_lower for t in ["chicken", "beef", "pork", "fish", "salmon", "tuna", "shrimp", "turkey", "egg", "tofu", "lamb", "steak"]):
+        return "Protein Foods"
+    if any(t in name_lower for t in ["milk", "cheese", "yogurt", "cream", "butter"]):
+        return "Dairy"
+    if any(t in name_lower for t in ["coffee", "tea", "juice", "soda", "water", "drink", "latte", "espresso", "smoothie", "shake"]):
+        return "Beverages"
+    if any(t in name_lower for t in ["pizza", "burger", "sandwich", "taco", "burrito", "fries", "hot dog", "wrap", "sub "]):
+        return "Fast Food"
+    if any(t in name_lower for t in ["cookie", "cake", "ice cream", "chocolate", "candy", "brownie", "pie", "donut", "pastry"]):
+        return "Desserts"
+    if any(t in name_lower for t in ["chip", "pretzel", "popcorn", "cracker", "granola bar", "protein bar", "trail mix", "nuts"]):
+        return "Snacks"
+    if any(t in name_lower for t in ["sauce", "ketchup", "mustard", "dressing", "mayo", "salsa", "syrup", "honey", "jam"]):
+        return "Condiments & Sauces"
+    if any(t in name_lower for t in ["oil", "lard", "shortening"]):
+        return "Oils & Fats"
+
+    return "Other"
+
+
+def food_name_column(sources: list, limit: int) -> tuple:
+    """(names, categories) from food.csv / branded_food.csv in the given datasets, or synthetic if none."""
+    names, categories = [], []
+    for source in sources:
+        base_dir = Path(source)
+        descriptions = builder.load_food_descriptions(base_dir)
+        branded_csv = builder.find_csv(base_dir, "branded_food.csv")
+        food_cats = {}
+        if branded_csv:
+            with builder.open_csv_text(branded_csv) as f:
+                for row in builder.csv.DictReader(f):
+                    food_cats[row.get("fdc_id", "")] = row.get("branded_food_category", "")
+        for fdc_id, description in descriptions.items():
+            names.append(description or "")
+            categories.append(food_cats.get(str(fdc_id), ""))
+            if len(names) >= limit:
+                return names, categories
+    if names:
+        return names, categories
+
+    rng = random.Random(0)
+    words = [kw for _, kws in builder.NAME_KEYWORDS for kw in kws] + list(builder.COMMON_FOOD_TERMS)
+    words += ["organic", "original", "classic", "lite", "family size", "with", "and", "style", "sliced", "xtra"]
+    cats = [""] * 5 + [kw.title() for _, kws in builder.CATEGORY_KEYWORDS for kw in kws] + ["Other Foods", "Prepared Meals"]
+    for _ in range(limit):
+        names.append(" ".join(rng.choice(words) for _ in range(rng.randint(1, 6))).upper())
+        categories.append(rng.choice(cats))
+    return names, categories
+
+
+def bench_categorize(args) -> int:
+    """Legacy keyword scans vs the Aho-Corasick matchers, with an equivalence check."""
+    names, categories = food_name_column(args.sources, args.limit)
+    print(f"Classifying {len(names):,} food names")
+
+    legacy_s, legacy = time_call(lambda: [legacy_categorize_food(n, c) for n, c in zip(names, categories)])
+    single_s, single = time_call(lambda: [builder.categorize_food(n, c) for n, c in zip(names, categories)])
+    batch_s, batch = time_call(builder.categorize_foods, names, categories)
+    print_comparison("categorize_food", [
+        ("legacy any(t in ...)", legacy_s, len(names)),
+        ("KeywordMatcher per name", single_s, len(names)),
+        ("categorize_foods batch", batch_s, len(names)),
+    ])
+
+    legacy_c_s, legacy_common = time_call(lambda: [legacy_is_common_food(n) for n in names])
+    single_c_s, single_common = time_call(lambda: [builder.is_common_food(n) for n in names])
+    batch_c_s, batch_common = time_call(builder.is_common_foods, names)
+    print_comparison("is_common_food", [
+        ("legacy term loop", legacy_c_s, len(names)),
+        ("KeywordMatcher per name", single_c_s, len(names)),
+        ("is_common_foods batch", batch_c_s, len(names)),
+    ])
+
+    status = 0
+    for label, expected, got in [
+        ("categorize_food", legacy, single), ("categorize_foods", legacy, batch),
+        ("is_common_food", legacy_common, single_common), ("is_common_foods", legacy_common, batch_common),
+    ]:
+        mismatches = [i for i, (a, b) in enumerate(zip(expected, got)) if a != b]
+        if mismatches:
+            i = mismatches[0]
+            print(f"\n  MISMATCH in {label}: {len(mismatches)} names, e.g. {names[i]!r} / {categories[i]!r}: "
+                  f"{expected[i]!r} != {got[i]!r}")
+            status = 1
+    if status == 0:
+        print("\n  All outputs identical to the legacy functions.")
+    return status
+
+
+FOOD_WORDS = (
+    "chicken", "breast", "grilled", "roasted", "beef", "ground", "pork", "salmon", "tuna",
+    "rice", "brown", "white", "whole", "wheat", "bread", "pasta", "cheese", "cheddar",
+    "milk", "yogurt", "greek", "vanilla", "chocolate", "strawberry", "banana", "apple",
+    "orange", "juice", "latte", "coffee", "tea", "green", "organic", "raw", "cooked",
+    "frozen", "pizza", "sauce", "tomato", "potato", "chips", "crackers", "cereal", "oat",
+    "almond", "peanut", "butter", "protein", "bar", "smoothie", "soup", "salad", "bean",
+)
+
+
+def synthetic_database_foods(n: int, seed: int = 0) -> list:
+    """`n` complete food dicts (every FOOD_FIELDS key) with word-salad names, for build_database."""
+    rng = random.Random(seed)
+    brands = [None] * 4 + [f"Brand {i}" for i in range(500)]
+    categories = [category for category, _ in builder.CATEGORY_KEYWORDS] + ["Other"]
+    # Concatenated datasets don't arrive in fdcId order.
+    fdc_ids = rng.sample(range(100_000, 100_000 + 4 * n), n)
+    foods = []
+    for i in range(n):
+        name = " ".join(rng.choice(FOOD_WORDS) for _ in range(rng.randint(2, 5))).title()
+        extras = {k: round(rng.random() * 50, 2) for k in rng.sample(sorted(builder.ADDITIONAL_NUTRIENT_KEYS), 4)}
+        foods.append({
+            "fdcId": fdc_ids[i],
+            "name": name,
+            "brand": rng.choice(brands),
+            "category": rng.choice(categories),
+            "servingSize": "100",
+            "servingUnit": "g",
+            "calories": round(rng.random() * 500, 1),
+            "protein": round(rng.random() * 30, 1),
+            "carbs": round(rng.random() * 60, 1),
+            "fat": round(rng.random() * 25, 1),
+            "fiber": round(rng.random() * 8, 1),
+            "sugar": round(rng.random() * 20, 1),
+            "sodium": round(rng.random() * 900, 1),
+            "cholesterol": None,
+            "saturatedFat": round(rng.random() * 10, 1),
+            "additionalNutrients": json.dumps(extras),
+            "dataType": "branded" if i % 3 else "sr_legacy",
+            "isCommon": i % 7 == 0,
+        })
+    return foods
+
+
+def database_digest(db_path: Path) -> str:
+    """SHA-256 over every foods row plus a few FTS lookups, to compare two builds' contents."""
+    digest = hashlib.sha256()
+    conn = sqlite3.connect(str(db_path))
+    try:
+        for row in conn.execute("SELECT * FROM foods ORDER BY fdcId"):
+            digest.update(repr(row).encode())
+        for word in FOOD_WORDS[:10]:
+            rows = conn.execute(
+                "SELECT rowid FROM foods_fts WHERE foods_fts MATCH ? ORDER BY rowid", (f'"{word}"*',)
+            ).fetchall()
+            digest.update(repr(rows).encode())
+    finally:
+        conn.close()
+    return digest.hexdigest()
+
+
+def bench_dbload(args) -> int:
+    """Compare the in-place build_database with the --bulk-load modes on synthetic foods."""
+    status = 0
+    modes = [None] + list(builder.BULK_LOAD_MODES)
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            foods = synthetic_database_foods(n)
+            timings, sizes, digests = [], [], []
+            for mode in modes:
+                out = Path(tmp) / f"{mode or 'inplace'}.sqlite"
+                with contextlib.redirect_stdout(io.StringIO()):
+                    seconds, _ = time_call(builder.build_database, foods, mode, out)
+                timings.append((f"bulk_load={mode}", seconds, n))
+                sizes.append(out.stat().st_size)
+                digests.append(database_digest(out))
+            print_comparison(f"build_database {n:,} foods", timings)
+            for (label, _, _), size in zip(timings, sizes):
+                print(f"    {label:<28} {size / (1024 * 1024):8.1f} MB")
+            if len(set(digests)) != 1:
+                print("    MISMATCH: bulk-load database contents differ from the in-place build!")
+                status = 1
+            del foods
+    if status == 0:
+        print("\n  All builds have identical foods rows and FTS results.")
+    return status
+
+
+def bench_fts_profiles(args) -> int:
+    """Size and prefix-search latency of each foods_fts layout on an existing database."""
+    builder.compare_fts_profiles(Path(args.database), args.profiles, args.queries, args.seed)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for build_food_database.py")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("loaders", help="csv.DictReader vs columnar food_nutrient.csv loading")
+    p.add_argument("dataset_dir", help="Extracted USDA dataset directory or zip, e.g. usda_data/branded")
+    p.add_argument("--repeat", type=int, default=1, help="Runs per loader; the best time is reported")
+    p.set_defaults(func=bench_loaders)
+
+    p = sub.add_parser("zipio", help="extract-then-read vs streaming CSVs from the dataset zips")
+    p.add_argument("data_dir", nargs="?", default=str(builder.DATA_DIR), help="Directory holding <dataset>.zip files")
+    p.set_defaults(func=bench_zipio)
+
+    p = sub.add_parser("dedup", help="legacy vs indexed global dedup on synthetic foods")
+    p.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000, 5_000_000])
+    p.add_argument("--duplicate-ratio", type=float, default=0.3, help="Fraction of rows that repeat an earlier key")
+    p.add_argument("--legacy-max", type=int, default=100_000, help="Largest size to also run the quadratic legacy dedup on")
+    p.set_defaults(func=bench_dedup)
+
+    p = sub.add_parser("categorize", help="legacy keyword scans vs KeywordMatcher, with equivalence check")
+    p.add_argument("sources", nargs="*", help="USDA dataset dirs/zips to take names from (default: synthetic names)")
+    p.add_argument("--limit", type=int, default=500_000, help="Maximum number of names")
+    p.set_defaults(func=bench_categorize)
+
+    p = sub.add_parser("dbload", help="in-place build_database vs --bulk-load (memory / tempfile) build time and size")
+    p.add_argument("--sizes", type=int, nargs="+", default=[100_000, 500_000])
+    p.set_defaults(func=bench_dbload)
+
+    p = sub.add_parser("fts-profiles", help="foods_fts size vs prefix-search latency for each FTS profile")
+    p.add_argument("database", help="A built food_database.sqlite")
+    p.add_argument("--profiles", nargs="+", choices=list(builder.FTS_PROFILES), help="Default: all")
+    p.add_argument("--queries", type=int, default=2000, help="benchmark_search corpus size before filtering")
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_fts_profiles)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,849 @@
+#!/usr/bin/env python3
+"""
+Search-latency benchmark for food_database.sqlite.
+
+Replays the exact SQL that the iOS app (LocalFoodDatabase.swift) runs against
+the bundled database over a generated query corpus, and reports latency
+percentiles and rows scanned per query kind:
+
+- prefix      one word cut short, as typed keystroke by keystroke ("chic")
+- multiword   consecutive words from a real name, last one cut short ("chicken bre")
+- typo        a word with one edit (deletion, insertion, substitution, swap)
+- infix       the middle of a word ("icke"); FTS misses, so the LIKE fallback runs
+- brand       a brand name prefix
+- by_id       getFoodById
+- common      getCommonFoods
+
+Searches go through the app's two stages: the FTS5 join first, then the
+LIKE scan when FTS returns nothing (or the FTS query is invalid). With
+`--stages trigram` the fallback is served from the foods_trigram index
+instead (see build_food_database.py --trigram).
+
+Results are written as JSON so two builds can be compared:
+
+Usage:
+    python3 benchmark_search.py run food_database.sqlite --output before.json
+    python3 benchmark_search.py run new.sqlite --corpus before.json --output after.json
+    python3 benchmark_search.py run new.sqlite --stages trigram --corpus before.json --output trigram.json
+    python3 benchmark_search.py compare before.json after.json
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import sqlite3
+import string
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Callable, NamedTuple, Optional
+
+# Column list shared by every app query (LocalFoodDatabase.foodItemFromRow).
+APP_COLUMNS = (
+    "fdcId, name, brand, category, servingSize, servingUnit, "
+    "calories, protein, carbs, fat, fiber, sugar, sodium, "
+    "cholesterol, saturatedFat, additionalNutrients, isCommon"
+)
+_FTS_COLUMNS = ", ".join(f"f.{c}" for c in APP_COLUMNS.split(", "))
+
+# LocalFoodDatabase.searchFoods
+FTS_SEARCH_SQL = f"""
+    SELECT {_FTS_COLUMNS}
+    FROM foods f
+    JOIN foods_fts fts ON f.fdcId = fts.rowid
+    WHERE foods_fts MATCH ?
+    ORDER BY (f.brand IS NULL OR f.brand = '') DESC, f.isCommon DESC, rank
+    LIMIT ?
+"""
+
+# LocalFoodDatabase.searchFoodsLike
+LIKE_SEARCH_SQL = f"""
+    SELECT {APP_COLUMNS}
+    FROM foods
+    WHERE name LIKE ? OR brand LIKE ?
+    ORDER BY (brand IS NULL OR brand = '') DESC,
+             isCommon DESC,
+             CASE WHEN LOWER(name) = LOWER(?) THEN 0
+                  WHEN LOWER(name) LIKE LOWER(? || '%') THEN 1
+                  ELSE 2 END,
+             name
+    LIMIT ?
+"""
+
+# LocalFoodDatabase.getFoodById / getCommonFoods / getFoodCount
+FOOD_BY_ID_SQL = f"SELECT {APP_COLUMNS} FROM foods WHERE fdcId = ?"
+COMMON_FOODS_SQL = f"SELECT {APP_COLUMNS} FROM foods WHERE isCommon = 1 ORDER BY name LIMIT ?"
+FOOD_COUNT_SQL = "SELECT COUNT(*) FROM foods"
+
+DEFAULT_LIMIT = 50
+COMMON_LIMIT = 20
+
+QUERY_KINDS = ("prefix", "multiword", "typo", "infix", "brand", "by_id", "common")
+SEARCH_KINDS = ("prefix", "multiword", "typo", "infix", "brand")
+# Share of the generated corpus per kind.
+KIND_WEIGHTS = {
+    "prefix": 40, "multiword": 20, "typo": 15, "infix": 10, "brand": 10, "by_id": 3, "common": 2,
+}
+
+
+def fts_query(query: str) -> str:
+    """The app's FTS5 query string: every word becomes a quoted prefix term."""
+    return " ".join(f'"{word}"*' for word in query.split())
+
+
+class SearchStage(NamedTuple):
+    """
+    One step of a search. The first stage that returns rows wins.
+
+    `params(query, limit)` binds `sql`. `candidates_sql`, bound with
+    `candidate_params(conn, query)`, counts the rows the stage's index lookup visits;
+    it's only used when the stage's plan doesn't scan all of foods. A stage
+    with `applies` is skipped for queries it returns False for. A stage
+    with `fetch(conn, query, limit)` runs that instead of executing `sql`
+    (`sql` is then only used for its query plan).
+    """
+    name: str
+    sql: str
+    params: Callable[[str, int], tuple]
+    candidates_sql: Optional[str] = None
+    candidate_params: Optional[Callable[[sqlite3.Connection, str], tuple]] = None
+    applies: Optional[Callable[[str], bool]] = None
+    fetch: Optional[Callable[[sqlite3.Connection, str, int], list]] = None
+
+
+FTS_STAGE = SearchStage(
+    "fts",
+    FTS_SEARCH_SQL,
+    lambda q, limit: (fts_query(q), limit),
+    "SELECT COUNT(*) FROM foods_fts WHERE foods_fts MATCH ?",
+    lambda conn, q: (fts_query(q),),
+)
+LIKE_STAGE = SearchStage(
+    "like",
+    LIKE_SEARCH_SQL,
+    lambda q, limit: (f"%{q}%", f"%{q}%", q, q, limit),
+)
+# What LocalFoodDatabase.searchFoods does today.
+APP_SEARCH = (FTS_STAGE, LIKE_STAGE)
+
+# The LIKE fallback answered from foods_trigram (build_food_database.py
+# --trigram) instead of a scan: same ORDER BY, but the WHERE is a trigram
+# substring match on name/brand, which is what `LIKE '%q%'` tests. Trigram
+# matches need at least 3 characters, so shorter queries keep the LIKE scan.
+TRIGRAM_SEARCH_SQL = LIKE_SEARCH_SQL.replace(
+    "WHERE name LIKE ? OR brand LIKE ?",
+    "WHERE fdcId IN (SELECT rowid FROM foods_trigram WHERE foods_trigram MATCH ?)",
+)
+TRIGRAM_MIN_CHARS = 3
+
+
+def trigram_query(query: str) -> str:
+    """`query` as one quoted FTS5 string, i.e. a substring match under the trigram tokenizer."""
+    return '"' + query.replace('"', '""') + '"'
+
+
+TRIGRAM_STAGE = SearchStage(
+    "trigram",
+    TRIGRAM_SEARCH_SQL,
+    lambda q, limit: (trigram_query(q), q, q, limit),
+    "SELECT COUNT(*) FROM foods_trigram WHERE foods_trigram MATCH ?",
+    lambda conn, q: (trigram_query(q),),
+    lambda q: len(q) >= TRIGRAM_MIN_CHARS,
+)
+TRIGRAM_SEARCH = (
+    FTS_STAGE,
+    TRIGRAM_STAGE,
+    LIKE_STAGE._replace(applies=lambda q: len(q) < TRIGRAM_MIN_CHARS),
+)
+
+# The app's ranked search using foods.priority (build_food_database.py).
+# `priority >> 5` is (generic, isCommon), the app's ORDER BY ahead of rank,
+# so the order is unchanged. The FTS MATCH runs twice. The first pass joins
+# every match to foods by rowid (fdcId is the INTEGER PRIMARY KEY) and sorts
+# the tiers in a temp b-tree, without computing rank, to find the tier of
+# the LIMIT-th row. The second pass computes bm25 and sorts only matches in
+# that tier or above. A final small sort orders the LIMIT rows after their
+# columns are read. That saves the most for broad prefixes, where most
+# matches fall below the cutoff tier. For narrow queries the extra MATCH
+# makes it slightly slower than the app's single pass (see
+# build_food_database.py --compare-ranked-search).
+RANKED_SEARCH_SQL = f"""
+    WITH tiers AS (
+        SELECT p.priority >> 5 AS tier
+        FROM foods_fts fts JOIN foods p ON p.fdcId = fts.rowid
+        WHERE foods_fts MATCH ?1
+    ),
+    cutoff AS (
+        SELECT COALESCE((SELECT tier FROM tiers ORDER BY tier DESC LIMIT 1 OFFSET ?2 - 1), 0) AS tier
+    ),
+    top AS (
+        SELECT fts.rowid AS id, p.priority >> 5 AS tier, fts.rank AS score
+        FROM foods_fts fts JOIN foods p ON p.fdcId = fts.rowid
+        WHERE foods_fts MATCH ?1 AND p.priority >> 5 >= (SELECT tier FROM cutoff)
+        ORDER BY tier DESC, score
+        LIMIT ?2
+    )
+    SELECT {_FTS_COLUMNS}
+    FROM top JOIN foods f ON f.fdcId = top.id
+    ORDER BY top.tier DESC, top.score
+"""
+RANKED_STAGE = FTS_STAGE._replace(name="ranked", sql=RANKED_SEARCH_SQL)
+RANKED_SEARCH = (RANKED_STAGE, LIKE_STAGE)
+
+
+# Precomputed typeahead (build_food_database.py --typeahead): one row per
+# name/brand token prefix, holding the top-k fdcIds of the ranked search for
+# `"prefix"*` as a packed little-endian uint32 blob. Single-token ASCII
+# queries whose prefix made the size budget are answered with one primary
+# key lookup plus k rowid fetches; everything else goes to FTS as before.
+TYPEAHEAD_LOOKUP_SQL = "SELECT ids FROM typeahead WHERE prefix = ?"
+_TYPEAHEAD_KEY_RE = re.compile(r"[a-z0-9]+")
+
+
+def typeahead_key(query: str) -> Optional[str]:
+    """The typeahead.prefix to look `query` up under, or None if only FTS can answer it."""
+    key = query.strip().lower()
+    return key if _TYPEAHEAD_KEY_RE.fullmatch(key) else None
+
+
+def pack_ids(ids: list) -> bytes:
+    return struct.pack(f"<{len(ids)}I", *ids)
+
+
+def unpack_ids(blob: bytes) -> tuple:
+    return struct.unpack(f"<{len(blob) // 4}I", blob)
+
+
+def typeahead_search(conn: sqlite3.Connection, query: str, limit: int = DEFAULT_LIMIT) -> list:
+    """App-column rows for `query` from the typeahead table, in ranked order ([] if the prefix isn't stored)."""
+    row = conn.execute(TYPEAHEAD_LOOKUP_SQL, (typeahead_key(query),)).fetchone()
+    if not row:
+        return []
+    ids = unpack_ids(row[0])[:limit]
+    placeholders = ", ".join("?" * len(ids))
+    rows = conn.execute(f"SELECT {APP_COLUMNS} FROM foods WHERE fdcId IN ({placeholders})", ids).fetchall()
+    position = {fdc_id: i for i, fdc_id in enumerate(ids)}
+    rows.sort(key=lambda r: position[r[0]])
+    return rows
+
+
+TYPEAHEAD_STAGE = SearchStage(
+    "typeahead",
+    TYPEAHEAD_LOOKUP_SQL,
+    lambda q, limit: (typeahead_key(q),),
+    "SELECT length(ids) / 4 FROM typeahead WHERE prefix = ?",
+    lambda conn, q: (typeahead_key(q),),
+    lambda q: typeahead_key(q) is not None,
+    typeahead_search,
+)
+TYPEAHEAD_SEARCH = (TYPEAHEAD_STAGE, RANKED_STAGE, LIKE_STAGE)
+
+
+# "Did you mean" (build_food_database.py --spelling): a SymSpell index over
+# the FTS vocabulary. spell_terms holds every term with its document
+# frequency; spell_deletes maps each string reachable by deleting up to
+# max_edit_distance characters from a term's first prefix_length characters
+# to the ids of those terms (packed uint32, as in typeahead). Correcting a
+# word is a handful of primary-key lookups on its own deletes, then an edit
+# distance check on the few candidates that share one.
+SPELL_WORD_RE = re.compile(r"[a-z]+")
+
+
+def spelling_deletes(word: str, max_distance: int) -> set:
+    """`word` plus every string made by deleting up to `max_distance` characters from it."""
+    result = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier if len(w) > 1 for i in range(len(w))}
+        result |= frontier
+    return result
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Optimal string alignment distance (adjacent swaps count 1), or max_distance + 1 if larger."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > max_distance:
+            return max_distance + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+def spelling_settings(conn: sqlite3.Connection) -> tuple:
+    """(max_edit_distance, prefix_length) the spelling tables were built with."""
+    return tuple(conn.execute(
+        "SELECT max_edit_distance, prefix_length FROM spell_settings"
+    ).fetchone())
+
+
+def suggest(conn: sqlite3.Connection, word: str, limit: int = 5, settings: Optional[tuple] = None) -> list:
+    """
+    Spelling suggestions for one word as [(term, distance, frequency)],
+    closest first, then most frequent. A known word returns itself at
+    distance 0. `settings` skips re-reading spell_settings per call.
+    """
+    word = word.lower()
+    max_distance, prefix_length = settings or spelling_settings(conn)
+    known = conn.execute("SELECT term, freq FROM spell_terms WHERE term = ?", (word,)).fetchone()
+    if known:
+        return [(known[0], 0, known[1])]
+
+    keys = list(spelling_deletes(word[:prefix_length], max_distance))
+    placeholders = ", ".join("?" * len(keys))
+    ids = set()
+    for (blob,) in conn.execute(f"SELECT term_ids FROM spell_deletes WHERE del IN ({placeholders})", keys):
+        ids.update(unpack_ids(blob))
+    if not ids:
+        return []
+    ids = list(ids)
+    placeholders = ", ".join("?" * len(ids))
+    found = []
+    for term, freq in conn.execute(f"SELECT term, freq FROM spell_terms WHERE id IN ({placeholders})", ids):
+        distance = edit_distance(word, term, max_distance)
+        if distance <= max_distance:
+            found.append((term, distance, freq))
+    found.sort(key=lambda t: (t[1], -t[2], t[0]))
+    return found[:limit]
+
+
+def did_you_mean(conn: sqlite3.Connection, query: str, settings: Optional[tuple] = None) -> Optional[str]:
+    """`query` with every misspelled word replaced by its best suggestion, or None if nothing changed."""
+    settings = settings or spelling_settings(conn)
+    words = query.lower().split()
+    corrected = []
+    for word in words:
+        if SPELL_WORD_RE.fullmatch(word):
+            suggestions = suggest(conn, word, 1, settings)
+            corrected.append(suggestions[0][0] if suggestions else word)
+        else:
+            corrected.append(word)
+    return " ".join(corrected) if corrected != words else None
+
+
+def spelling_search(conn: sqlite3.Connection, query: str, limit: int = DEFAULT_LIMIT) -> list:
+    """The app's FTS search for the did_you_mean() correction of `query` ([] if there is none)."""
+    corrected = did_you_mean(conn, query)
+    if corrected is None:
+        return []
+    return conn.execute(FTS_SEARCH_SQL, (fts_query(corrected), limit)).fetchall()
+
+
+SPELL_STAGE = SearchStage(
+    "spelling",
+    "SELECT term_ids FROM spell_deletes WHERE del = ?",
+    lambda q, limit: (q.lower(),),
+    "SELECT COUNT(*) FROM foods_fts WHERE foods_fts MATCH ?",
+    lambda conn, q: (fts_query(did_you_mean(conn, q) or ""),),
+    fetch=spelling_search,
+)
+# FTS, then FTS for the corrected spelling, and only then the LIKE scan:
+# typos are answered from indexes instead of scanning foods.
+SPELL_SEARCH = (FTS_STAGE, SPELL_STAGE, LIKE_STAGE)
+
+STAGE_SETS = {
+    "app": APP_SEARCH,
+    "trigram": TRIGRAM_SEARCH,
+    "ranked": RANKED_SEARCH,
+    "typeahead": TYPEAHEAD_SEARCH,
+    "spelling": SPELL_SEARCH,
+}
+
+
+def _applies(stage: SearchStage, query: str) -> bool:
+    return stage.applies is None or stage.applies(query)
+
+
+def search_foods(conn: sqlite3.Connection, query: str, limit: int = DEFAULT_LIMIT,
+                 stages: tuple = APP_SEARCH) -> tuple:
+    """Run `query` through `stages` like the app does. Returns (rows, index of the stage that answered)."""
+    query = query.strip()
+    if not query:
+        return [], None
+    applicable = [i for i, stage in enumerate(stages) if _applies(stage, query)]
+    for i in applicable:
+        stage = stages[i]
+        try:
+            if stage.fetch:
+                rows = stage.fetch(conn, query, limit)
+            else:
+                rows = conn.execute(stage.sql, stage.params(query, limit)).fetchall()
+        except sqlite3.OperationalError:
+            # e.g. an FTS syntax error; the app treats it as no results.
+            rows = []
+        if rows or i == applicable[-1]:
+            return rows, i
+    return [], None
+
+
+# ---------------------------------------------------------------------------
+# Query plans
+# ---------------------------------------------------------------------------
+
+# Category browse and brand filter run in memory in the app today; they are
+# registered so the schema keeps them index-ordered when they move to SQL.
+# There is no barcode column (FoodItem.barcode is always nil for bundled
+# foods), so fdcId is the only key lookup.
+CATEGORY_BROWSE_SQL = f"SELECT {APP_COLUMNS} FROM foods WHERE category = ? ORDER BY name LIMIT ?"
+BRAND_FILTER_SQL = f"SELECT {APP_COLUMNS} FROM foods WHERE brand = ? ORDER BY name LIMIT ?"
+
+PLAN_SCAN = "scan"
+PLAN_TEMP_BTREE = "temp-btree"
+_SCAN_FOODS_RE = re.compile(r"SCAN (foods|f)\b")
+_PLAN_INDEX_RE = re.compile(r"USING (?:COVERING )?INDEX (\w+)")
+
+
+class AppQuery(NamedTuple):
+    """A query the app (or a search stage) runs, checked by the build's query-plan gate."""
+    name: str
+    sql: str
+    params: tuple
+    # Plan problems the query has by design, e.g. the LIKE fallback's scan.
+    allow: tuple = ()
+    # Table the query needs; the check is skipped when the build has none.
+    requires: Optional[str] = None
+    note: str = ""
+
+
+APP_QUERIES = (
+    AppQuery("search", FTS_SEARCH_SQL, (fts_query("chicken bre"), DEFAULT_LIMIT), allow=(PLAN_TEMP_BTREE,),
+             note="ORDER BY rank sorts the FTS matches"),
+    AppQuery("search_like", LIKE_SEARCH_SQL, LIKE_STAGE.params("icke", DEFAULT_LIMIT),
+             allow=(PLAN_SCAN, PLAN_TEMP_BTREE), note="fallback scan; --trigram replaces it"),
+    AppQuery("food_by_id", FOOD_BY_ID_SQL, (1,)),
+    AppQuery("common_foods", COMMON_FOODS_SQL, (COMMON_LIMIT,)),
+    AppQuery("food_count", FOOD_COUNT_SQL, (), allow=(PLAN_SCAN,),
+             note="COUNT(*) walks the smallest index"),
+    AppQuery("category_browse", CATEGORY_BROWSE_SQL, ("Dairy", DEFAULT_LIMIT)),
+    AppQuery("brand_filter", BRAND_FILTER_SQL, ("Starbucks", DEFAULT_LIMIT)),
+    AppQuery("search_ranked", RANKED_SEARCH_SQL, (fts_query("chicken bre"), DEFAULT_LIMIT),
+             allow=(PLAN_TEMP_BTREE,), note="tier and rank ordering sort the FTS matches"),
+    AppQuery("search_trigram", TRIGRAM_SEARCH_SQL, TRIGRAM_STAGE.params("icke", DEFAULT_LIMIT),
+             allow=(PLAN_TEMP_BTREE,), requires="foods_trigram", note="sorts the trigram matches"),
+    AppQuery("typeahead", TYPEAHEAD_LOOKUP_SQL, ("chi",), requires="typeahead"),
+    AppQuery("spelling", SPELL_STAGE.sql, ("chiken",), requires="spell_deletes"),
+)
+
+
+def query_plan(conn: sqlite3.Connection, sql: str, params: tuple) -> list:
+    """EXPLAIN QUERY PLAN detail lines for a statement."""
+    return [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+def partial_indexes(conn: sqlite3.Connection) -> set:
+    """Names of indexes with a WHERE clause."""
+    return {name for name, sql in conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index'")
+            if sql and " WHERE " in sql.upper()}
+
+
+def plan_problems(plan: list, partial: set = frozenset()) -> list:
+    """
+    (problem, detail) for every full scan of foods and every temp b-tree in a
+    plan. Walking a partial index only visits the rows it keeps, so that is
+    not counted as a scan.
+    """
+    problems = []
+    for detail in plan:
+        index = _PLAN_INDEX_RE.search(detail)
+        if (_SCAN_FOODS_RE.match(detail) and "VIRTUAL TABLE" not in detail
+                and not (index and index.group(1) in partial)):
+            problems.append((PLAN_SCAN, detail))
+        if "USE TEMP B-TREE" in detail:
+            problems.append((PLAN_TEMP_BTREE, detail))
+    return problems
+
+
+def check_plans(conn: sqlite3.Connection, queries: tuple = APP_QUERIES) -> list:
+    """
+    Plan every registered query. Each result has the plan lines, the problems
+    found, and a status: "ok", "allowed" (only problems the query declares),
+    "violation", or "skipped" (the table it needs was not built).
+    """
+    tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    partial = partial_indexes(conn)
+    results = []
+    for query in queries:
+        result = {"name": query.name, "sql": " ".join(query.sql.split()), "note": query.note}
+        if query.requires and query.requires not in tables:
+            results.append({**result, "status": "skipped", "plan": [], "problems": []})
+            continue
+        plan = query_plan(conn, query.sql, query.params)
+        problems = plan_problems(plan, partial)
+        if any(kind not in query.allow for kind, _ in problems):
+            status = "violation"
+        else:
+            status = "allowed" if problems else "ok"
+        results.append({**result, "status": status, "plan": plan,
+                        "problems": [{"kind": kind, "detail": detail} for kind, detail in problems]})
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Query corpus
+# ---------------------------------------------------------------------------
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _typo(word: str, rng: random.Random) -> str:
+    """Apply one random edit to `word`."""
+    if len(word) < 2:
+        return word + rng.choice(string.ascii_lowercase)
+    i = rng.randrange(len(word))
+    edit = rng.choice(("delete", "insert", "substitute", "swap"))
+    if edit == "delete":
+        return word[:i] + word[i + 1:]
+    if edit == "insert":
+        return word[:i] + rng.choice(string.ascii_lowercase) + word[i:]
+    if edit == "substitute":
+        return word[:i] + rng.choice(string.ascii_lowercase.replace(word[i], "")) + word[i + 1:]
+    i = min(i, len(word) - 2)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def generate_corpus(conn: sqlite3.Connection, size: int = 5000, seed: int = 0) -> list:
+    """
+    Build `size` [kind, query] pairs from the names and brands in `conn`.
+
+    by_id queries hold the fdcId as a string; common queries are empty.
+    The same database and seed always give the same corpus.
+    """
+    rng = random.Random(seed)
+    rows = conn.execute("SELECT fdcId, name, brand FROM foods ORDER BY fdcId").fetchall()
+    if not rows:
+        return []
+    brands = sorted({brand for _, _, brand in rows if brand})
+    kinds = rng.choices(list(KIND_WEIGHTS), weights=list(KIND_WEIGHTS.values()), k=size)
+
+    corpus = []
+    for kind in kinds:
+        fdc_id, name, _ = rng.choice(rows)
+        words = _WORD_RE.findall(name.lower()) or ["a"]
+        word = rng.choice(words)
+        if kind == "prefix":
+            query = word[:rng.randint(1, len(word))]
+        elif kind == "multiword":
+            n = min(len(words), rng.randint(2, 3))
+            start = rng.randrange(len(words) - n + 1)
+            phrase = words[start:start + n]
+            phrase[-1] = phrase[-1][:rng.randint(1, len(phrase[-1]))]
+            query = " ".join(phrase)
+        elif kind == "typo":
+            long_words = [w for w in words if len(w) >= 4]
+            query = _typo(rng.choice(long_words), rng) if long_words else _typo(word, rng)
+        elif kind == "infix":
+            if len(word) >= 4:
+                start = rng.randint(1, len(word) - 3)
+                query = word[start:rng.randint(start + 2, len(word) - 1) + 1]
+            else:
+                query = word
+        elif kind == "brand":
+            brand = rng.choice(brands) if brands else name
+            query = brand.lower()[:rng.randint(2, max(2, len(brand)))].strip() or brand.lower()
+        elif kind == "by_id":
+            query = str(fdc_id)
+        else:
+            query = ""
+        corpus.append([kind, query])
+    return corpus
+
+
+def generate_typo_corpus(conn: sqlite3.Connection, size: int = 2000, seed: int = 0) -> list:
+    """
+    `size` [typo, intended word] pairs: one random edit applied to a word of
+    4+ letters taken from a random food name.
+    """
+    rng = random.Random(seed)
+    names = [name for (name,) in conn.execute("SELECT name FROM foods ORDER BY fdcId")]
+    corpus = []
+    while names and len(corpus) < size:
+        words = [w for w in _WORD_RE.findall(rng.choice(names).lower()) if len(w) >= 4 and w.isalpha()]
+        if not words:
+            continue
+        word = rng.choice(words)
+        typo = _typo(word, rng)
+        if typo != word:
+            corpus.append([typo, word])
+    return corpus
+
+
+def corpus_digest(corpus: list) -> str:
+    return hashlib.sha256(json.dumps(corpus, separators=(",", ":")).encode()).hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# Replay
+# ---------------------------------------------------------------------------
+
+def run_query(conn: sqlite3.Connection, kind: str, query: str, limit: int = DEFAULT_LIMIT,
+              stages: tuple = APP_SEARCH) -> tuple:
+    """Run one corpus entry the way the app would. Returns (rows, stage index or None)."""
+    if kind == "by_id":
+        return conn.execute(FOOD_BY_ID_SQL, (int(query),)).fetchall(), None
+    if kind == "common":
+        return conn.execute(COMMON_FOODS_SQL, (COMMON_LIMIT,)).fetchall(), None
+    return search_foods(conn, query, limit, stages)
+
+
+def scans_foods(conn: sqlite3.Connection, sql: str, params: tuple) -> bool:
+    """True if the statement's query plan walks every row of foods."""
+    return any(kind == PLAN_SCAN for kind, _ in plan_problems(query_plan(conn, sql, params)))
+
+
+class _WorkCounter:
+    """Counts SQLite VM instructions through the progress handler."""
+
+    GRANULARITY = 100
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.ticks = 0
+
+    def _tick(self):
+        self.ticks += 1
+        return 0
+
+    def __enter__(self):
+        self.conn.set_progress_handler(self._tick, self.GRANULARITY)
+        return self
+
+    def __exit__(self, *exc):
+        self.conn.set_progress_handler(None, 0)
+
+    @property
+    def steps(self) -> int:
+        return self.ticks * self.GRANULARITY
+
+
+def measure_work(conn: sqlite3.Connection, kind: str, query: str, limit: int, stages: tuple,
+                 total_rows: int, plan_cache: dict) -> tuple:
+    """
+    (rows_scanned, vm_steps) for one corpus entry.
+
+    rows_scanned counts every row of foods for a stage whose plan scans the
+    table, and the index candidates (e.g. FTS matches, all of which are
+    joined and sorted before LIMIT) otherwise. by_id visits the one row it
+    returns; common reads every isCommon row to sort it by name.
+    """
+    with _WorkCounter(conn) as counter:
+        rows, answered = run_query(conn, kind, query, limit, stages)
+    if kind == "common":
+        if "common" not in plan_cache:
+            plan_cache["common"] = scans_foods(conn, COMMON_FOODS_SQL, (COMMON_LIMIT,))
+        if plan_cache["common"]:
+            return total_rows, counter.steps
+        # Every common food is read and sorted by name before LIMIT.
+        return conn.execute("SELECT COUNT(*) FROM foods WHERE isCommon = 1").fetchone()[0], counter.steps
+    if answered is None:
+        return len(rows), counter.steps
+
+    scanned = 0
+    q = query.strip()
+    for stage in stages[:answered + 1]:
+        if not _applies(stage, q):
+            continue
+        params = stage.params(q, limit)
+        if stage.name not in plan_cache:
+            try:
+                plan_cache[stage.name] = scans_foods(conn, stage.sql, params)
+            except sqlite3.OperationalError:
+                continue
+        if plan_cache[stage.name]:
+            scanned += total_rows
+        elif stage.candidates_sql:
+            try:
+                row = conn.execute(stage.candidates_sql, stage.candidate_params(conn, q)).fetchone()
+            except sqlite3.OperationalError:
+                continue
+            scanned += row[0] if row else 0
+    return scanned, counter.steps
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(samples: list) -> dict:
+    """Latency/work summary for a list of per-query samples."""
+    latencies = sorted(s["ms"] for s in samples)
+    scanned = sorted(s["rows_scanned"] for s in samples)
+    searches = [s for s in samples if s["stage"] is not None]
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(latencies, 50), 4),
+        "p95_ms": round(percentile(latencies, 95), 4),
+        "p99_ms": round(percentile(latencies, 99), 4),
+        "mean_ms": round(sum(latencies) / len(latencies), 4) if latencies else 0.0,
+        "max_ms": round(latencies[-1], 4) if latencies else 0.0,
+        "rows_scanned_mean": round(sum(scanned) / len(scanned), 1) if scanned else 0.0,
+        "rows_scanned_p95": percentile(scanned, 95),
+        "vm_steps_mean": round(sum(s["vm_steps"] for s in samples) / len(samples)) if samples else 0,
+        "fallback_rate": round(sum(1 for s in searches if s["stage"] > 0) / len(searches), 4) if searches else 0.0,
+        "empty_rate": round(sum(1 for s in samples if s["rows"] == 0) / len(samples), 4) if samples else 0.0,
+    }
+
+
+def replay(conn: sqlite3.Connection, corpus: list, limit: int = DEFAULT_LIMIT, repeat: int = 1,
+           warmup: int = 500, stages: tuple = APP_SEARCH, measure: bool = True) -> list:
+    """
+    Time every corpus entry (best of `repeat`), then measure its work in a
+    separate untimed pass so the counters don't distort latency (skipped,
+    and reported as 0, with measure=False). Returns one sample dict per entry.
+    """
+    for kind, query in corpus[:warmup]:
+        run_query(conn, kind, query, limit, stages)
+
+    total_rows = conn.execute(FOOD_COUNT_SQL).fetchone()[0]
+    plan_cache = {}
+    samples = []
+    for kind, query in corpus:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows, answered = run_query(conn, kind, query, limit, stages)
+            best = min(best, time.perf_counter() - start)
+        scanned, steps = 0, 0
+        if measure:
+            scanned, steps = measure_work(conn, kind, query, limit, stages, total_rows, plan_cache)
+        samples.append({
+            "kind": kind,
+            "query": query,
+            "ms": best * 1000,
+            "rows": len(rows),
+            "stage": answered,
+            "rows_scanned": scanned,
+            "vm_steps": steps,
+        })
+    return samples
+
+
+def run_benchmark(db_path: Path, corpus: Optional[list] = None, queries: int = 5000, seed: int = 0,
+                  limit: int = DEFAULT_LIMIT, repeat: int = 1, stages: tuple = APP_SEARCH) -> dict:
+    """Replay a corpus (generated from the database if not given) and return the JSON report."""
+    db_path = Path(db_path)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        if corpus is None:
+            corpus = generate_corpus(conn, queries, seed)
+        samples = replay(conn, corpus, limit, repeat, stages=stages)
+        food_count = conn.execute(FOOD_COUNT_SQL).fetchone()[0]
+    finally:
+        conn.close()
+
+    by_kind = {kind: summarize([s for s in samples if s["kind"] == kind])
+               for kind in QUERY_KINDS if any(s["kind"] == kind for s in samples)}
+    return {
+        "database": str(db_path),
+        "size_bytes": db_path.stat().st_size,
+        "foods": food_count,
+        "sqlite_version": sqlite3.sqlite_version,
+        "stages": [stage.name for stage in stages],
+        "limit": limit,
+        "repeat": repeat,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "corpus_sha256": corpus_digest(corpus),
+        "summary": {
+            "search": summarize([s for s in samples if s["kind"] in SEARCH_KINDS]),
+            **by_kind,
+        },
+        "corpus": corpus,
+    }
+
+
+def print_report(report: dict):
+    size_mb = report["size_bytes"] / (1024 * 1024)
+    print(f"\n  {report['database']} ({size_mb:.1f} MB, {report['foods']:,} foods, "
+          f"SQLite {report['sqlite_version']}, stages {'+'.join(report['stages'])})")
+    print(f"  corpus {len(report['corpus']):,} queries, sha256 {report['corpus_sha256'][:12]}...")
+    print(f"\n    {'kind':<10} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'rows scanned':>13} {'fallback':>9} {'empty':>7}")
+    for kind, s in report["summary"].items():
+        print(f"    {kind:<10} {s['count']:>6} {s['p50_ms']:>9.3f} {s['p95_ms']:>9.3f} {s['p99_ms']:>9.3f} "
+              f"{s['rows_scanned_mean']:>13,.0f} {s['fallback_rate']:>8.1%} {s['empty_rate']:>6.1%}")
+
+
+def compare_reports(base: dict, new: dict):
+    """Print new vs base latency and work per kind."""
+    if base["corpus_sha256"] != new["corpus_sha256"]:
+        print("  WARNING: the two reports replayed different corpora; pass --corpus to reuse one.")
+    print(f"\n  base: {base['database']} ({base['size_bytes'] / (1024 * 1024):.1f} MB)")
+    print(f"  new:  {new['database']} ({new['size_bytes'] / (1024 * 1024):.1f} MB)")
+    print(f"\n    {'kind':<10} {'p50 ms':>17} {'p95 ms':>17} {'p99 ms':>17} {'rows scanned':>21}")
+    for kind, b in base["summary"].items():
+        n = new["summary"].get(kind)
+        if not n:
+            continue
+        cells = []
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            ratio = b[key] / n[key] if n[key] else float("inf")
+            cells.append(f"{n[key]:>8.3f} (x{ratio:5.2f})")
+        cells.append(f"{b['rows_scanned_mean']:>9,.0f} -> {n['rows_scanned_mean']:>9,.0f}")
+        print(f"    {kind:<10} " + " ".join(cells))
+
+
+def load_report(path: Path) -> dict:
+    return json.loads(Path(path).read_text())
+
+
+def cmd_run(args) -> int:
+    corpus = None
+    if args.corpus:
+        corpus = load_report(args.corpus)["corpus"]
+    report = run_benchmark(Path(args.database), corpus, args.queries, args.seed, args.limit, args.repeat,
+                           STAGE_SETS[args.stages])
+    print_report(report)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=1))
+        print(f"\n  Results: {args.output}")
+    return 0
+
+
+def cmd_compare(args) -> int:
+    compare_reports(load_report(args.base), load_report(args.new))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the iOS app's search SQL against food_database.sqlite")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="replay a query corpus and report latency percentiles")
+    p.add_argument("database", help="Path to food_database.sqlite")
+    p.add_argument("--queries", type=int, default=5000, help="Generated corpus size (default: 5000)")
+    p.add_argument("--seed", type=int, default=0, help="Corpus generator seed")
+    p.add_argument("--corpus", help="Reuse the corpus stored in an earlier results JSON")
+    p.add_argument("--limit", type=int, default=DEFAULT_LIMIT, help="Search LIMIT (the app uses 50)")
+    p.add_argument("--repeat", type=int, default=1, help="Runs per query; the best time is kept")
+    p.add_argument("--stages", choices=list(STAGE_SETS), default="app",
+                   help="app: FTS then LIKE scan (today); trigram: FTS then foods_trigram (needs --trigram build); "
+                        "ranked: priority-tier FTS then LIKE; typeahead: prefix table, then ranked (needs --typeahead); "
+                        "spelling: FTS, then FTS on the did-you-mean correction, then LIKE (needs --spelling)")
+    p.add_argument("--output", help="Write the JSON results here")
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser("compare", help="compare two results JSON files")
+    p.add_argument("base")
+    p.add_argument("new")
+    p.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
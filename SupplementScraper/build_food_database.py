@@ -11,23 +11,46 @@ Downloads and processes:
 Output: food_database.sqlite (~10-15 MB) with FTS5 full-text search index.
 
 Usage:
-    python3 build_food_database.py
-
-The script will download USDA CSV files to a 'usda_data/' subdirectory,
-then build the SQLite database in the current directory.
+    python3 build_food_database.py [--extract] [--connections N] [--parquet-cache] [--workers N]
+                                   [--bulk-load {memory,tempfile}] [--fts-profile NAME]
+                                   [--compare-fts-profiles] [--trigram] [--compare-ranked-search]
+                                   [--typeahead [--typeahead-prefix-len N] [--typeahead-k K]
+                                                [--typeahead-budget-mb MB]]
+                                   [--spelling [--spell-distance N]] [--plan-gate {off,warn,fail}]
+                                   [--max-size-mb MB] [--top-brands N [--brand-weight {products,active}]]
+                                   [--brand-manifest PATH] [--incremental] [--reproducible] [--stage-cache]
+                                   [--profile REPORT.json [--profile-no-tracemalloc]]
+
+The script will download USDA CSV zips to a 'usda_data/' subdirectory and
+read the CSVs straight out of each zip (pass --extract to unpack them to disk
+first), then build the SQLite database in the current directory.
 """
 
+import argparse
+import atexit
+import bisect
 import csv
+import hashlib
+import heapq
+import inspect
 import io
 import json
+import math
 import os
 import re
 import sqlite3
 import sys
+import tempfile
+import time
+import unicodedata
 import zipfile
-from collections import defaultdict
-from pathlib import Path
-from typing import Optional
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import accumulate
+from pathlib import Path, PurePosixPath
+from typing import NamedTuple, Optional
 
 try:
     import requests
@@ -36,12 +59,33 @@ except ImportError:
     os.system(f"{sys.executable} -m pip install requests")
     import requests
 
+import benchmark_search
+import build_profile
+import food_delta
+from downloader import MANIFEST_NAME, DownloadError, download, forget, load_manifest, save_manifest, sha256_file
+
+try:
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:
+    print("Installing numpy and pyarrow...")
+    os.system(f"{sys.executable} -m pip install numpy pyarrow")
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+
 # ---------------------------------------------------------------------------
 # Configuration
 # ---------------------------------------------------------------------------
 
 DATA_DIR = Path(__file__).parent / "usda_data"
 OUTPUT_DB = Path(__file__).parent / "food_database.sqlite"
+PARQUET_CACHE_DIR = DATA_DIR / "parquet_cache"
 
 # USDA FoodData Central CSV download URLs
 # https://fdc.nal.usda.gov/download-datasets/
@@ -105,12 +149,20 @@ ADDITIONAL_NUTRIENT_KEYS = {
     "copper", "manganese", "selenium",
 }
 
+# Column layout of the dense nutrient matrix (see NutrientTable), in
+# NUTRIENT_IDS order.
+NUTRIENT_KEYS = tuple(NUTRIENT_IDS.values())
+NUTRIENT_COLUMNS = {key: i for i, key in enumerate(NUTRIENT_KEYS)}
+ADDITIONAL_NUTRIENT_COLUMNS = [(key, i) for i, key in enumerate(NUTRIENT_KEYS) if key in ADDITIONAL_NUTRIENT_KEYS]
+
 # Top brand owners to include from Branded Foods
-# This keeps the database manageable while covering most popular items
+# This keeps the database manageable while covering most popular items.
+# Entries are matched by canonical_brand, so spelling and legal-suffix
+# variants ("McDonald's Corporation", "MCDONALD'S CORP.") need no entry.
 TOP_BRAND_OWNERS = {
     # Fast Food / Restaurants
-    "McDonald's Corporation", "McDonald's", "Starbucks", "Starbucks Coffee Company",
-    "Subway", "Chick-fil-A, Inc.", "Chick-fil-A", "Taco Bell Corp.", "Taco Bell",
+    "McDonald's", "Starbucks", "Starbucks Coffee Company",
+    "Subway", "Chick-fil-A", "Taco Bell",
     "Wendy's International, Inc.", "Wendy's", "Burger King", "Domino's",
     "Pizza Hut", "KFC", "Chipotle Mexican Grill", "Panera Bread",
     "Dunkin' Donuts", "Dunkin'", "Popeyes Louisiana Kitchen",
@@ -120,26 +172,26 @@ TOP_BRAND_OWNERS = {
     "Raising Cane's", "Whataburger",
 
     # Beverages
-    "The Coca-Cola Company", "Coca-Cola", "PepsiCo, Inc.", "PepsiCo",
-    "Red Bull", "Red Bull GmbH", "Monster Beverage Corporation", "Monster",
-    "Gatorade", "Starbucks Corporation", "Nestle Waters",
+    "Coca-Cola", "PepsiCo",
+    "Red Bull", "Monster Beverage Corporation", "Monster",
+    "Gatorade", "Nestle Waters",
     "Keurig Dr Pepper", "Dr Pepper", "Celsius Holdings, Inc.",
     "BODYARMOR", "Bai Brands LLC", "Vita Coco",
 
     # Dairy & Yogurt
-    "Chobani, LLC", "Chobani", "Dannon", "The Dannon Company, Inc.",
+    "Chobani", "Dannon",
     "Oikos", "Fage", "Siggi's", "Yoplait",
     "Organic Valley", "Horizon Organic", "Fairlife, LLC",
     "Tillamook County Creamery Association",
 
     # Cereal & Breakfast
-    "General Mills, Inc.", "General Mills", "Kellogg Company", "Kellogg's",
+    "General Mills", "Kellogg's",
     "Post Holdings, Inc.", "Post", "Quaker Oats Company", "Quaker",
     "Nature's Path Foods",
 
     # Snacks & Chips
-    "Frito-Lay", "Frito-Lay, Inc.", "Lay's",
-    "Doritos", "Cheetos", "KIND LLC", "KIND",
+    "Frito-Lay", "Lay's",
+    "Doritos", "Cheetos", "KIND",
     "RXBAR", "Clif Bar & Company", "Clif", "LARABAR",
     "Nature Valley", "Wonderful Company", "Blue Diamond Growers",
     "Planters", "Skinny Pop",
@@ -155,13 +207,13 @@ TOP_BRAND_OWNERS = {
     "Beyond Meat, Inc.", "Impossible Foods Inc.",
 
     # Frozen Foods
-    "Nestlé", "Nestle", "Nestlé USA", "Amy's Kitchen",
+    "Nestlé", "Nestlé USA", "Amy's Kitchen",
     "Birds Eye", "Stouffer's", "Lean Cuisine",
-    "Trader Joe's", "Trader Joe's Company, Inc.",
+    "Trader Joe's",
     "Annie's Homegrown",
 
     # Condiments & Sauces
-    "The Kraft Heinz Company", "Kraft Heinz", "Kraft",
+    "Kraft Heinz", "Kraft",
     "Heinz", "Hellmann's", "Hidden Valley",
     "Frank's RedHot", "Sriracha", "Huy Fong Foods",
     "Newman's Own",
@@ -185,8 +237,40 @@ TOP_BRAND_OWNERS = {
     "Kirkland Signature",
 }
 
-# Normalize brand names for matching (lowercase, stripped)
-TOP_BRANDS_LOWER = {b.lower().strip() for b in TOP_BRAND_OWNERS}
+# Legal-entity words dropped from the end of a brand by canonical_brand.
+BRAND_LEGAL_SUFFIXES = {
+    "inc", "incorporated", "llc", "ltd", "limited", "corp", "corporation", "co", "company",
+    "companies", "plc", "lp", "llp", "gmbh", "ag", "sa", "nv", "bv", "srl", "pty",
+}
+_BRAND_POSSESSIVE_RE = re.compile(r"['\u2019`]s\b")
+_BRAND_APOSTROPHE_RE = re.compile(r"['\u2019`]")
+_BRAND_SEPARATOR_RE = re.compile(r"[^a-z0-9]+")
+
+
+@lru_cache(maxsize=1 << 17)
+def canonical_brand(brand: str) -> str:
+    """
+    Matching key for a brand owner or brand name: lowercase, possessive 's
+    and apostrophes removed, accents folded, other punctuation and runs of
+    whitespace turned into single spaces, then trailing legal suffixes
+    (BRAND_LEGAL_SUFFIXES) and a leading "the" dropped. "MCDONALD'S CORP."
+    and "McDonald's Corporation" both become "mcdonald". Cached, since
+    branded_food.csv repeats the same few thousand owners millions of times.
+    """
+    if not brand:
+        return ""
+    text = _BRAND_APOSTROPHE_RE.sub("", _BRAND_POSSESSIVE_RE.sub("", brand.lower()))
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    words = _BRAND_SEPARATOR_RE.sub(" ", text).split()
+    while len(words) > 1 and words[-1] in BRAND_LEGAL_SUFFIXES:
+        words.pop()
+    if len(words) > 1 and words[0] == "the":
+        words.pop(0)
+    return " ".join(words)
+
+
+# canonical_brand key -> TOP_BRAND_OWNERS entry, built once.
+TOP_BRAND_KEYS = {canonical_brand(b): b for b in sorted(TOP_BRAND_OWNERS)}
 
 # Common food terms for the isCommon flag
 COMMON_FOOD_TERMS = {
@@ -210,26 +294,24 @@ COMMON_FOOD_TERMS = {
 
 def is_common_food(name: str) -> bool:
     """Check if a food name matches common food terms."""
-    name_lower = name.lower()
-    for term in COMMON_FOOD_TERMS:
-        if term in name_lower:
-            return True
-    return False
+    return _COMMON_MATCHER.first(name.lower()) is not None
 
 
-def extras_json(nutr: dict) -> Optional[str]:
-    """Serialise vitamin/mineral keys (>0) from a nutrient dict as JSON, or None."""
-    extras = {k: v for k, v in nutr.items() if k in ADDITIONAL_NUTRIENT_KEYS and v and v > 0}
+def extras_json(values: Optional[list]) -> Optional[str]:
+    """Serialise vitamin/mineral values (>0) from a NutrientTable row as canonical (sorted, compact) JSON, or None."""
+    if values is None:
+        return None
+    extras = {k: values[i] for k, i in ADDITIONAL_NUTRIENT_COLUMNS if values[i] > 0}
     if not extras:
         return None
-    return json.dumps(extras, separators=(",", ":"))
+    return json.dumps(extras, separators=(",", ":"), sort_keys=True)
 
 
-def is_top_brand(brand_owner: str) -> bool:
-    """Check if a brand owner is in our top brands list."""
+def is_top_brand(brand_owner: str, top_brands=TOP_BRAND_KEYS) -> bool:
+    """Check if a brand owner is in our top brands list (or `top_brands`, a set of canonical_brand keys)."""
     if not brand_owner:
         return False
-    return brand_owner.lower().strip() in TOP_BRANDS_LOWER
+    return canonical_brand(brand_owner) in top_brands
 
 
 def clean_food_name(name: str) -> str:
@@ -245,80 +327,436 @@ def clean_food_name(name: str) -> str:
     return name
 
 
-def download_and_extract(data_type: str, url: str) -> Path:
-    """Download a USDA CSV zip file and extract it."""
+def download_and_extract(data_type: str, url: str, extract: bool = True, connections: int = 1) -> Path:
+    """
+    Download a USDA CSV zip file and, if `extract`, extract it.
+
+    Returns the directory to read CSVs from, or with extract=False the zip
+    itself: find_csv / open_csv_text read members straight out of the archive
+    so the multi-GB CSVs are never written to disk a second time.
+    Downloads resume after interruption and are SHA-256 checked (see
+    downloader.py); a corrupt zip is re-downloaded once.
+    """
     extract_dir = DATA_DIR / data_type
+    zip_path = DATA_DIR / f"{data_type}.zip"
+
     if extract_dir.exists() and any(extract_dir.glob("*.csv")):
         print(f"  [{data_type}] Already downloaded, skipping.")
         return extract_dir
 
-    zip_path = DATA_DIR / f"{data_type}.zip"
-
-    if not zip_path.exists():
-        print(f"  [{data_type}] Downloading from USDA...")
+    for attempt in range(2):
         try:
-            resp = requests.get(url, stream=True, timeout=300)
-            resp.raise_for_status()
-            total = int(resp.headers.get("content-length", 0))
-            downloaded = 0
-            with open(zip_path, "wb") as f:
-                for chunk in resp.iter_content(chunk_size=1024 * 1024):
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    if total > 0:
-                        pct = downloaded * 100 // total
-                        print(f"\r  [{data_type}] {pct}% ({downloaded // (1024*1024)} MB)", end="", flush=True)
-            print()
-        except Exception as e:
+            download(url, zip_path, connections=connections, label=data_type)
+        except DownloadError as e:
             print(f"\n  [{data_type}] Download failed: {e}")
-            if zip_path.exists():
-                zip_path.unlink()
             return extract_dir
 
-    print(f"  [{data_type}] Extracting...")
-    extract_dir.mkdir(parents=True, exist_ok=True)
-    try:
-        with zipfile.ZipFile(zip_path, "r") as zf:
-            zf.extractall(extract_dir)
-    except zipfile.BadZipFile:
-        print(f"  [{data_type}] Bad zip file, re-downloading...")
-        zip_path.unlink()
-        return download_and_extract(data_type, url)
+        start = time.perf_counter()
+        try:
+            with zipfile.ZipFile(zip_path, "r") as zf:
+                size = sum(info.file_size for info in zf.infolist())
+                if extract:
+                    print(f"  [{data_type}] Extracting...")
+                    extract_dir.mkdir(parents=True, exist_ok=True)
+                    zf.extractall(extract_dir)
+        except zipfile.BadZipFile:
+            print(f"  [{data_type}] Bad zip file, re-downloading...")
+            forget(zip_path)
+            continue
+
+        if not extract:
+            print(f"  [{data_type}] Streaming CSVs from zip: 0 MB written "
+                  f"({size / (1024 * 1024):.0f} MB extraction skipped).")
+            return zip_path
+        print(f"  [{data_type}] Extracted {size / (1024 * 1024):.0f} MB in {time.perf_counter() - start:.1f}s.")
+        return extract_dir
 
+    print(f"  [{data_type}] Still a bad zip file after re-downloading, skipping.")
     return extract_dir
 
 
-def find_csv(base_dir: Path, filename: str) -> Optional[Path]:
-    """Find a CSV file recursively in extracted directory."""
+class ZipMember(NamedTuple):
+    """A CSV inside a dataset zip, read in place without extracting it."""
+    zip_path: Path
+    name: str
+    size: int  # uncompressed bytes
+
+    def __str__(self) -> str:
+        return f"{self.zip_path}!{self.name}"
+
+
+def find_csv(base_dir: Path, filename: str):
+    """
+    Find a CSV file recursively in an extracted directory, or inside a dataset
+    zip when `base_dir` is a .zip. In a Parquet cache directory (see
+    build_parquet_cache) the cached `<name>.parquet` stands in for the CSV.
+    Returns a Path, a ZipMember, or None.
+    """
+    if base_dir.suffix == ".zip":
+        if not base_dir.is_file():
+            return None
+        with zipfile.ZipFile(base_dir, "r") as zf:
+            for info in zf.infolist():
+                if PurePosixPath(info.filename).name == filename:
+                    return ZipMember(base_dir, info.filename, info.file_size)
+        return None
+    cached = base_dir / (Path(filename).stem + ".parquet")
+    if cached.is_file():
+        return cached
     for path in base_dir.rglob(filename):
         return path
     return None
 
 
-def load_nutrients(base_dir: Path) -> dict:
-    """Load nutrient data from food_nutrient.csv. Returns {fdc_id: {nutrient_name: value}}."""
+def is_parquet(csv_ref) -> bool:
+    return isinstance(csv_ref, Path) and csv_ref.suffix == ".parquet"
+
+
+def csv_size(csv_ref) -> int:
+    """Uncompressed size in bytes of a CSV returned by find_csv."""
+    if isinstance(csv_ref, ZipMember):
+        return csv_ref.size
+    return csv_ref.stat().st_size
+
+
+@contextmanager
+def open_csv_binary(csv_ref):
+    """Open a CSV returned by find_csv for binary reading (pyarrow input)."""
+    if isinstance(csv_ref, ZipMember):
+        with zipfile.ZipFile(csv_ref.zip_path, "r") as zf, zf.open(csv_ref.name) as f:
+            yield f
+    else:
+        with open(csv_ref, "rb") as f:
+            yield f
+
+
+@contextmanager
+def open_csv_text(csv_ref):
+    """Open a CSV returned by find_csv as text for csv.DictReader."""
+    with open_csv_binary(csv_ref) as raw:
+        yield io.TextIOWrapper(raw, encoding="utf-8-sig")
+
+
+def iter_csv_rows(csv_ref, columns: Optional[list] = None):
+    """
+    Yield rows of a CSV returned by find_csv as dicts, like csv.DictReader.
+    From a Parquet cache only `columns` are read, and typed columns come back
+    as int/float (or None when empty) instead of strings.
+    """
+    if is_parquet(csv_ref):
+        parquet_file = pq.ParquetFile(csv_ref)
+        if columns is not None:
+            columns = [c for c in columns if c in parquet_file.schema_arrow.names]
+        for batch in parquet_file.iter_batches(columns=columns):
+            yield from batch.to_pylist()
+        return
+    with open_csv_text(csv_ref) as f:
+        yield from csv.DictReader(f)
+
+
+def iter_column_batches(csv_ref, column_types: dict, block_size: Optional[int] = None,
+                        newlines_in_values: bool = False):
+    """
+    Yield pyarrow RecordBatches holding only the columns in `column_types`,
+    cast to those types, from a CSV / zip member or a Parquet cache file.
+    """
+    columns = list(column_types)
+    if is_parquet(csv_ref):
+        for batch in pq.ParquetFile(csv_ref).iter_batches(columns=columns):
+            yield pa.RecordBatch.from_arrays(
+                [batch.column(c).cast(column_types[c]) for c in columns], names=columns)
+        return
+
+    read_options = pa_csv.ReadOptions(block_size=block_size) if block_size else pa_csv.ReadOptions()
+    with open_csv_binary(csv_ref) as raw, pa_csv.open_csv(
+            raw,
+            read_options=read_options,
+            parse_options=pa_csv.ParseOptions(newlines_in_values=newlines_in_values),
+            convert_options=pa_csv.ConvertOptions(include_columns=columns, column_types=column_types),
+    ) as reader:
+        yield from reader
+
+
+# CSVs mirrored into the Parquet cache, with the columns stored typed; every
+# other column is kept as a string so rows read back exactly as the CSV text.
+PARQUET_CACHE_TABLES = {
+    "food.csv": {"fdc_id": pa.int64(), "food_category_id": pa.int64()},
+    "food_nutrient.csv": {"id": pa.int64(), "fdc_id": pa.int64(), "nutrient_id": pa.int64(), "amount": pa.float64()},
+    "food_portion.csv": {"id": pa.int64(), "fdc_id": pa.int64(), "gram_weight": pa.float64()},
+    "branded_food.csv": {"fdc_id": pa.int64()},
+    "food_category.csv": {"id": pa.int64()},
+}
+
+
+def source_checksum(source: Path) -> Optional[str]:
+    """SHA-256 of the zip a dataset came from (from the download manifest), or None."""
+    if (source / "cache.json").is_file():
+        # A Parquet cache directory (build_parquet_cache) records its zip's checksum.
+        return json.loads((source / "cache.json").read_text()).get("source_sha256")
+    zip_path = source if source.suffix == ".zip" else source.parent / f"{source.name}.zip"
+    if not zip_path.is_file():
+        return None
+    entry = load_manifest(zip_path.parent / MANIFEST_NAME).get(zip_path.name)
+    if entry and entry.get("sha256"):
+        return entry["sha256"]
+    return sha256_file(zip_path)
+
+
+def csv_columns(csv_ref) -> list:
+    """Column names of a CSV returned by find_csv (or of its Parquet cache file)."""
+    if is_parquet(csv_ref):
+        return pq.ParquetFile(csv_ref).schema_arrow.names
+    with open_csv_text(csv_ref) as f:
+        return next(csv.reader(f), [])
+
+
+def csv_to_parquet(csv_ref, dest: Path, typed_columns: dict):
+    """Stream one CSV into a zstd-compressed Parquet file with `typed_columns` typed and the rest as strings."""
+    column_types = {name: pa.string() for name in csv_columns(csv_ref)}
+    for name, dtype in typed_columns.items():
+        if name in column_types:
+            column_types[name] = dtype
+
+    tmp = dest.with_suffix(".tmp")
+    writer = None
+    try:
+        for batch in iter_column_batches(csv_ref, column_types, block_size=NUTRIENT_CSV_BLOCK_SIZE,
+                                         newlines_in_values=True):
+            if writer is None:
+                writer = pq.ParquetWriter(tmp, batch.schema, compression="zstd")
+            writer.write_batch(batch)
+        if writer is None:
+            writer = pq.ParquetWriter(tmp, pa.schema([(n, t) for n, t in column_types.items()]), compression="zstd")
+    finally:
+        if writer is not None:
+            writer.close()
+    os.replace(tmp, dest)
+
+
+def build_parquet_cache(data_type: str, source: Path) -> Path:
+    """
+    Mirror a dataset's CSVs (PARQUET_CACHE_TABLES) into typed Parquet files
+    under PARQUET_CACHE_DIR, keyed by the source zip's SHA-256, and return the
+    cache directory; find_csv and the loaders read it in place of the CSVs,
+    projecting only the columns they need. Later builds on the same zip skip
+    the CSV parse entirely. Returns `source` unchanged if it has no checksum.
+    """
+    checksum = source_checksum(source)
+    if not checksum:
+        print(f"  [{data_type}] No zip checksum for {source}, reading CSVs directly.")
+        return source
+
+    cache_dir = PARQUET_CACHE_DIR / f"{data_type}-{checksum[:16]}"
+    marker = cache_dir / "cache.json"
+    if marker.is_file():
+        print(f"  [{data_type}] Using Parquet cache {cache_dir.name}.")
+        return cache_dir
+
+    # Drop caches built from older releases of this dataset.
+    if PARQUET_CACHE_DIR.exists():
+        for stale in PARQUET_CACHE_DIR.glob(f"{data_type}-*"):
+            for path in stale.iterdir():
+                path.unlink()
+            stale.rmdir()
+
+    print(f"  [{data_type}] Building Parquet cache {cache_dir.name}...")
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+    tables = {}
+    for filename, typed_columns in PARQUET_CACHE_TABLES.items():
+        csv_ref = find_csv(source, filename)
+        if not csv_ref:
+            continue
+        dest = cache_dir / (Path(filename).stem + ".parquet")
+        try:
+            csv_to_parquet(csv_ref, dest, typed_columns)
+        except pa.ArrowInvalid:
+            # A typed column has malformed cells: keep everything as text.
+            csv_to_parquet(csv_ref, dest, {})
+        tables[filename] = {"csv_bytes": csv_size(csv_ref), "parquet_bytes": dest.stat().st_size}
+
+    marker.write_text(json.dumps({"source_sha256": checksum, "tables": tables}, indent=2))
+    csv_mb = sum(t["csv_bytes"] for t in tables.values()) / (1024 * 1024)
+    parquet_mb = sum(t["parquet_bytes"] for t in tables.values()) / (1024 * 1024)
+    print(f"  [{data_type}] Parquet cache: {csv_mb:.0f} MB CSV -> {parquet_mb:.0f} MB in "
+          f"{time.perf_counter() - start:.1f}s.")
+    return cache_dir
+
+
+# food_nutrient.csv is by far the largest input (tens of millions of rows for
+# Branded Foods), so it is read in blocks of this many bytes.
+NUTRIENT_CSV_BLOCK_SIZE = 64 * 1024 * 1024
+
+
+def read_nutrient_columns(csv_path, fdc_ids: Optional[set] = None) -> tuple:
+    """
+    Read (fdc_id, nutrient_id, amount) from food_nutrient.csv as typed arrays.
+
+    Only the three needed columns are parsed, and rows whose nutrient_id is not
+    in NUTRIENT_IDS (or whose fdc_id is not in `fdc_ids`, when given) are
+    dropped block by block, so memory stays proportional to the rows we keep.
+    Missing amounts become 0, matching the DictReader loader.
+    Returns three numpy arrays (int64, int64, float64) in file order.
+    """
+    wanted = pa.array(sorted(NUTRIENT_IDS), type=pa.int64())
+    wanted_foods = pa.array(sorted(fdc_ids), type=pa.int64()) if fdc_ids is not None else None
+    column_types = {"fdc_id": pa.int64(), "nutrient_id": pa.int64(), "amount": pa.float64()}
+
+    fdc_ids, nutrient_ids, amounts = [], [], []
+    for batch in iter_column_batches(csv_path, column_types, block_size=NUTRIENT_CSV_BLOCK_SIZE):
+        mask = pc.fill_null(pc.is_in(batch.column("nutrient_id"), value_set=wanted), False)
+        if wanted_foods is not None:
+            mask = pc.and_(mask, pc.fill_null(pc.is_in(batch.column("fdc_id"), value_set=wanted_foods), False))
+        batch = batch.filter(mask)
+        if batch.num_rows == 0:
+            continue
+        fdc_ids.append(batch.column("fdc_id").to_numpy(zero_copy_only=False))
+        nutrient_ids.append(batch.column("nutrient_id").to_numpy(zero_copy_only=False))
+        amounts.append(pc.fill_null(batch.column("amount"), 0.0).to_numpy(zero_copy_only=False))
+
+    if not fdc_ids:
+        empty_int = np.empty(0, dtype=np.int64)
+        return empty_int, empty_int, np.empty(0, dtype=np.float64)
+    return np.concatenate(fdc_ids), np.concatenate(nutrient_ids), np.concatenate(amounts)
+
+
+class NutrientTable:
+    """
+    Dense nutrient store for one dataset.
+
+    `fdc_ids` is a sorted int64 index and `values` a float32 matrix of shape
+    [foods x NUTRIENT_KEYS] with NaN for nutrients the food does not report.
+    At Branded scale this is a few hundred MB instead of several GB of
+    per-food dicts.
+    """
+
+    def __init__(self, fdc_ids: np.ndarray, values: np.ndarray):
+        self.fdc_ids = fdc_ids
+        self.values = values
+
+    @classmethod
+    def empty(cls) -> "NutrientTable":
+        return cls(np.empty(0, dtype=np.int64), np.empty((0, len(NUTRIENT_KEYS)), dtype=np.float32))
+
+    @classmethod
+    def from_columns(cls, fdc_ids: np.ndarray, nutrient_ids: np.ndarray, amounts: np.ndarray) -> "NutrientTable":
+        """Pivot long (fdc_id, nutrient_id, amount) arrays; later rows win on duplicates."""
+        if len(fdc_ids) == 0:
+            return cls.empty()
+
+        ids_sorted = np.array(sorted(NUTRIENT_IDS), dtype=np.int64)
+        col_of_id = np.array([NUTRIENT_COLUMNS[NUTRIENT_IDS[i]] for i in ids_sorted.tolist()], dtype=np.int64)
+        cols = col_of_id[np.searchsorted(ids_sorted, nutrient_ids)]
+
+        index = np.unique(fdc_ids)
+        rows = np.searchsorted(index, fdc_ids)
+
+        # Keep the last occurrence of each (row, col) so duplicates resolve
+        # exactly like successive dict assignments did.
+        flat = rows * len(NUTRIENT_KEYS) + cols
+        _, first_from_end = np.unique(flat[::-1], return_index=True)
+        keep = len(flat) - 1 - first_from_end
+
+        values = np.full((len(index), len(NUTRIENT_KEYS)), np.nan, dtype=np.float32)
+        values[rows[keep], cols[keep]] = amounts[keep]
+        return cls(index, values)
+
+    @classmethod
+    def from_dict(cls, nutrients: dict) -> "NutrientTable":
+        """Build from the {fdc_id: {key: value}} shape returned by load_nutrients_dictreader."""
+        index = np.array(sorted(nutrients), dtype=np.int64)
+        values = np.full((len(index), len(NUTRIENT_KEYS)), np.nan, dtype=np.float32)
+        for row, fdc_id in enumerate(index.tolist()):
+            for key, value in nutrients[fdc_id].items():
+                values[row, NUTRIENT_COLUMNS[key]] = value
+        return cls(index, values)
+
+    def __len__(self) -> int:
+        return len(self.fdc_ids)
+
+    @property
+    def nbytes(self) -> int:
+        return self.fdc_ids.nbytes + self.values.nbytes
+
+    def row_index(self, fdc_id: int) -> Optional[int]:
+        """Position of fdc_id in the matrix, or None if it has no nutrient rows."""
+        i = int(self.fdc_ids.searchsorted(fdc_id))
+        if i < len(self.fdc_ids) and self.fdc_ids[i] == fdc_id:
+            return i
+        return None
+
+    def row(self, fdc_id: int) -> Optional[list]:
+        """
+        Nutrient values for one food as Python floats in NUTRIENT_KEYS order
+        (NaN = missing), or None. float32 keeps ~7 significant digits, which
+        covers every USDA amount, so values are rounded back to that precision
+        to return 187.62 rather than 187.6199951171875.
+        """
+        i = self.row_index(fdc_id)
+        if i is None:
+            return None
+        return [float(f"{v:.7g}") if v == v else v for v in self.values[i].tolist()]
+
+    def to_dict(self) -> dict:
+        """Expand to {fdc_id: {key: value}}; for comparisons and debugging only."""
+        result = {}
+        for fdc_id in self.fdc_ids.tolist():
+            values = self.row(fdc_id)
+            result[fdc_id] = {key: v for key, v in zip(NUTRIENT_KEYS, values) if v == v}
+        return result
+
+
+def nutrient_value(values: Optional[list], key: str, default=None):
+    """Look up one nutrient in a NutrientTable row, returning `default` when missing."""
+    if values is None:
+        return default
+    value = values[NUTRIENT_COLUMNS[key]]
+    return default if value != value else value
+
+
+@build_profile.profiled("load_nutrients", rows=len)
+def load_nutrients(base_dir: Path, fdc_ids: Optional[set] = None) -> NutrientTable:
+    """Load nutrient data from food_nutrient.csv into a NutrientTable, optionally only for `fdc_ids`."""
+    csv_path = find_csv(base_dir, "food_nutrient.csv")
+    if not csv_path:
+        print(f"  Warning: food_nutrient.csv not found in {base_dir}")
+        return NutrientTable.empty()
+
+    try:
+        ids, nutrient_ids, amounts = read_nutrient_columns(csv_path, fdc_ids)
+    except pa.ArrowInvalid as e:
+        # Malformed numeric cells: the row-by-row loader skips those rows.
+        print(f"  Warning: columnar read failed ({e}), falling back to csv.DictReader")
+        return NutrientTable.from_dict(load_nutrients_dictreader(base_dir, fdc_ids))
+
+    return NutrientTable.from_columns(ids, nutrient_ids, amounts)
+
+
+def load_nutrients_dictreader(base_dir: Path, fdc_ids: Optional[set] = None) -> dict:
+    """Row-by-row csv.DictReader loader; kept as the reference for benchmarks."""
     csv_path = find_csv(base_dir, "food_nutrient.csv")
     if not csv_path:
         print(f"  Warning: food_nutrient.csv not found in {base_dir}")
         return {}
 
     nutrients = defaultdict(dict)
-    with open(csv_path, "r", encoding="utf-8-sig") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            try:
-                nutrient_id = int(row.get("nutrient_id", 0))
-                if nutrient_id in NUTRIENT_IDS:
-                    fdc_id = int(row["fdc_id"])
-                    value = float(row.get("amount", 0) or 0)
-                    key = NUTRIENT_IDS[nutrient_id]
-                    nutrients[fdc_id][key] = value
-            except (ValueError, KeyError):
-                continue
+    for row in iter_csv_rows(csv_path, ["fdc_id", "nutrient_id", "amount"]):
+        try:
+            nutrient_id = int(row.get("nutrient_id", 0))
+            if nutrient_id in NUTRIENT_IDS:
+                fdc_id = int(row["fdc_id"])
+                if fdc_ids is not None and fdc_id not in fdc_ids:
+                    continue
+                value = float(row.get("amount", 0) or 0)
+                key = NUTRIENT_IDS[nutrient_id]
+                nutrients[fdc_id][key] = value
+        except (ValueError, KeyError, TypeError):
+            continue
 
     return dict(nutrients)
 
 
+@build_profile.profiled("load_food_portions", rows=len)
 def load_food_portions(base_dir: Path) -> dict:
     """Load serving size data from food_portion.csv. Returns {fdc_id: (size, unit)}."""
     csv_path = find_csv(base_dir, "food_portion.csv")
@@ -326,82 +764,189 @@ def load_food_portions(base_dir: Path) -> dict:
         return {}
 
     portions = {}
-    with open(csv_path, "r", encoding="utf-8-sig") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            try:
-                fdc_id = int(row["fdc_id"])
-                if fdc_id in portions:
-                    continue  # Keep first portion (usually the most standard)
-                amount = row.get("amount", "1") or "1"
-                unit = row.get("modifier", "") or row.get("measure_unit_id", "")
-                gram_weight = float(row.get("gram_weight", 0) or 0)
-                if gram_weight > 0:
-                    portions[fdc_id] = (str(amount), f"{unit} ({int(gram_weight)}g)" if unit else f"{int(gram_weight)}g")
-            except (ValueError, KeyError):
-                continue
+    for row in iter_csv_rows(csv_path, ["fdc_id", "amount", "modifier", "measure_unit_id", "gram_weight"]):
+        try:
+            fdc_id = int(row["fdc_id"])
+            if fdc_id in portions:
+                continue  # Keep first portion (usually the most standard)
+            amount = row.get("amount", "1") or "1"
+            unit = row.get("modifier", "") or row.get("measure_unit_id", "")
+            gram_weight = float(row.get("gram_weight", 0) or 0)
+            if gram_weight > 0:
+                portions[fdc_id] = (str(amount), f"{unit} ({int(gram_weight)}g)" if unit else f"{int(gram_weight)}g")
+        except (ValueError, KeyError, TypeError):
+            continue
 
     return portions
 
 
+# Keyword tables for categorize_food, in priority order: the first group
+# with any keyword contained in the (lowercased) text wins. USDA/branded
+# category strings are checked first, then the food name.
+CATEGORY_KEYWORDS = [
+    ("Fruits", ["fruit", "berry", "citrus"]),
+    ("Vegetables", ["vegetable", "legume"]),
+    ("Grains & Cereals", ["grain", "cereal", "bread", "baked", "pasta"]),
+    ("Protein Foods", ["meat", "poultry", "fish", "seafood", "egg", "nut", "seed"]),
+    ("Dairy", ["dairy", "milk", "cheese", "yogurt", "cream"]),
+    ("Beverages", ["beverage", "drink", "water", "juice", "coffee", "tea"]),
+    ("Snacks", ["snack", "chip", "cracker", "pretzel", "popcorn"]),
+    ("Desserts", ["dessert", "candy", "chocolate", "cookie", "cake", "ice cream"]),
+    ("Fast Food", ["fast food", "restaurant"]),
+    ("Condiments & Sauces", ["sauce", "condiment", "dressing", "spice", "seasoning"]),
+    ("Oils & Fats", ["oil", "fat", "butter", "margarine"]),
+]
+
+NAME_KEYWORDS = [
+    ("Fruits", ["apple", "banana", "orange", "berry", "fruit", "grape", "melon", "peach", "pear", "mango", "pineapple", "cherry", "plum", "lemon", "lime", "kiwi"]),
+    ("Vegetables", ["broccoli", "carrot", "spinach", "tomato", "potato", "lettuce", "cabbage", "celery", "pepper", "onion", "corn", "pea", "bean", "vegetable"]),
+    ("Grains & Cereals", ["rice", "bread", "pasta", "noodle", "oat", "cereal", "wheat", "flour", "tortilla", "bagel", "muffin", "pancake", "waffle"]),
+    ("Protein Foods", ["chicken", "beef", "pork", "fish", "salmon", "tuna", "shrimp", "turkey", "egg", "tofu", "lamb", "steak"]),
+    ("Dairy", ["milk", "cheese", "yogurt", "cream", "butter"]),
+    ("Beverages", ["coffee", "tea", "juice", "soda", "water", "drink", "latte", "espresso", "smoothie", "shake"]),
+    ("Fast Food", ["pizza", "burger", "sandwich", "taco", "burrito", "fries", "hot dog", "wrap", "sub "]),
+    ("Desserts", ["cookie", "cake", "ice cream", "chocolate", "candy", "brownie", "pie", "donut", "pastry"]),
+    ("Snacks", ["chip", "pretzel", "popcorn", "cracker", "granola bar", "protein bar", "trail mix", "nuts"]),
+    ("Condiments & Sauces", ["sauce", "ketchup", "mustard", "dressing", "mayo", "salsa", "syrup", "honey", "jam"]),
+    ("Oils & Fats", ["oil", "lard", "shortening"]),
+]
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over prioritised keyword groups.
+
+    Built once from a list of keyword groups; `first(text)` makes a single
+    pass over the text and returns the lowest group index whose keyword
+    occurs anywhere in it (substring semantics, same as `kw in text`), or
+    None. This replaces one `in` scan per keyword per food.
+    """
+
+    NO_MATCH = sys.maxsize
+
+    def __init__(self, groups: list):
+        goto = [{}]
+        out = [self.NO_MATCH]
+        for priority, keywords in enumerate(groups):
+            for keyword in keywords:
+                state = 0
+                for ch in keyword:
+                    nxt = goto[state].get(ch)
+                    if nxt is None:
+                        goto.append({})
+                        out.append(self.NO_MATCH)
+                        nxt = len(goto) - 1
+                        goto[state][ch] = nxt
+                    state = nxt
+                out[state] = min(out[state], priority)
+
+        # Breadth-first: resolve failure links into a full transition table
+        # (a DFA) so matching never has to walk failure chains.
+        delta = [None] * len(goto)
+        delta[0] = dict(goto[0])
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            out[state] = min(out[state], out[fail[state]])
+            transitions = dict(delta[fail[state]])
+            transitions.update(goto[state])
+            delta[state] = transitions
+            for ch, child in goto[state].items():
+                fail[child] = delta[fail[state]].get(ch, 0)
+                queue.append(child)
+
+        self._delta = delta
+        self._out = out
+
+    def first(self, text: str) -> Optional[int]:
+        """Lowest matching group index in `text`, or None."""
+        delta = self._delta
+        out = self._out
+        state = 0
+        best = self.NO_MATCH
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            if out[state] < best:
+                best = out[state]
+                if best == 0:
+                    break
+        return None if best == self.NO_MATCH else best
+
+
+_CATEGORY_MATCHER = KeywordMatcher([keywords for _, keywords in CATEGORY_KEYWORDS])
+_NAME_MATCHER = KeywordMatcher([keywords for _, keywords in NAME_KEYWORDS])
+_COMMON_MATCHER = KeywordMatcher([COMMON_FOOD_TERMS])
+
+
 def categorize_food(name: str, food_category: str = "") -> str:
     """Assign a FoodCategory based on food name and USDA category."""
-    name_lower = name.lower()
-    cat_lower = food_category.lower() if food_category else ""
-
     # Check category first
-    if any(t in cat_lower for t in ["fruit", "berry", "citrus"]):
-        return "Fruits"
-    if any(t in cat_lower for t in ["vegetable", "legume"]):
-        return "Vegetables"
-    if any(t in cat_lower for t in ["grain", "cereal", "bread", "baked", "pasta"]):
-        return "Grains & Cereals"
-    if any(t in cat_lower for t in ["meat", "poultry", "fish", "seafood", "egg", "nut", "seed"]):
-        return "Protein Foods"
-    if any(t in cat_lower for t in ["dairy", "milk", "cheese", "yogurt", "cream"]):
-        return "Dairy"
-    if any(t in cat_lower for t in ["beverage", "drink", "water", "juice", "coffee", "tea"]):
-        return "Beverages"
-    if any(t in cat_lower for t in ["snack", "chip", "cracker", "pretzel", "popcorn"]):
-        return "Snacks"
-    if any(t in cat_lower for t in ["dessert", "candy", "chocolate", "cookie", "cake", "ice cream"]):
-        return "Desserts"
-    if any(t in cat_lower for t in ["fast food", "restaurant"]):
-        return "Fast Food"
-    if any(t in cat_lower for t in ["sauce", "condiment", "dressing", "spice", "seasoning"]):
-        return "Condiments & Sauces"
-    if any(t in cat_lower for t in ["oil", "fat", "butter", "margarine"]):
-        return "Oils & Fats"
+    if food_category:
+        hit = _CATEGORY_MATCHER.first(food_category.lower())
+        if hit is not None:
+            return CATEGORY_KEYWORDS[hit][0]
 
     # Fallback: check name
-    if any(t in name_lower for t in ["apple", "banana", "orange", "berry", "fruit", "grape", "melon", "peach", "pear", "mango", "pineapple", "cherry", "plum", "lemon", "lime", "kiwi"]):
-        return "Fruits"
-    if any(t in name_lower for t in ["broccoli", "carrot", "spinach", "tomato", "potato", "lettuce", "cabbage", "celery", "pepper", "onion", "corn", "pea", "bean", "vegetable"]):
-        return "Vegetables"
-    if any(t in name_lower for t in ["rice", "bread", "pasta", "noodle", "oat", "cereal", "wheat", "flour", "tortilla", "bagel", "muffin", "pancake", "waffle"]):
-        return "Grains & Cereals"
-    if any(t in name_lower for t in ["chicken", "beef", "pork", "fish", "salmon", "tuna", "shrimp", "turkey", "egg", "tofu", "lamb", "steak"]):
-        return "Protein Foods"
-    if any(t in name_lower for t in ["milk", "cheese", "yogurt", "cream", "butter"]):
-        return "Dairy"
-    if any(t in name_lower for t in ["coffee", "tea", "juice", "soda", "water", "drink", "latte", "espresso", "smoothie", "shake"]):
-        return "Beverages"
-    if any(t in name_lower for t in ["pizza", "burger", "sandwich", "taco", "burrito", "fries", "hot dog", "wrap", "sub "]):
-        return "Fast Food"
-    if any(t in name_lower for t in ["cookie", "cake", "ice cream", "chocolate", "candy", "brownie", "pie", "donut", "pastry"]):
-        return "Desserts"
-    if any(t in name_lower for t in ["chip", "pretzel", "popcorn", "cracker", "granola bar", "protein bar", "trail mix", "nuts"]):
-        return "Snacks"
-    if any(t in name_lower for t in ["sauce", "ketchup", "mustard", "dressing", "mayo", "salsa", "syrup", "honey", "jam"]):
-        return "Condiments & Sauces"
-    if any(t in name_lower for t in ["oil", "lard", "shortening"]):
-        return "Oils & Fats"
+    hit = _NAME_MATCHER.first(name.lower())
+    if hit is not None:
+        return NAME_KEYWORDS[hit][0]
 
     return "Other"
 
 
-def process_foundation_and_legacy(data_type: str, base_dir: Path) -> list:
-    """Process Foundation Foods or SR Legacy data."""
+def categorize_foods(names: list, food_categories: list) -> list:
+    """
+    Batch categorize_food over a column of names. Category strings repeat
+    heavily, so each distinct one is matched once; names are matched only
+    for foods whose category string decided nothing.
+    """
+    by_category = {}
+    for food_category in set(food_categories):
+        hit = _CATEGORY_MATCHER.first(food_category.lower()) if food_category else None
+        by_category[food_category] = CATEGORY_KEYWORDS[hit][0] if hit is not None else None
+
+    first_name_match = _NAME_MATCHER.first
+    result = []
+    for name, food_category in zip(names, food_categories):
+        category = by_category[food_category]
+        if category is None:
+            hit = first_name_match(name.lower())
+            category = NAME_KEYWORDS[hit][0] if hit is not None else "Other"
+        result.append(category)
+    return result
+
+
+def is_common_foods(names: list) -> list:
+    """Batch is_common_food over a column of names."""
+    first = _COMMON_MATCHER.first
+    return [first(name.lower()) is not None for name in names]
+
+
+def classify_foods(foods: list, food_categories: list):
+    """Fill in "category" and "isCommon" on processed foods, in place, using the batch matchers."""
+    names = [food["name"] for food in foods]
+    for food, category, common in zip(foods, categorize_foods(names, food_categories), is_common_foods(names)):
+        food["category"] = category
+        food["isCommon"] = common
+
+
+def defer_classification(foods: list, food_categories: list):
+    """Park each food's USDA category in "category" so classify_deferred can run later (after dedup)."""
+    for food, food_category in zip(foods, food_categories):
+        food["category"] = food_category
+
+
+def classify_deferred(foods: list):
+    """classify_foods for foods processed with classify=False."""
+    classify_foods(foods, [food["category"] or "" for food in foods])
+
+
+def process_foundation_and_legacy(data_type: str, base_dir: Path, classify: bool = True) -> list:
+    """
+    Process Foundation Foods or SR Legacy data. With classify=False the foods
+    keep their USDA category for classify_deferred instead of being categorized.
+    """
     food_csv = find_csv(base_dir, "food.csv")
     if not food_csv:
         print(f"  [{data_type}] food.csv not found!")
@@ -415,61 +960,64 @@ def process_foundation_and_legacy(data_type: str, base_dir: Path) -> list:
     category_map = {}
     cat_csv = find_csv(base_dir, "food_category.csv")
     if cat_csv:
-        with open(cat_csv, "r", encoding="utf-8-sig") as f:
-            for row in csv.DictReader(f):
-                try:
-                    category_map[int(row["id"])] = row.get("description", "")
-                except (ValueError, KeyError):
-                    continue
+        for row in iter_csv_rows(cat_csv, ["id", "description"]):
+            try:
+                category_map[int(row["id"])] = row.get("description", "")
+            except (ValueError, KeyError, TypeError):
+                continue
 
     foods = []
+    food_categories = []  # USDA category per food, for classify_foods
     print(f"  [{data_type}] Processing foods...")
-    with open(food_csv, "r", encoding="utf-8-sig") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            try:
-                fdc_id = int(row["fdc_id"])
-                name = clean_food_name(row.get("description", ""))
-                if not name:
-                    continue
-
-                nutr = nutrients.get(fdc_id, {})
-                calories = nutr.get("calories", 0)
+    for row in iter_csv_rows(food_csv, ["fdc_id", "description", "food_category_id"]):
+        try:
+            fdc_id = int(row["fdc_id"])
+            name = clean_food_name(row.get("description", ""))
+            if not name:
+                continue
 
-                # Skip entries with no calorie data (likely incomplete)
-                if calories == 0 and not any(nutr.get(k, 0) > 0 for k in ["protein", "carbs", "fat"]):
-                    continue
+            nutr = nutrients.row(fdc_id)
+            calories = nutrient_value(nutr, "calories", 0)
 
-                cat_id = int(row.get("food_category_id", 0) or 0)
-                food_category = category_map.get(cat_id, "")
-
-                portion = portions.get(fdc_id, ("100", "g"))
-
-                sugar = nutr.get("sugar", nutr.get("sugar_alt"))
-
-                foods.append({
-                    "fdcId": fdc_id,
-                    "name": name,
-                    "brand": None,
-                    "category": categorize_food(name, food_category),
-                    "servingSize": portion[0],
-                    "servingUnit": portion[1],
-                    "calories": calories,
-                    "protein": nutr.get("protein", 0),
-                    "carbs": nutr.get("carbs", 0),
-                    "fat": nutr.get("fat", 0),
-                    "fiber": nutr.get("fiber", 0),
-                    "sugar": sugar,
-                    "sodium": nutr.get("sodium", 0),
-                    "cholesterol": nutr.get("cholesterol"),
-                    "saturatedFat": nutr.get("saturatedFat"),
-                    "additionalNutrients": extras_json(nutr),
-                    "dataType": data_type,
-                    "isCommon": is_common_food(name),
-                })
-            except (ValueError, KeyError):
+            # Skip entries with no calorie data (likely incomplete)
+            if calories == 0 and not any(nutrient_value(nutr, k, 0) > 0 for k in ["protein", "carbs", "fat"]):
                 continue
 
+            cat_id = int(row.get("food_category_id", 0) or 0)
+            food_category = category_map.get(cat_id, "")
+
+            portion = portions.get(fdc_id, ("100", "g"))
+
+            sugar = nutrient_value(nutr, "sugar", nutrient_value(nutr, "sugar_alt"))
+
+            foods.append({
+                "fdcId": fdc_id,
+                "name": name,
+                "brand": None,
+                "category": None,  # filled in by classify_foods
+                "servingSize": portion[0],
+                "servingUnit": portion[1],
+                "calories": calories,
+                "protein": nutrient_value(nutr, "protein", 0),
+                "carbs": nutrient_value(nutr, "carbs", 0),
+                "fat": nutrient_value(nutr, "fat", 0),
+                "fiber": nutrient_value(nutr, "fiber", 0),
+                "sugar": sugar,
+                "sodium": nutrient_value(nutr, "sodium", 0),
+                "cholesterol": nutrient_value(nutr, "cholesterol"),
+                "saturatedFat": nutrient_value(nutr, "saturatedFat"),
+                "additionalNutrients": extras_json(nutr),
+                "dataType": data_type,
+                "isCommon": False,
+            })
+            food_categories.append(food_category)
+        except (ValueError, KeyError, TypeError):
+            continue
+
+    if classify:
+        classify_foods(foods, food_categories)
+    else:
+        defer_classification(foods, food_categories)
     print(f"  [{data_type}] Found {len(foods)} foods.")
     return foods
 
@@ -479,8 +1027,236 @@ def process_survey(base_dir: Path) -> list:
     return process_foundation_and_legacy("survey", base_dir)
 
 
-def process_branded(base_dir: Path) -> list:
-    """Process Branded Foods data, filtering to top brand owners."""
+# branded_food.csv columns process_branded needs after the brand filter;
+# everything else (ingredients, GTIN, ...) is dropped in the first pass.
+BRANDED_FIELDS = (
+    "brand_owner", "brand_name", "description", "serving_size",
+    "serving_size_unit", "household_serving_fulltext", "branded_food_category",
+)
+
+
+def brand_key_matches(column: pa.Array, top_brands) -> pa.BooleanArray:
+    """
+    Per row of a brand column, whether its canonical_brand key is in
+    `top_brands`. Each distinct value in the batch is canonicalized once and
+    the result is spread back over the rows with its dictionary indices.
+    """
+    encoded = pc.dictionary_encode(column)
+    hits = pa.array([canonical_brand(value) in top_brands for value in encoded.dictionary.to_pylist()],
+                    type=pa.bool_())
+    return pc.fill_null(pc.take(hits, encoded.indices), False)
+
+
+def scan_top_brand_rows(food_csv, top_brands=TOP_BRAND_KEYS) -> tuple:
+    """
+    First pass over branded_food.csv: keep only rows whose brand_owner or
+    brand_name is a top brand (TOP_BRAND_KEYS, or `top_brands`, a set of
+    canonical_brand keys), matched a column batch at a time.
+
+    Returns (kept, total_rows, skipped_brands) where `kept` is a list of
+    (fdc_id, {field: value}) in file order, trimmed to BRANDED_FIELDS.
+    """
+    available = set(csv_columns(food_csv))
+    fields = [k for k in BRANDED_FIELDS if k in available]
+    column_types = {"fdc_id": pa.string(), **{k: pa.string() for k in fields}}
+    kept = []
+    total_rows = 0
+    skipped_brands = 0
+    # A release missing a brand column simply never matches on it.
+    brand_columns = [k for k in ("brand_owner", "brand_name") if k in available]
+    for batch in iter_column_batches(food_csv, column_types, newlines_in_values=True):
+        total_rows += batch.num_rows
+        mask = pa.array([False] * batch.num_rows, type=pa.bool_())
+        for column in brand_columns:
+            mask = pc.or_(mask, brand_key_matches(batch.column(column), top_brands))
+        matched = batch.filter(mask)
+        skipped_brands += batch.num_rows - matched.num_rows
+        for row in matched.to_pylist():
+            try:
+                fdc_id = int(row["fdc_id"])
+            except (ValueError, TypeError):
+                continue
+            kept.append((fdc_id, {k: row.get(k) or "" for k in BRANDED_FIELDS}))
+    return kept, total_rows, skipped_brands
+
+
+# --top-brands: pick the N brand owners with the most products instead of
+# TOP_BRAND_OWNERS, in one pass over branded_food.csv with a fixed number of
+# counters rather than an exact count for each of its tens of thousands of
+# owners. The choice is written to a manifest so a later build can reuse it
+# (--brand-manifest).
+BRAND_SKETCH_FACTOR = 10  # counters kept per requested brand
+# "products" counts every row; "active" skips rows with a discontinued_date.
+BRAND_WEIGHTS = ("products", "active")
+BRAND_MANIFEST_NAME = "brand_manifest.json"
+
+
+class BrandSelection(NamedTuple):
+    """How process_branded picks brands when not using TOP_BRAND_OWNERS."""
+    top_n: int = 0
+    weight: str = "products"
+    manifest: Optional[Path] = None
+    # Use the brands already listed in `manifest` instead of counting again.
+    reuse: bool = False
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy hitters (Metwally et al., 2005) with weighted updates.
+
+    At most `capacity` counters are kept. An item that is not monitored takes
+    over the smallest counter and inherits its count as `error`, so every
+    count over-estimates the item's true weight by at most its error, and
+    every item heavier than total / capacity is guaranteed to be monitored.
+    The smallest counter is found through a lazily updated min-heap.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counters = {}  # item -> [count, error]
+        self.total = 0
+        self._heap = []     # (count, item), possibly stale
+
+    def add(self, item, weight: int = 1):
+        if weight <= 0:
+            return
+        self.total += weight
+        counter = self.counters.get(item)
+        if counter is None:
+            error = 0
+            if len(self.counters) >= self.capacity:
+                while True:
+                    count, victim = heapq.heappop(self._heap)
+                    if self.counters[victim][0] == count:
+                        break
+                del self.counters[victim]
+                error = count
+            counter = self.counters[item] = [error, error]
+        counter[0] += weight
+        heapq.heappush(self._heap, (counter[0], item))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, item) for item, (count, _) in self.counters.items()]
+            heapq.heapify(self._heap)
+
+    def top(self, n: int) -> list:
+        """The `n` largest counters as (item, count, error), largest first."""
+        return [(item, count, error) for item, (count, error)
+                in sorted(self.counters.items(), key=lambda kv: (-kv[1][0], kv[0]))[:n]]
+
+
+def select_top_brands(food_csv, top_n: int, weight: str = "products") -> dict:
+    """
+    Stream branded_food.csv once through a SpaceSaving sketch and return the
+    brand manifest: the top_n brand owners (canonical_brand keys, so spelling
+    variants count together) with their estimated
+    counts and error bounds. A brand is marked `guaranteed` when even its
+    lower bound beats the next brand's count.
+    """
+    columns = ["brand_owner"]
+    if weight == "active" and "discontinued_date" in csv_columns(food_csv):
+        columns.append("discontinued_date")
+    sketch = SpaceSaving(max(top_n * BRAND_SKETCH_FACTOR, top_n + 1))
+    rows = 0
+    for batch in iter_column_batches(food_csv, {c: pa.string() for c in columns}, newlines_in_values=True):
+        rows += batch.num_rows
+        owners = batch.column("brand_owner")
+        if "discontinued_date" in columns:
+            owners = owners.filter(pc.fill_null(pc.equal(batch.column("discontinued_date"), ""), True))
+        # One weighted update per distinct brand key in the batch.
+        counts = Counter()
+        for entry in pc.value_counts(owners).to_pylist():
+            counts[canonical_brand(entry["values"])] += entry["counts"]
+        for key, count in counts.items():
+            if key:
+                sketch.add(key, count)
+
+    top = sketch.top(top_n + 1)
+    next_count = top[top_n][1] if len(top) > top_n else 0
+    return {
+        "top_n": top_n,
+        "weight": weight,
+        "capacity": sketch.capacity,
+        "rows": rows,
+        "total_weight": sketch.total,
+        "brands": [{"brand_owner": item, "count": count, "error": error, "guaranteed": count - error >= next_count}
+                   for item, count, error in top[:top_n]],
+    }
+
+
+def resolve_top_brands(base_dir: Path, food_csv, selection: BrandSelection) -> set:
+    """
+    The canonical_brand keys of the brand owners process_branded keeps under
+    `selection` (compare with canonical_brand(...), not .lower()), writing or
+    reading its manifest.
+    """
+    checksum = source_checksum(base_dir)
+    if selection.reuse:
+        manifest = json.loads(selection.manifest.read_text())
+        if manifest.get("source_sha256") != checksum:
+            print(f"  [branded] Warning: {selection.manifest.name} was built from a different branded dataset.")
+        print(f"  [branded] Using {len(manifest['brands'])} brands from {selection.manifest}.")
+        return {canonical_brand(entry["brand_owner"]) for entry in manifest["brands"]}
+
+    print(f"  [branded] Selecting the top {selection.top_n} brand owners by {selection.weight}...")
+    manifest = select_top_brands(food_csv, selection.top_n, selection.weight)
+    manifest["source_sha256"] = checksum
+    guaranteed = sum(1 for entry in manifest["brands"] if entry["guaranteed"])
+    print(f"  [branded] {len(manifest['brands'])} brands from {manifest['rows']} rows "
+          f"({guaranteed} guaranteed by the sketch's error bounds).")
+    if selection.manifest is not None:
+        selection.manifest.write_text(json.dumps(manifest, indent=2))
+        print(f"  [branded] Brand manifest: {selection.manifest}")
+    return {entry["brand_owner"] for entry in manifest["brands"]}
+
+
+def load_food_descriptions(base_dir: Path, fdc_ids: Optional[set] = None) -> dict:
+    """Load {fdc_id: description} from food.csv, optionally only for `fdc_ids`."""
+    csv_path = find_csv(base_dir, "food.csv")
+    if not csv_path:
+        return {}
+
+    wanted = pa.array(sorted(fdc_ids), type=pa.int64()) if fdc_ids is not None else None
+    descriptions = {}
+    column_types = {"fdc_id": pa.int64(), "description": pa.string()}
+    try:
+        for batch in iter_column_batches(csv_path, column_types, newlines_in_values=True):
+            mask = pc.is_valid(batch.column("fdc_id"))
+            if wanted is not None:
+                mask = pc.and_(mask, pc.fill_null(pc.is_in(batch.column("fdc_id"), value_set=wanted), False))
+            batch = batch.filter(mask)
+            descriptions.update(zip(batch.column("fdc_id").to_pylist(),
+                                    pc.fill_null(batch.column("description"), "").to_pylist()))
+    except pa.ArrowInvalid as e:
+        # Malformed fdc_id cells: the row-by-row loader skips those rows.
+        print(f"  Warning: columnar read failed ({e}), falling back to csv.DictReader")
+        return load_food_descriptions_dictreader(csv_path, fdc_ids)
+    return descriptions
+
+
+def load_food_descriptions_dictreader(csv_path, fdc_ids: Optional[set] = None) -> dict:
+    """Row-by-row csv.DictReader version of load_food_descriptions."""
+    descriptions = {}
+    for row in iter_csv_rows(csv_path, ["fdc_id", "description"]):
+        try:
+            fdc_id = int(row["fdc_id"])
+        except (ValueError, KeyError, TypeError):
+            continue
+        if fdc_ids is None or fdc_id in fdc_ids:
+            descriptions[fdc_id] = row.get("description", "") or ""
+    return descriptions
+
+
+def process_branded(base_dir: Path, brands: Optional[BrandSelection] = None, classify: bool = True) -> list:
+    """
+    Process Branded Foods data, filtering to top brand owners
+    (TOP_BRAND_OWNERS, or those picked by `brands`). classify=False works as
+    for process_foundation_and_legacy.
+
+    Two passes: branded_food.csv is streamed once to find the rows from top
+    brands, then food_nutrient.csv and food.csv are loaded only for those
+    fdc_ids. Most branded rows are rejected by the brand filter, so this
+    avoids materialising nutrients for foods we would throw away.
+    """
     food_csv = find_csv(base_dir, "branded_food.csv")
     main_food_csv = find_csv(base_dir, "food.csv")
 
@@ -488,143 +1264,252 @@ def process_branded(base_dir: Path) -> list:
         print("  [branded] Required CSV files not found!")
         return []
 
-    print("  [branded] Loading nutrients...")
-    nutrients = load_nutrients(base_dir)
+    top_brands = resolve_top_brands(base_dir, food_csv, brands) if brands is not None else TOP_BRAND_KEYS
+    print("  [branded] Scanning branded foods (filtering to top brands)...")
+    kept_rows, total_rows, skipped_brands = scan_top_brand_rows(food_csv, top_brands)
+    kept_ids = {fdc_id for fdc_id, _ in kept_rows}
 
-    # Load main food table for descriptions
-    food_names = {}
-    with open(main_food_csv, "r", encoding="utf-8-sig") as f:
-        for row in csv.DictReader(f):
-            try:
-                food_names[int(row["fdc_id"])] = row.get("description", "")
-            except (ValueError, KeyError):
-                continue
+    print(f"  [branded] Loading nutrients for {len(kept_ids)} foods...")
+    nutrients = load_nutrients(base_dir, fdc_ids=kept_ids)
+    food_names = load_food_descriptions(base_dir, fdc_ids=kept_ids)
 
     # Process branded foods
     foods = []
+    food_categories = []  # branded_food_category per food, for classify_foods
     seen = set()  # For deduplication: (name_lower, brand_lower)
-    skipped_brands = 0
-    total_rows = 0
 
-    print("  [branded] Processing branded foods (filtering to top brands)...")
-    with open(food_csv, "r", encoding="utf-8-sig") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            total_rows += 1
-            try:
-                brand_owner = (row.get("brand_owner", "") or "").strip()
-                brand_name = (row.get("brand_name", "") or "").strip()
-
-                # Filter to top brands
-                if not is_top_brand(brand_owner) and not is_top_brand(brand_name):
-                    skipped_brands += 1
-                    continue
+    print("  [branded] Processing branded foods...")
+    for fdc_id, row in kept_rows:
+        try:
+            brand_owner = (row.get("brand_owner", "") or "").strip()
+            brand_name = (row.get("brand_name", "") or "").strip()
 
-                fdc_id = int(row["fdc_id"])
-                name = food_names.get(fdc_id, row.get("description", ""))
-                name = clean_food_name(name)
-                if not name:
-                    continue
+            name = food_names.get(fdc_id, row.get("description", ""))
+            name = clean_food_name(name)
+            if not name:
+                continue
 
-                brand = brand_name or brand_owner
+            brand = brand_name or brand_owner
 
-                # Deduplicate: keep first occurrence per name+brand
-                dedup_key = (name.lower(), brand.lower())
-                if dedup_key in seen:
-                    continue
-                seen.add(dedup_key)
-
-                nutr = nutrients.get(fdc_id, {})
-                calories = nutr.get("calories", 0)
-
-                serving_size = row.get("serving_size", "1") or "1"
-                serving_unit = row.get("serving_size_unit", "g") or "g"
-                household = row.get("household_serving_fulltext", "")
-
-                # Use household serving if available (more user-friendly)
-                if household:
-                    serving_unit = f"{household} ({serving_size}{serving_unit})"
-                    serving_size = "1"
-
-                food_category = row.get("branded_food_category", "")
-                sugar = nutr.get("sugar", nutr.get("sugar_alt"))
-
-                foods.append({
-                    "fdcId": fdc_id,
-                    "name": name,
-                    "brand": brand,
-                    "category": categorize_food(name, food_category),
-                    "servingSize": str(serving_size),
-                    "servingUnit": serving_unit,
-                    "calories": calories,
-                    "protein": nutr.get("protein", 0),
-                    "carbs": nutr.get("carbs", 0),
-                    "fat": nutr.get("fat", 0),
-                    "fiber": nutr.get("fiber", 0),
-                    "sugar": sugar,
-                    "sodium": nutr.get("sodium", 0),
-                    "cholesterol": nutr.get("cholesterol"),
-                    "saturatedFat": nutr.get("saturatedFat"),
-                    "additionalNutrients": extras_json(nutr),
-                    "dataType": "branded",
-                    "isCommon": is_common_food(name),
-                })
-            except (ValueError, KeyError):
+            # Deduplicate: keep first occurrence per name+brand
+            dedup_key = (name.lower(), brand.lower())
+            if dedup_key in seen:
                 continue
-
+            seen.add(dedup_key)
+
+            nutr = nutrients.row(fdc_id)
+            calories = nutrient_value(nutr, "calories", 0)
+
+            serving_size = row.get("serving_size", "1") or "1"
+            serving_unit = row.get("serving_size_unit", "g") or "g"
+            household = row.get("household_serving_fulltext", "")
+
+            # Use household serving if available (more user-friendly)
+            if household:
+                serving_unit = f"{household} ({serving_size}{serving_unit})"
+                serving_size = "1"
+
+            food_category = row.get("branded_food_category", "")
+            sugar = nutrient_value(nutr, "sugar", nutrient_value(nutr, "sugar_alt"))
+
+            foods.append({
+                "fdcId": fdc_id,
+                "name": name,
+                "brand": brand,
+                "category": None,  # filled in by classify_foods
+                "servingSize": str(serving_size),
+                "servingUnit": serving_unit,
+                "calories": calories,
+                "protein": nutrient_value(nutr, "protein", 0),
+                "carbs": nutrient_value(nutr, "carbs", 0),
+                "fat": nutrient_value(nutr, "fat", 0),
+                "fiber": nutrient_value(nutr, "fiber", 0),
+                "sugar": sugar,
+                "sodium": nutrient_value(nutr, "sodium", 0),
+                "cholesterol": nutrient_value(nutr, "cholesterol"),
+                "saturatedFat": nutrient_value(nutr, "saturatedFat"),
+                "additionalNutrients": extras_json(nutr),
+                "dataType": "branded",
+                "isCommon": False,
+            })
+            food_categories.append(food_category)
+        except (ValueError, KeyError, TypeError):
+            continue
+
+    if classify:
+        classify_foods(foods, food_categories)
+    else:
+        defer_classification(foods, food_categories)
     print(f"  [branded] Processed {total_rows} total rows, kept {len(foods)} from top brands (skipped {skipped_brands}).")
     return foods
 
 
-def build_database(all_foods: list):
-    """Build the SQLite database with FTS5 search index."""
-    print(f"\nBuilding SQLite database with {len(all_foods)} foods...")
+# Order of food fields when rows cross a process boundary or hit SQLite.
+FOOD_FIELDS = (
+    "fdcId", "name", "brand", "category", "servingSize", "servingUnit",
+    "calories", "protein", "carbs", "fat", "fiber", "sugar", "sodium",
+    "cholesterol", "saturatedFat", "additionalNutrients", "dataType", "isCommon",
+)
 
-    if OUTPUT_DB.exists():
-        OUTPUT_DB.unlink()
 
-    conn = sqlite3.connect(str(OUTPUT_DB))
-    cursor = conn.cursor()
+def process_dataset(data_type: str, base_dir: Path, brands: Optional[BrandSelection] = None,
+                    classify: bool = True) -> list:
+    """Run the processor that matches `data_type`."""
+    with build_profile.stage(f"process_{data_type}") as stage:
+        if data_type == "branded":
+            foods = process_branded(base_dir, brands, classify)
+        else:
+            foods = process_foundation_and_legacy(data_type, base_dir, classify)
+        stage.rows = len(foods)
+    return foods
 
-    # Create main foods table.
-    # `additionalNutrients` is a JSON string of {"vitamin_a": 90, "calcium": 12, ...}
-    # matching the iOS additionalNutrients dict pattern. Keeps schema stable as
-    # we add nutrients without column migrations.
-    cursor.execute("""
-        CREATE TABLE foods (
-            fdcId INTEGER PRIMARY KEY,
-            name TEXT NOT NULL,
-            brand TEXT,
-            category TEXT NOT NULL DEFAULT 'Other',
-            servingSize TEXT NOT NULL DEFAULT '1',
-            servingUnit TEXT NOT NULL DEFAULT 'serving',
-            calories REAL NOT NULL DEFAULT 0,
-            protein REAL NOT NULL DEFAULT 0,
-            carbs REAL NOT NULL DEFAULT 0,
-            fat REAL NOT NULL DEFAULT 0,
-            fiber REAL NOT NULL DEFAULT 0,
-            sugar REAL,
-            sodium REAL,
-            cholesterol REAL,
-            saturatedFat REAL,
-            additionalNutrients TEXT,
-            dataType TEXT NOT NULL,
-            isCommon INTEGER NOT NULL DEFAULT 0
-        )
-    """)
 
-    # Insert all foods
-    insert_sql = """
-        INSERT OR IGNORE INTO foods
-        (fdcId, name, brand, category, servingSize, servingUnit,
-         calories, protein, carbs, fat, fiber, sugar, sodium,
-         cholesterol, saturatedFat, additionalNutrients, dataType, isCommon)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+def process_dataset_compact(data_type: str, base_dir: Path, brands: Optional[BrandSelection] = None,
+                            classify: bool = True) -> list:
+    """Worker entry point: process one dataset and return FOOD_FIELDS tuples, which pickle far smaller than dicts."""
+    return [tuple(food[k] for k in FOOD_FIELDS) for food in process_dataset(data_type, base_dir, brands, classify)]
+
+
+def process_datasets(sources: dict, workers: int = 1, brands: Optional[BrandSelection] = None) -> list:
     """
+    Process every {data_type: base_dir} and concatenate the foods.
 
-    rows = []
-    for food in all_foods:
-        rows.append((
+    With workers > 1 each dataset runs in its own process. Results are always
+    concatenated in `sources` order, never completion order, so the global
+    dedup sees the same sequence and the output is identical to a
+    sequential run.
+    """
+    if workers <= 1 or len(sources) <= 1:
+        all_foods = []
+        for data_type, base_dir in sources.items():
+            print(f"\n2. Processing {data_type} foods...")
+            all_foods.extend(process_dataset(data_type, base_dir, brands))
+        return all_foods
+
+    print(f"\n2. Processing {len(sources)} datasets in {min(workers, len(sources))} worker processes...")
+    with ProcessPoolExecutor(max_workers=min(workers, len(sources))) as pool:
+        profile = build_profile.worker_settings()
+        futures = [pool.submit(build_profile.worker_call, profile, process_dataset_compact, data_type, base_dir, brands)
+                   for data_type, base_dir in sources.items()]
+        all_foods = []
+        for future in futures:
+            rows, stages = future.result()
+            build_profile.PROFILER.merge(stages)
+            all_foods.extend(dict(zip(FOOD_FIELDS, row)) for row in rows)
+    return all_foods
+
+
+# Nutrition fields counted by the dedup "more complete nutrition wins" rule.
+COMPLETENESS_FIELDS = ("calories", "protein", "carbs", "fat", "fiber", "sugar", "sodium")
+# Popcount of every completeness bitmask, so scoring is one table lookup.
+_COMPLETENESS_SCORE = [bin(mask).count("1") for mask in range(1 << len(COMPLETENESS_FIELDS))]
+
+
+def completeness_mask(food: dict) -> int:
+    """Bitmask of which COMPLETENESS_FIELDS are present (truthy) on a food."""
+    mask = 0
+    for bit, k in enumerate(COMPLETENESS_FIELDS):
+        if food.get(k):
+            mask |= 1 << bit
+    return mask
+
+
+def dedup_key(food: dict) -> str:
+    """Global dedup key: lowercase name, plus lowercase brand for branded foods."""
+    key = food["name"].lower()
+    if food["brand"]:
+        key += f"|{food['brand'].lower()}"
+    return key
+
+
+def dedup_foods(foods: list) -> list:
+    """
+    Keep one food per dedup_key, in first-seen order.
+
+    A later duplicate replaces the kept food (in the same slot) only if it
+    has strictly more complete nutrition, i.e. more COMPLETENESS_FIELDS set.
+    Each key maps straight to its slot and the kept food's score, so this
+    is linear in the number of foods.
+    """
+    slots = {}
+    unique_foods = []
+    scores = []
+    with build_profile.stage("dedup") as stage:
+        for food in foods:
+            key = dedup_key(food)
+            score = _COMPLETENESS_SCORE[completeness_mask(food)]
+            slot = slots.get(key)
+            if slot is None:
+                slots[key] = len(unique_foods)
+                unique_foods.append(food)
+                scores.append(score)
+            elif score > scores[slot]:
+                unique_foods[slot] = food
+                scores[slot] = score
+        stage.rows = len(foods)
+    return unique_foods
+
+
+# PRAGMAs for --bulk-load builds. The database is built somewhere disposable
+# (memory or a temp file) and only copied to OUTPUT_DB once complete, so
+# there's nothing for a journal or fsyncs to protect during the load.
+# page_size must be set before the first table is created; VACUUM INTO keeps it.
+BULK_LOAD_PRAGMAS = (
+    "PRAGMA page_size = 4096",
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA locking_mode = EXCLUSIVE",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -524288",  # 512 MB, in KiB
+)
+BULK_LOAD_MODES = ("memory", "tempfile")
+
+
+# foods.priority: a static 0-127 search priority, one byte per row.
+#   bit 6     generic (no brand)       } priority >> PRIORITY_TIER_SHIFT is the
+#   bit 5     isCommon                 } app's ORDER BY before rank
+#   bits 3-4  data type (DATA_TYPE_PRIORITY)
+#   bits 0-2  nutrient completeness (COMPLETENESS_FIELDS present, 0-7)
+PRIORITY_TIER_SHIFT = 5
+DATA_TYPE_PRIORITY = {"foundation": 3, "sr_legacy": 2, "survey": 1, "branded": 0}
+
+
+def food_priority(food: dict) -> int:
+    """foods.priority for one food (see the bit layout above)."""
+    return (
+        (0 if food["brand"] else 1) << 6
+        | (1 if food["isCommon"] else 0) << 5
+        | DATA_TYPE_PRIORITY.get(food["dataType"], 0) << 3
+        | _COMPLETENESS_SCORE[completeness_mask(food)]
+    )
+
+
+# foods columns in insert order: FOOD_FIELDS, then priority.
+FOOD_COLUMNS = FOOD_FIELDS + ("priority",)
+FOOD_INSERT_SQL = (
+    f"INSERT OR IGNORE INTO foods ({', '.join(FOOD_COLUMNS)}) VALUES ({', '.join('?' * len(FOOD_COLUMNS))})"
+)
+
+# Secondary indexes on foods.
+# (category, name) and (brand, name) return category browse and brand
+# filter rows already in name order; the partial indexes keep only the
+# rows those queries can match. idx_foods_common_name serves every
+# isCommon = 1 lookup, getCommonFoods' ORDER BY name included, even
+# without ANALYZE stats. See benchmark_search.APP_QUERIES and --plan-gate.
+# foods.priority has no index of its own: ranked search reads it from the
+# foods row it already fetches by rowid (fdcId is the INTEGER PRIMARY KEY).
+FOOD_INDEXES = (
+    "CREATE INDEX idx_foods_category ON foods(category, name)",
+    "CREATE INDEX idx_foods_common_name ON foods(name) WHERE isCommon = 1",
+    "CREATE INDEX idx_foods_dataType ON foods(dataType)",
+    "CREATE INDEX idx_foods_brand ON foods(brand, name) WHERE brand IS NOT NULL",
+)
+
+
+def food_rows(foods):
+    """Yield insert tuples (FOOD_FIELDS order, then priority) without materializing a second list."""
+    for food in foods:
+        yield (
             food["fdcId"],
             food["name"],
             food["brand"],
@@ -643,30 +1528,57 @@ def build_database(all_foods: list):
             food.get("additionalNutrients"),
             food["dataType"],
             1 if food["isCommon"] else 0,
-        ))
-
-    cursor.executemany(insert_sql, rows)
-    inserted = cursor.rowcount
-    print(f"  Inserted {inserted} rows into foods table.")
+            food_priority(food),
+        )
 
-    # Create indexes for fast lookup
-    cursor.execute("CREATE INDEX idx_foods_category ON foods(category)")
-    cursor.execute("CREATE INDEX idx_foods_isCommon ON foods(isCommon)")
-    cursor.execute("CREATE INDEX idx_foods_dataType ON foods(dataType)")
-    cursor.execute("CREATE INDEX idx_foods_brand ON foods(brand)")
 
-    # Create FTS5 full-text search index
+# foods_fts layouts build_database can emit (--fts-profile). The app only
+# issues `"word"*` prefix queries ranked by bm25, so the trade-offs are:
+# - prefix: extra index entries per token prefix length; a prefix query of
+#   exactly that length becomes one term lookup instead of a term-range walk.
+# - detail=column drops token offsets (smaller), but phrase queries stop
+#   working, and a word the tokenizer splits ("o'brien", "7-up") is a phrase;
+#   the app then falls back to its LIKE scan.
+# - columnsize=0 drops the per-row token counts (smaller), but bm25 has to
+#   re-tokenize each candidate row from foods to rank it.
+class FtsProfile(NamedTuple):
+    prefix: str
+    detail: str
+    columnsize: int
+    description: str
+
+
+FTS_PROFILES = {
+    "baseline": FtsProfile("", "full", 1, "no prefix index (the original layout)"),
+    "prefix": FtsProfile("1 2 3", "full", 1, "prefix indexes for 1-3 character prefixes"),
+    "prefix-wide": FtsProfile("1 2 3 4 5", "full", 1, "prefix indexes for 1-5 character prefixes"),
+    "compact": FtsProfile("1 2 3", "column", 1, "1-3 prefixes, no token offsets"),
+    "minimal": FtsProfile("", "column", 0, "no prefix index, no offsets, no column sizes"),
+}
+DEFAULT_FTS_PROFILE = "baseline"
+
+
+def fts_options(profile: FtsProfile) -> str:
+    """The fts5() option list for foods_fts under `profile`."""
+    options = [
+        "content='foods'",
+        "content_rowid='fdcId'",
+        "tokenize='unicode61 remove_diacritics 2'",
+    ]
+    if profile.prefix:
+        options.append(f"prefix='{profile.prefix}'")
+    if profile.detail != "full":
+        options.append(f"detail={profile.detail}")
+    if not profile.columnsize:
+        options.append("columnsize=0")
+    return ", ".join(options)
+
+
+def create_fts_index(cursor: sqlite3.Cursor, fts_profile: str = DEFAULT_FTS_PROFILE):
+    """Create, populate and attach the sync triggers for foods_fts with the named FTS_PROFILES layout."""
+    profile = FTS_PROFILES[fts_profile]
     # FTS5 is built into iOS SQLite and handles word-boundary matching natively
-    print("  Creating FTS5 full-text search index...")
-    cursor.execute("""
-        CREATE VIRTUAL TABLE foods_fts USING fts5(
-            name,
-            brand,
-            content='foods',
-            content_rowid='fdcId',
-            tokenize='unicode61 remove_diacritics 2'
-        )
-    """)
+    cursor.execute(f"CREATE VIRTUAL TABLE foods_fts USING fts5(name, brand, {fts_options(profile)})")
 
     # Populate FTS index
     cursor.execute("""
@@ -696,6 +1608,312 @@ def build_database(all_foods: list):
         END
     """)
 
+
+def create_trigram_index(cursor: sqlite3.Cursor):
+    """
+    Create and populate foods_trigram, a trigram-tokenized FTS5 index over
+    name/brand, plus its sync triggers.
+
+    A quoted trigram MATCH is a case-insensitive substring test, the same
+    thing the app's `name LIKE '%q%' OR brand LIKE '%q%'` fallback checks by
+    scanning every row (see benchmark_search.TRIGRAM_SEARCH_SQL). Needs
+    SQLite 3.34+ (iOS 15).
+    """
+    cursor.execute("""
+        CREATE VIRTUAL TABLE foods_trigram USING fts5(
+            name,
+            brand,
+            content='foods',
+            content_rowid='fdcId',
+            tokenize='trigram'
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO foods_trigram(rowid, name, brand)
+        SELECT fdcId, name, COALESCE(brand, '') FROM foods
+    """)
+    cursor.execute("""
+        CREATE TRIGGER foods_trigram_ai AFTER INSERT ON foods BEGIN
+            INSERT INTO foods_trigram(rowid, name, brand)
+            VALUES (new.fdcId, new.name, COALESCE(new.brand, ''));
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER foods_trigram_ad AFTER DELETE ON foods BEGIN
+            INSERT INTO foods_trigram(foods_trigram, rowid, name, brand)
+            VALUES ('delete', old.fdcId, old.name, COALESCE(old.brand, ''));
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER foods_trigram_au AFTER UPDATE ON foods BEGIN
+            INSERT INTO foods_trigram(foods_trigram, rowid, name, brand)
+            VALUES ('delete', old.fdcId, old.name, COALESCE(old.brand, ''));
+            INSERT INTO foods_trigram(rowid, name, brand)
+            VALUES (new.fdcId, new.name, COALESCE(new.brand, ''));
+        END
+    """)
+
+
+class TypeaheadOptions(NamedTuple):
+    """--typeahead knobs: prefix lengths stored, ids kept per prefix, and the table's size budget."""
+    max_prefix_len: int = 4
+    top_k: int = 50
+    budget_mb: float = 2.0
+
+
+# Approximate per-row cost of a typeahead entry beyond prefix + ids
+# (record header, cell pointer, b-tree slack).
+TYPEAHEAD_ROW_OVERHEAD = 8
+
+
+def create_typeahead_table(cursor: sqlite3.Cursor, options: TypeaheadOptions = TypeaheadOptions()) -> dict:
+    """
+    Precompute the typeahead table: for every token prefix of up to
+    max_prefix_len characters, the top_k fdcIds of the ranked search for
+    `"prefix"*`, packed as a uint32 blob (see benchmark_search.TYPEAHEAD_SEARCH).
+    The options are recorded in typeahead_settings.
+
+    Prefixes come from the FTS vocabulary, so they are exactly the terms FTS
+    matches. When everything doesn't fit in budget_mb, the prefixes with the
+    most matching rows (the most expensive FTS queries) are kept first;
+    the rest stay on the FTS path. Must run after foods_fts is built.
+    Returns a small report dict.
+    """
+    cursor.execute("CREATE VIRTUAL TABLE temp.foods_fts_vocab USING fts5vocab(main, foods_fts, row)")
+    matches = defaultdict(int)
+    for term, docs in cursor.execute("SELECT term, doc FROM temp.foods_fts_vocab"):
+        if benchmark_search.typeahead_key(term) != term:
+            continue
+        for length in range(1, min(options.max_prefix_len, len(term)) + 1):
+            matches[term[:length]] += docs
+    cursor.execute("DROP TABLE temp.foods_fts_vocab")
+
+    budget = int(options.budget_mb * 1024 * 1024)
+    used = 0
+    kept = []
+    # Most matches first; ties go to the shorter prefix, then alphabetical.
+    for prefix in sorted(matches, key=lambda p: (-matches[p], len(p), p)):
+        cost = len(prefix) + 4 * min(options.top_k, matches[prefix]) + TYPEAHEAD_ROW_OVERHEAD
+        if used + cost > budget:
+            continue
+        used += cost
+        kept.append(prefix)
+
+    cursor.execute("CREATE TABLE typeahead (prefix TEXT PRIMARY KEY, ids BLOB NOT NULL) WITHOUT ROWID")
+    rows = []
+    for prefix in kept:
+        ranked = cursor.execute(
+            benchmark_search.RANKED_SEARCH_SQL, (benchmark_search.fts_query(prefix), options.top_k)
+        ).fetchall()
+        if ranked:
+            rows.append((prefix, benchmark_search.pack_ids([r[0] for r in ranked])))
+    cursor.executemany("INSERT INTO typeahead (prefix, ids) VALUES (?, ?)", rows)
+    cursor.execute(
+        "CREATE TABLE typeahead_settings (max_prefix_len INTEGER NOT NULL, top_k INTEGER NOT NULL, "
+        "budget_mb REAL NOT NULL)"
+    )
+    cursor.execute("INSERT INTO typeahead_settings VALUES (?, ?, ?)", tuple(options))
+
+    by_length = defaultdict(lambda: [0, 0])
+    kept_set = set(kept)
+    for prefix in matches:
+        by_length[len(prefix)][0 if prefix in kept_set else 1] += 1
+    return {
+        "prefixes": len(rows),
+        "dropped": len(matches) - len(kept),
+        "payload_bytes": sum(len(p) + len(ids) for p, ids in rows),
+        "estimated_bytes": used,
+        "by_length": {length: tuple(counts) for length, counts in sorted(by_length.items())},
+    }
+
+
+class SpellingOptions(NamedTuple):
+    """--spelling knobs: SymSpell edit distance, delete-generation prefix, shortest term indexed."""
+    max_edit_distance: int = 2
+    prefix_length: int = 7
+    min_term_len: int = 3
+
+
+def create_spelling_tables(cursor: sqlite3.Cursor, options: SpellingOptions = SpellingOptions()) -> dict:
+    """
+    Build the "did you mean" tables from the foods_fts vocabulary (see
+    benchmark_search.suggest): spell_terms (term, document frequency),
+    spell_deletes (SymSpell deletes -> packed term ids) and spell_settings.
+    Only alphabetic terms of min_term_len+ letters are indexed. Must run
+    after foods_fts is built. Returns a small report dict.
+    """
+    cursor.execute("CREATE VIRTUAL TABLE temp.foods_fts_vocab USING fts5vocab(main, foods_fts, row)")
+    terms = [
+        (term, docs)
+        for term, docs in cursor.execute("SELECT term, doc FROM temp.foods_fts_vocab ORDER BY term")
+        if len(term) >= options.min_term_len and benchmark_search.SPELL_WORD_RE.fullmatch(term)
+    ]
+    cursor.execute("DROP TABLE temp.foods_fts_vocab")
+
+    deletes = defaultdict(list)
+    for term_id, (term, _) in enumerate(terms, 1):
+        for key in benchmark_search.spelling_deletes(term[:options.prefix_length], options.max_edit_distance):
+            deletes[key].append(term_id)
+
+    cursor.execute("""
+        CREATE TABLE spell_terms (
+            id INTEGER PRIMARY KEY,
+            term TEXT NOT NULL UNIQUE,
+            freq INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("CREATE TABLE spell_deletes (del TEXT PRIMARY KEY, term_ids BLOB NOT NULL) WITHOUT ROWID")
+    cursor.execute("""
+        CREATE TABLE spell_settings (
+            max_edit_distance INTEGER NOT NULL,
+            prefix_length INTEGER NOT NULL,
+            min_term_len INTEGER NOT NULL
+        )
+    """)
+    cursor.executemany(
+        "INSERT INTO spell_terms (id, term, freq) VALUES (?, ?, ?)",
+        ((term_id, term, docs) for term_id, (term, docs) in enumerate(terms, 1)),
+    )
+    cursor.executemany(
+        "INSERT INTO spell_deletes (del, term_ids) VALUES (?, ?)",
+        ((key, benchmark_search.pack_ids(ids)) for key, ids in sorted(deletes.items())),
+    )
+    cursor.execute("INSERT INTO spell_settings VALUES (?, ?, ?)", tuple(options))
+    return {
+        "terms": len(terms),
+        "deletes": len(deletes),
+        "payload_bytes": sum(len(term) + 8 for term, _ in terms)
+                         + sum(len(key) + 4 * len(ids) for key, ids in deletes.items()),
+    }
+
+
+def build_database(all_foods: list, bulk_load: Optional[str] = None, output_db: Optional[Path] = None,
+                   fts_profile: str = DEFAULT_FTS_PROFILE, trigram: bool = False,
+                   typeahead: Optional[TypeaheadOptions] = None, spelling: Optional[SpellingOptions] = None,
+                   plan_gate: str = "warn", reproducible: bool = False):
+    """
+    Build the SQLite database with FTS5 search index.
+
+    With bulk_load ("memory" or "tempfile") rows are inserted in fdcId order
+    with journaling and fsyncs off, in memory or in a temp file next to the
+    output, then the FTS index is optimized, ANALYZE is run, and the result is
+    written to the output path with VACUUM INTO (compact, freshly-ordered pages).
+    Without it the output file is built in place, as before.
+
+    With trigram=True a foods_trigram substring index is added for the
+    search fallback (see create_trigram_index). With typeahead options the
+    prefix -> top-k table is precomputed (see create_typeahead_table), and
+    with spelling options the "did you mean" index (see create_spelling_tables).
+
+    Before the output is written, every registered app query is planned (see
+    check_query_plans). With plan_gate="fail" a query that scans foods or
+    sorts in a temp b-tree without declaring it raises QueryPlanError and no
+    database is left behind; "warn" only reports it, "off" skips the check.
+
+    With reproducible=True rows are always inserted in fdcId order and an
+    in-place build gets a fixed page size and a final VACUUM, so identical
+    inputs give a byte-identical file (see write_build_manifest).
+    """
+    output_db = Path(output_db or OUTPUT_DB)
+    mode = f"bulk-load ({bulk_load})" if bulk_load else "in place"
+    print(f"\nBuilding SQLite database with {len(all_foods)} foods ({mode})...")
+    start = time.perf_counter()
+
+    if output_db.exists():
+        output_db.unlink()
+
+    build_path = None
+    if bulk_load == "memory":
+        conn = sqlite3.connect(":memory:")
+    elif bulk_load == "tempfile":
+        build_path = output_db.with_name(output_db.name + ".building")
+        if build_path.exists():
+            build_path.unlink()
+        conn = sqlite3.connect(str(build_path))
+    elif bulk_load is None:
+        conn = sqlite3.connect(str(output_db))
+    else:
+        raise ValueError(f"unknown bulk_load mode {bulk_load!r}, expected one of {BULK_LOAD_MODES}")
+    cursor = conn.cursor()
+    if bulk_load:
+        for pragma in BULK_LOAD_PRAGMAS:
+            cursor.execute(pragma)
+    elif reproducible:
+        cursor.execute(BULK_LOAD_PRAGMAS[0])  # page_size
+
+    # Create main foods table.
+    # `additionalNutrients` is a JSON string of {"vitamin_a": 90, "calcium": 12, ...}
+    # matching the iOS additionalNutrients dict pattern. Keeps schema stable as
+    # we add nutrients without column migrations.
+    cursor.execute("""
+        CREATE TABLE foods (
+            fdcId INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            brand TEXT,
+            category TEXT NOT NULL DEFAULT 'Other',
+            servingSize TEXT NOT NULL DEFAULT '1',
+            servingUnit TEXT NOT NULL DEFAULT 'serving',
+            calories REAL NOT NULL DEFAULT 0,
+            protein REAL NOT NULL DEFAULT 0,
+            carbs REAL NOT NULL DEFAULT 0,
+            fat REAL NOT NULL DEFAULT 0,
+            fiber REAL NOT NULL DEFAULT 0,
+            sugar REAL,
+            sodium REAL,
+            cholesterol REAL,
+            saturatedFat REAL,
+            additionalNutrients TEXT,
+            dataType TEXT NOT NULL,
+            isCommon INTEGER NOT NULL DEFAULT 0,
+            priority INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+    # Insert all foods
+    if bulk_load or reproducible:
+        # Appending in rowid order fills foods' b-tree pages left to right
+        # instead of splitting them at random. The sort is stable, so
+        # INSERT OR IGNORE still keeps the first of any repeated fdcId.
+        all_foods = sorted(all_foods, key=lambda food: food["fdcId"])
+    with build_profile.stage("insert") as stage:
+        cursor.executemany(FOOD_INSERT_SQL, food_rows(all_foods))
+        inserted = stage.rows = cursor.rowcount
+    print(f"  Inserted {inserted} rows into foods table.")
+
+    # Create indexes for fast lookup
+    for index_sql in FOOD_INDEXES:
+        cursor.execute(index_sql)
+
+    # Create FTS5 full-text search index
+    print(f"  Creating FTS5 full-text search index ({fts_profile}: {FTS_PROFILES[fts_profile].description})...")
+    with build_profile.stage("fts_build") as stage:
+        create_fts_index(cursor, fts_profile)
+        stage.rows = inserted
+    if trigram:
+        print("  Creating trigram substring index...")
+        create_trigram_index(cursor)
+
+    if bulk_load:
+        # Merge the FTS b-trees into one segment and give the planner stats.
+        cursor.execute("INSERT INTO foods_fts(foods_fts) VALUES('optimize')")
+        if trigram:
+            cursor.execute("INSERT INTO foods_trigram(foods_trigram) VALUES('optimize')")
+        cursor.execute("ANALYZE")
+
+    if typeahead:
+        print(f"  Precomputing typeahead (prefixes <= {typeahead.max_prefix_len} chars, "
+              f"top {typeahead.top_k}, budget {typeahead.budget_mb} MB)...")
+        report = create_typeahead_table(cursor, typeahead)
+        print(f"    {report['prefixes']} prefixes stored, {report['dropped']} left to FTS (over budget), "
+              f"{report['payload_bytes'] / (1024 * 1024):.2f} MB payload")
+        for length, (stored, dropped) in report["by_length"].items():
+            print(f"    length {length}: {stored} stored, {dropped} dropped")
+    if spelling:
+        print(f"  Building spelling suggestions (edit distance {spelling.max_edit_distance}, "
+              f"prefix {spelling.prefix_length})...")
+        report = create_spelling_tables(cursor, spelling)
+        print(f"    {report['terms']} terms, {report['deletes']} delete keys, "
+              f"{report['payload_bytes'] / (1024 * 1024):.2f} MB payload")
     conn.commit()
 
     # Print stats
@@ -735,60 +1953,1063 @@ def build_database(all_foods: list):
         else:
             print(f'    "{q}" -> No results')
 
+    if plan_gate != "off":
+        violations = check_query_plans(conn, output_db.with_name(output_db.stem + ".plans.json"))
+        if violations and plan_gate == "fail":
+            conn.close()
+            for path in (build_path, output_db):
+                if path is not None and path.exists():
+                    path.unlink()
+            raise QueryPlanError(f"query plan regression in {', '.join(violations)}")
+
+    if bulk_load:
+        cursor.execute("VACUUM INTO ?", (str(output_db),))
+    elif reproducible:
+        # Repack every b-tree in key order so the page layout doesn't depend
+        # on the order pages were allocated during the build.
+        cursor.execute("VACUUM")
     conn.close()
+    if build_path is not None:
+        build_path.unlink()
+
+    elapsed = time.perf_counter() - start
+    size_mb = output_db.stat().st_size / (1024 * 1024)
+    print(f"\n  Output: {output_db} ({size_mb:.1f} MB, built in {elapsed:.1f}s)")
+
+
+# --incremental: diff the new foods against the existing database by fdcId
+# and apply only what changed, instead of rebuilding every row, index and
+# FTS entry. Rows are compared by a digest of their normalized values.
+_REAL_COLUMN_INDEXES = frozenset(
+    FOOD_COLUMNS.index(c) for c in ("calories", "protein", "carbs", "fat", "fiber", "sugar", "sodium",
+                                    "cholesterol", "saturatedFat")
+)
+FOOD_UPDATE_SQL = (
+    f"UPDATE foods SET {', '.join(f'{c} = ?' for c in FOOD_COLUMNS[1:])} WHERE fdcId = ?"
+)
+FTS_TRIGGERS = ("foods_ai", "foods_ad", "foods_au")
+TRIGRAM_TRIGGERS = ("foods_trigram_ai", "foods_trigram_ad", "foods_trigram_au")
+TYPEAHEAD_TABLES = ("typeahead", "typeahead_settings")
+SPELLING_TABLES = ("spell_terms", "spell_deletes", "spell_settings")
+# VACUUM after an update once this share of the file is free pages.
+VACUUM_FREE_RATIO = 0.1
+
+
+def row_digest(row: tuple) -> bytes:
+    """
+    Digest of one foods row (FOOD_COLUMNS order), either an insert tuple from
+    food_rows or a row read back from SQLite: REAL columns are compared as
+    floats, since an int stored in one reads back as a float.
+    """
+    values = tuple(float(v) if i in _REAL_COLUMN_INDEXES and v is not None else v for i, v in enumerate(row))
+    return hashlib.blake2b(repr(values).encode(), digest_size=16).digest()
+
+
+@contextmanager
+def timed_phase(phases: dict, name: str):
+    """Record the wall time of the `with` body in phases[name] (and as a --profile stage)."""
+    start = time.perf_counter()
+    try:
+        with build_profile.stage(name):
+            yield
+    finally:
+        phases[name] = time.perf_counter() - start
+
+
+def stored_settings(cursor: sqlite3.Cursor, tables: set, table: str) -> Optional[tuple]:
+    """The options row a derived table was built with (typeahead_settings, spell_settings), or None."""
+    if table not in tables:
+        return None
+    return cursor.execute(f"SELECT * FROM {table}").fetchone()
+
+
+def incremental_mismatch(conn: sqlite3.Connection, fts_profile: str) -> Optional[str]:
+    """Why the existing database can't be updated in place (schema differs from this build), or None."""
+    master = {name: sql for name, sql in conn.execute("SELECT name, sql FROM sqlite_master")}
+    if "foods" not in master:
+        return "no foods table"
+    columns = tuple(row[1] for row in conn.execute("PRAGMA table_info(foods)"))
+    if columns != FOOD_COLUMNS:
+        return "foods columns differ"
+    indexes = {sql for name, sql in master.items() if name.startswith("idx_foods_")}
+    if indexes != set(FOOD_INDEXES):
+        return "foods indexes differ"
+    if fts_options(FTS_PROFILES[fts_profile]) not in (master.get("foods_fts") or ""):
+        return f"foods_fts was not built with the {fts_profile} profile"
+    if any(trigger not in master for trigger in FTS_TRIGGERS):
+        return "FTS sync triggers missing"
+    return None
+
+
+def update_database(all_foods: list, output_db: Optional[Path] = None, fts_profile: str = DEFAULT_FTS_PROFILE,
+                    trigram: bool = False, typeahead: Optional[TypeaheadOptions] = None,
+                    spelling: Optional[SpellingOptions] = None, plan_gate: str = "warn", bulk_load=None):
+    """
+    Bring an existing database up to date with `all_foods` (--incremental).
+
+    Every food row is digested (row_digest) and diffed against the database
+    by fdcId; only the inserts, updates and deletes are applied, through
+    foods' FTS sync triggers, in one transaction. The typeahead and spelling
+    tables, which are derived from the whole FTS vocabulary, are rebuilt
+    inside the same transaction when anything changed or when they were
+    built with other options than `typeahead` / `spelling`; the trigram
+    index has its own triggers. Falls back to build_database when there is
+    no database yet or its schema differs from what this build would create.
+
+    The query plan gate runs before COMMIT: with plan_gate="fail" a
+    violation rolls the transaction back, so the database is left as it was.
+    """
+    output_db = Path(output_db or OUTPUT_DB)
+    options = dict(fts_profile=fts_profile, trigram=trigram, typeahead=typeahead, spelling=spelling,
+                   plan_gate=plan_gate)
+    if not output_db.exists():
+        print(f"\n  {output_db} does not exist yet, doing a full build.")
+        build_database(all_foods, bulk_load=bulk_load, output_db=output_db, **options)
+        return
+    conn = sqlite3.connect(str(output_db), isolation_level=None)
+    mismatch = incremental_mismatch(conn, fts_profile)
+    if mismatch:
+        conn.close()
+        print(f"\n  Can't update {output_db} in place ({mismatch}), doing a full build.")
+        build_database(all_foods, bulk_load=bulk_load, output_db=output_db, **options)
+        return
+
+    print(f"\nUpdating SQLite database with {len(all_foods)} foods (incremental)...")
+    start = time.perf_counter()
+    phases = {}
+    cursor = conn.cursor()
+
+    with timed_phase(phases, "hash new rows"):
+        new_rows = {}
+        for row in food_rows(all_foods):
+            # First food per fdcId wins, as with INSERT OR IGNORE.
+            if row[0] not in new_rows:
+                new_rows[row[0]] = (row, row_digest(row))
+    with timed_phase(phases, "hash existing rows"):
+        existing = {row[0]: row_digest(row) for row in cursor.execute(f"SELECT {', '.join(FOOD_COLUMNS)} FROM foods")}
+    with timed_phase(phases, "diff"):
+        inserts = [row for fdc_id, (row, _) in new_rows.items() if fdc_id not in existing]
+        updates = [row[1:] + row[:1] for fdc_id, (row, digest) in new_rows.items()
+                   if fdc_id in existing and existing[fdc_id] != digest]
+        deletes = [(fdc_id,) for fdc_id in existing if fdc_id not in new_rows]
+    changed = bool(inserts or updates or deletes)
+    tables = {name for (name,) in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    rebuild_typeahead = bool(typeahead) and (
+        changed or stored_settings(cursor, tables, "typeahead_settings") != tuple(typeahead))
+    rebuild_spelling = bool(spelling) and (
+        changed or stored_settings(cursor, tables, "spell_settings") != tuple(spelling))
+
+    cursor.execute("BEGIN")
+    try:
+        with timed_phase(phases, "derived tables (drop)"):
+            if "foods_trigram" in tables and not trigram:
+                for trigger in TRIGRAM_TRIGGERS:
+                    cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+                cursor.execute("DROP TABLE foods_trigram")
+            if "typeahead" in tables and (rebuild_typeahead or not typeahead):
+                for table in TYPEAHEAD_TABLES:
+                    cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            if "spell_terms" in tables and (rebuild_spelling or not spelling):
+                for table in SPELLING_TABLES:
+                    cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        with timed_phase(phases, "delete"):
+            cursor.executemany("DELETE FROM foods WHERE fdcId = ?", deletes)
+        with timed_phase(phases, "update"):
+            cursor.executemany(FOOD_UPDATE_SQL, updates)
+        with timed_phase(phases, "insert"):
+            cursor.executemany(FOOD_INSERT_SQL, inserts)
+        with timed_phase(phases, "derived tables (build)"):
+            if trigram and "foods_trigram" not in tables:
+                create_trigram_index(cursor)
+            if rebuild_typeahead:
+                create_typeahead_table(cursor, typeahead)
+            if rebuild_spelling:
+                create_spelling_tables(cursor, spelling)
+        if changed:
+            with timed_phase(phases, "fts optimize"):
+                cursor.execute("INSERT INTO foods_fts(foods_fts) VALUES('optimize')")
+                if trigram:
+                    cursor.execute("INSERT INTO foods_trigram(foods_trigram) VALUES('optimize')")
+                if "sqlite_stat1" in tables:
+                    cursor.execute("ANALYZE")
+        violations = []
+        if plan_gate != "off":
+            violations = check_query_plans(conn, output_db.with_name(output_db.stem + ".plans.json"))
+        if violations and plan_gate == "fail":
+            raise QueryPlanError(f"query plan regression in {', '.join(violations)}; {output_db} left unchanged")
+        with timed_phase(phases, "commit"):
+            cursor.execute("COMMIT")
+    except BaseException:
+        cursor.execute("ROLLBACK")
+        conn.close()
+        raise
+
+    page_count = cursor.execute("PRAGMA page_count").fetchone()[0]
+    free_pages = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+    if page_count and free_pages / page_count > VACUUM_FREE_RATIO:
+        with timed_phase(phases, "vacuum"):
+            cursor.execute("VACUUM")
+    conn.close()
+
+    unchanged = len(new_rows) - len(inserts) - len(updates)
+    print(f"\n  Changes: {len(inserts)} inserted, {len(updates)} updated, {len(deletes)} deleted, "
+          f"{unchanged} unchanged.")
+    print("  Phases:")
+    for name, seconds in phases.items():
+        print(f"    {name:<24} {seconds:8.3f}s")
+    size_mb = output_db.stat().st_size / (1024 * 1024)
+    print(f"\n  Output: {output_db} ({size_mb:.1f} MB, updated in {time.perf_counter() - start:.1f}s)")
+
+
+# --reproducible: <output>.manifest.json records what a build was made from
+# and what it produced, so an unchanged rebuild can be skipped and delta
+# tooling (food_delta.py) can tell two builds apart without diffing them.
+BUILD_MANIFEST_SUFFIX = ".manifest.json"
+# main() arguments that change the output database.
+BUILD_OUTPUT_OPTIONS = (
+    "bulk_load", "fts_profile", "trigram", "typeahead", "typeahead_prefix_len", "typeahead_k",
+    "typeahead_budget_mb", "spelling", "spell_distance", "top_brands", "brand_weight", "max_size_mb",
+)
+
+
+def build_manifest_path(output_db: Path) -> Path:
+    return output_db.with_name(output_db.stem + BUILD_MANIFEST_SUFFIX)
+
+
+def build_inputs(sources: dict, options: dict, brand_manifest: Optional[Path] = None) -> dict:
+    """
+    Everything a reproducible build's output depends on: the source zips'
+    checksums, the output-affecting options, a hash of the builder code,
+    and the SQLite version (which writes the file format).
+    """
+    code = hashlib.sha256()
+    for module in (__file__, benchmark_search.__file__):
+        code.update(Path(module).read_bytes())
+    inputs = {
+        "sources": {data_type: source_checksum(source) for data_type, source in sources.items()},
+        "options": {k: options[k] for k in BUILD_OUTPUT_OPTIONS if k in options},
+        "builder_sha256": code.hexdigest(),
+        "sqlite_version": sqlite3.sqlite_version,
+    }
+    if brand_manifest is not None:
+        inputs["brand_manifest_sha256"] = sha256_file(brand_manifest)
+    return inputs
+
+
+def build_is_current(output_db: Path, inputs: dict) -> bool:
+    """True if output_db was built from exactly `inputs` and hasn't changed since."""
+    manifest_path = build_manifest_path(output_db)
+    if None in inputs["sources"].values():
+        return False  # a source with no known checksum can't be compared
+    if not output_db.exists() or not manifest_path.exists():
+        return False
+    try:
+        manifest = json.loads(manifest_path.read_text())
+    except ValueError:
+        return False
+    return manifest.get("inputs") == inputs and manifest.get("output", {}).get("sha256") == sha256_file(output_db)
 
-    size_mb = OUTPUT_DB.stat().st_size / (1024 * 1024)
-    print(f"\n  Output: {OUTPUT_DB} ({size_mb:.1f} MB)")
+
+def write_build_manifest(output_db: Path, inputs: dict) -> dict:
+    """Record `inputs` with the output's file hash, content checksum and row count next to output_db."""
+    conn = sqlite3.connect(f"file:{output_db}?mode=ro", uri=True)
+    try:
+        output = {
+            "file": output_db.name,
+            "bytes": output_db.stat().st_size,
+            "sha256": sha256_file(output_db),
+            "content_checksum": food_delta.content_checksum(conn),
+            "foods": conn.execute("SELECT COUNT(*) FROM foods").fetchone()[0],
+        }
+    finally:
+        conn.close()
+    manifest = {"inputs": inputs, "output": output}
+    manifest_path = build_manifest_path(output_db)
+    manifest_path.write_text(json.dumps(manifest, indent=2, sort_keys=True) + "\n")
+    print(f"  Build manifest: {manifest_path} (sha256 {output['sha256'][:12]}...)")
+    return manifest
+
+
+PLAN_GATE_MODES = ("off", "warn", "fail")
+
+
+class QueryPlanError(Exception):
+    """A registered app query scans foods or sorts in a temp b-tree it does not declare."""
+
+
+def check_query_plans(conn: sqlite3.Connection, report_path: Optional[Path] = None) -> list:
+    """
+    Run EXPLAIN QUERY PLAN for every query in benchmark_search.APP_QUERIES,
+    print a per-query report, and write it as JSON to `report_path`.
+    Returns the names of queries whose plan has an undeclared full scan of
+    foods or temp b-tree.
+    """
+    results = benchmark_search.check_plans(conn)
+    print("\n  Query plans:")
+    for result in results:
+        print(f"    {result['name']:<16} {result['status']}" + (f" ({result['note']})" if result["note"] else ""))
+        for detail in result["plan"]:
+            print(f"      {detail}")
+    violations = [result["name"] for result in results if result["status"] == "violation"]
+    for name in violations:
+        print(f"  WARNING: {name} scans foods or uses a temp b-tree")
+
+    if report_path is not None:
+        report = {"sqlite_version": sqlite3.sqlite_version, "violations": violations, "queries": results}
+        report_path.write_text(json.dumps(report, indent=2))
+        print(f"  Plan report: {report_path}")
+    return violations
+
+
+# --max-size-mb: instead of relying on TOP_BRAND_OWNERS alone to keep the
+# database small, every candidate food gets a utility score and foods are
+# packed best first until the estimated size reaches the budget.
+UTILITY_WEIGHTS = {
+    "common": 4.0,        # isCommon
+    "generic": 2.0,       # no brand
+    "data_type": 1.0,     # per DATA_TYPE_PRIORITY step (foundation 3 .. branded 0)
+    "completeness": 2.0,  # scaled by COMPLETENESS_FIELDS present / 7
+    "brand": 2.0,         # log-scaled share of the candidates from the food's brand
+}
+
+# Estimated on-disk bytes per food: the foods row plus its entries in the
+# indexes and foods_fts. Fitted on real and synthetic builds; each budget
+# pass rescales it by the actual/estimated size of the previous pass.
+FOOD_FIXED_BYTES = 200
+NAME_BYTES_FACTOR = 2.5   # foods row, idx_foods_category, foods_fts postings
+BRAND_BYTES_FACTOR = 2.0  # foods row, idx_foods_brand, foods_fts postings
+MAX_BUDGET_PASSES = 4
+# A pass that fits within this fraction of the budget is good enough.
+BUDGET_SLACK = 0.03
+
+
+def estimated_food_bytes(food: dict) -> int:
+    """Rough on-disk size of one food (see FOOD_FIXED_BYTES)."""
+    return int(
+        FOOD_FIXED_BYTES
+        + NAME_BYTES_FACTOR * len(food["name"])
+        + BRAND_BYTES_FACTOR * len(food["brand"] or "")
+        + len(food.get("additionalNutrients") or "")
+        + len(food["category"] or "") + len(food["servingSize"]) + len(food["servingUnit"])
+    )
+
+
+def utility_components(food: dict, brand_counts: Counter, log_max_brand: float) -> dict:
+    """Weighted UTILITY_WEIGHTS terms for one food; their sum is its utility."""
+    brand = (food["brand"] or "").lower()
+    brand_share = math.log1p(brand_counts[brand]) / log_max_brand if brand and log_max_brand else 0.0
+    return {
+        "common": UTILITY_WEIGHTS["common"] * (1 if food["isCommon"] else 0),
+        "generic": UTILITY_WEIGHTS["generic"] * (0 if brand else 1),
+        "data_type": UTILITY_WEIGHTS["data_type"] * DATA_TYPE_PRIORITY.get(food["dataType"], 0),
+        "completeness": UTILITY_WEIGHTS["completeness"] * _COMPLETENESS_SCORE[completeness_mask(food)]
+                        / len(COMPLETENESS_FIELDS),
+        "brand": UTILITY_WEIGHTS["brand"] * brand_share,
+    }
+
+
+def rank_by_utility(foods: list) -> tuple:
+    """
+    Score every food and sort best first (ties by fdcId, so the order is
+    reproducible). Returns (ranked foods, their utilities, their components).
+    A repeated fdcId keeps only its first food, as INSERT OR IGNORE would.
+    """
+    seen = set()
+    foods = [food for food in foods if not (food["fdcId"] in seen or seen.add(food["fdcId"]))]
+    brand_counts = Counter((food["brand"] or "").lower() for food in foods if food["brand"])
+    log_max_brand = math.log1p(max(brand_counts.values(), default=0))
+    components = [utility_components(food, brand_counts, log_max_brand) for food in foods]
+    utilities = [sum(parts.values()) for parts in components]
+    order = sorted(range(len(foods)), key=lambda i: (-utilities[i], foods[i]["fdcId"]))
+    return [foods[i] for i in order], [utilities[i] for i in order], [components[i] for i in order]
+
+
+def budget_report(ranked: list, utilities: list, components: list, kept: int, passes: list,
+                  budget_bytes: int, actual_bytes: int) -> dict:
+    """What --max-size-mb kept and cut, and why: per data type, per brand, and every cut food's score."""
+    cut = ranked[kept:]
+    by_type = Counter(food["dataType"] for food in ranked)
+    cut_by_type = Counter(food["dataType"] for food in cut)
+    by_brand = Counter(food["brand"] for food in ranked if food["brand"])
+    cut_by_brand = Counter(food["brand"] for food in cut if food["brand"])
+
+    def mean_completeness(foods):
+        return sum(_COMPLETENESS_SCORE[completeness_mask(food)] for food in foods) / len(foods) if foods else 0.0
+
+    return {
+        "budget_bytes": budget_bytes,
+        "actual_bytes": actual_bytes,
+        "passes": passes,
+        "weights": UTILITY_WEIGHTS,
+        "candidates": len(ranked),
+        "kept": kept,
+        "cut": len(cut),
+        "utility_cutoff": utilities[kept - 1] if 0 < kept < len(ranked) else None,
+        "common_cut": sum(1 for food in cut if food["isCommon"]),
+        "completeness_kept": mean_completeness(ranked[:kept]),
+        "completeness_cut": mean_completeness(cut),
+        "by_data_type": {dt: {"candidates": n, "cut": cut_by_type[dt]} for dt, n in by_type.most_common()},
+        "brands_cut": [{"brand": brand, "candidates": by_brand[brand], "cut": n}
+                       for brand, n in cut_by_brand.most_common()],
+        "cut_foods": [
+            {"fdcId": food["fdcId"], "name": food["name"], "brand": food["brand"], "dataType": food["dataType"],
+             "utility": round(utility, 3), "components": {k: round(v, 3) for k, v in parts.items()}}
+            for food, utility, parts in zip(cut, utilities[kept:], components[kept:])
+        ],
+    }
+
+
+def print_budget_report(report: dict):
+    mb = 1024 * 1024
+    print(f"\n  Size budget: {report['budget_bytes'] / mb:.1f} MB, actual {report['actual_bytes'] / mb:.2f} MB")
+    print(f"    Kept {report['kept']} of {report['candidates']} candidate foods, cut {report['cut']}"
+          + (f" (utility below {report['utility_cutoff']:.2f})" if report["utility_cutoff"] is not None else ""))
+    if not report["cut"]:
+        return
+    print(f"    Common foods cut: {report['common_cut']}")
+    print(f"    Mean completeness: kept {report['completeness_kept']:.1f}/{len(COMPLETENESS_FIELDS)}, "
+          f"cut {report['completeness_cut']:.1f}/{len(COMPLETENESS_FIELDS)}")
+    print("    Cut by data type:")
+    for dt, counts in report["by_data_type"].items():
+        print(f"      {dt:<12} {counts['cut']:>7} of {counts['candidates']}")
+    print("    Brands losing the most foods:")
+    for entry in report["brands_cut"][:10]:
+        print(f"      {entry['brand'][:40]:<40} {entry['cut']:>6} of {entry['candidates']}")
+
+
+def build_within_budget(all_foods: list, max_size_mb: float, output_db: Optional[Path] = None, **build_options):
+    """
+    build_database with at most `max_size_mb` on disk (--max-size-mb).
+
+    Foods are ranked by utility (rank_by_utility) and the best prefix whose
+    estimated size fits the budget is built. The estimate is then checked
+    against the real file size: a pass over budget, or well under it with
+    foods still cut, rescales the estimate by actual/estimated and packs
+    again. The report of what was cut is printed and written to
+    <output>.budget.json.
+    """
+    output_db = Path(output_db or OUTPUT_DB)
+    budget_bytes = int(max_size_mb * 1024 * 1024)
+    ranked, utilities, components = rank_by_utility(all_foods)
+    estimates = list(accumulate(estimated_food_bytes(food) for food in ranked))
+
+    def build(count: int) -> int:
+        build_database(ranked[:count], output_db=output_db, **build_options)
+        return output_db.stat().st_size
+
+    # Aim for the middle of the slack window so a growing pass is unlikely to overshoot.
+    target = budget_bytes * (1 - BUDGET_SLACK / 2)
+    scale = 1.0
+    passes = []
+    fitting = None  # largest food count that built within the budget
+    for n in range(1, MAX_BUDGET_PASSES + 1):
+        count = bisect.bisect_right(estimates, target / scale)
+        if passes and count == passes[-1]["foods"]:
+            break
+        estimated = int(estimates[count - 1] * scale) if count else 0
+        actual = build(count)
+        passes.append({"foods": count, "estimated_bytes": estimated, "actual_bytes": actual})
+        print(f"\n  Budget pass {n}: {count} foods, estimated {estimated / (1024 * 1024):.2f} MB, "
+              f"actual {actual / (1024 * 1024):.2f} MB")
+        if actual <= budget_bytes:
+            fitting = count
+            if count == len(ranked) or actual >= budget_bytes * (1 - BUDGET_SLACK):
+                break
+        elif fitting is not None:
+            break
+        if count:
+            scale *= actual / estimated
+
+    last = passes[-1]["foods"]
+    if fitting is None:
+        print(f"  WARNING: still over budget after {len(passes)} passes")
+        fitting = last
+    elif fitting != last:
+        build(fitting)
+    report = budget_report(ranked, utilities, components, fitting, passes, budget_bytes,
+                           output_db.stat().st_size)
+    print_budget_report(report)
+    report_path = output_db.with_name(output_db.stem + ".budget.json")
+    report_path.write_text(json.dumps(report, indent=1))
+    print(f"  Budget report: {report_path}")
+    return report
+
+
+# --stage-cache runs steps 2-4 of main() as a pipeline of content-addressed
+# stages. A stage's fingerprint hashes its inputs (upstream fingerprints,
+# source zip checksums, options) with its code version; its output is kept
+# in STAGE_CACHE_DIR as <stage>-<fingerprint>.parquet and loaded instead of
+# recomputed while the fingerprint is unchanged. Dedup only looks at names,
+# brands and nutrients, so it runs before categorize here: editing the
+# keyword tables or COMMON_FOOD_TERMS reruns just categorize and write.
+# Entries are never pruned; delete the directory to reclaim the space.
+STAGE_CACHE_DIR = DATA_DIR / "stage_cache"
+STAGE_WRITE_RECORD = "write.json"
+# Bump to invalidate every cached stage, e.g. after changing a helper that
+# STAGE_CODE doesn't list.
+PIPELINE_VERSION = 1
+
+FOOD_ARROW_SCHEMA = pa.schema(
+    [("fdcId", pa.int64())]
+    + [(k, pa.string()) for k in ("name", "brand", "category", "servingSize", "servingUnit")]
+    + [(k, pa.float64()) for k in ("calories", "protein", "carbs", "fat", "fiber", "sugar", "sodium",
+                                   "cholesterol", "saturatedFat")]
+    + [("additionalNutrients", pa.string()), ("dataType", pa.string()), ("isCommon", pa.bool_())]
+)
+
+# What each stage's code version covers: the modules, functions and classes
+# it runs (by source) and the tables it reads (by value). The write stage
+# hashes all of benchmark_search: the typeahead and spelling tables are built
+# with its search SQL, query and packing helpers.
+STAGE_CODE = {
+    "parse": (
+        process_dataset, process_foundation_and_legacy, process_branded, defer_classification,
+        load_nutrients, read_nutrient_columns, NutrientTable, nutrient_value, load_food_portions,
+        load_nutrients_dictreader, load_food_descriptions, load_food_descriptions_dictreader, find_csv,
+        ZipMember, is_parquet, open_csv_binary, open_csv_text, csv_columns, source_checksum, iter_csv_rows,
+        iter_column_batches, build_parquet_cache, csv_to_parquet, clean_food_name, extras_json,
+        scan_top_brand_rows, brand_key_matches, canonical_brand, resolve_top_brands, select_top_brands,
+        SpaceSaving, NUTRIENT_IDS, ADDITIONAL_NUTRIENT_KEYS, TOP_BRAND_OWNERS, BRAND_LEGAL_SUFFIXES,
+        BRANDED_FIELDS, BRAND_SKETCH_FACTOR, PARQUET_CACHE_TABLES, NUTRIENT_CSV_BLOCK_SIZE,
+    ),
+    "dedup": (dedup_foods, dedup_key, completeness_mask, COMPLETENESS_FIELDS),
+    "categorize": (
+        classify_deferred, classify_foods, categorize_foods, is_common_foods, KeywordMatcher,
+        CATEGORY_KEYWORDS, NAME_KEYWORDS, COMMON_FOOD_TERMS,
+    ),
+    "write": (
+        build_database, update_database, incremental_mismatch, row_digest, stored_settings,
+        build_within_budget, rank_by_utility, utility_components,
+        estimated_food_bytes, food_rows, food_priority, fts_options, create_fts_index, create_trigram_index,
+        create_typeahead_table, create_spelling_tables, FOOD_COLUMNS, FOOD_INDEXES, FTS_PROFILES,
+        BULK_LOAD_PRAGMAS, UTILITY_WEIGHTS, benchmark_search,
+    ),
+}
+
+
+@lru_cache(maxsize=None)
+def code_version(stage: str) -> str:
+    """SHA-256 over the source and tables STAGE_CODE lists for `stage`."""
+    digest = hashlib.sha256(f"pipeline {PIPELINE_VERSION}".encode())
+    for obj in STAGE_CODE[stage]:
+        if callable(obj) or inspect.ismodule(obj):
+            digest.update(inspect.getsource(obj).encode())
+        else:
+            # Sets by sorted members; anything else JSON lacks (pyarrow types) by str().
+            digest.update(json.dumps(obj, sort_keys=True,
+                                     default=lambda o: sorted(o) if isinstance(o, (set, frozenset)) else str(o)).encode())
+    return digest.hexdigest()
+
+
+def stage_fingerprint(stage: str, inputs) -> str:
+    """Fingerprint of one run of `stage` on `inputs` (anything JSON-serialisable)."""
+    payload = {"stage": stage, "code": code_version(stage), "inputs": inputs}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class StageCache:
+    """Food lists stored by stage fingerprint as zstd Parquet files, plus a record of the last write."""
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = cache_dir
+
+    def path(self, name: str, key: str) -> Path:
+        return self.cache_dir / f"{name}-{key[:16]}.parquet"
+
+    def load(self, name: str, key: Optional[str]) -> Optional[list]:
+        if key is None or not self.path(name, key).is_file():
+            return None
+        columns = pq.read_table(self.path(name, key)).to_pydict()
+        return [dict(zip(FOOD_FIELDS, row)) for row in zip(*(columns[k] for k in FOOD_FIELDS))]
+
+    def store(self, name: str, key: Optional[str], foods: list):
+        if key is None:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        table = pa.table({k: [food[k] for food in foods] for k in FOOD_FIELDS}, schema=FOOD_ARROW_SCHEMA)
+        path = self.path(name, key)
+        tmp = path.with_suffix(".tmp")
+        pq.write_table(table, tmp, compression="zstd")
+        os.replace(tmp, path)
+
+    def write_records(self) -> dict:
+        return load_manifest(self.cache_dir / STAGE_WRITE_RECORD)
+
+    def write_is_current(self, key: Optional[str], output_db: Path) -> bool:
+        """True if output_db was last written by the write stage `key` and is unchanged since."""
+        record = self.write_records().get(str(output_db))
+        return (key is not None and record is not None and record["key"] == key
+                and output_db.exists() and sha256_file(output_db) == record["sha256"])
+
+    def record_write(self, key: Optional[str], output_db: Path):
+        if key is None:
+            return
+        records = self.write_records()
+        records[str(output_db)] = {"key": key, "sha256": sha256_file(output_db)}
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        save_manifest(self.cache_dir / STAGE_WRITE_RECORD, records)
+
+
+def brand_inputs(brands: Optional[BrandSelection]):
+    """The part of a BrandSelection that decides which branded foods are parsed."""
+    if brands is None:
+        return None  # TOP_BRAND_OWNERS, covered by the parse code version
+    if brands.reuse:
+        return {"manifest_sha256": sha256_file(brands.manifest)}
+    return {"top_n": brands.top_n, "weight": brands.weight}
+
+
+def parse_stage(sources: dict, parse_keys: dict, cache: StageCache, workers: int = 1,
+                brands: Optional[BrandSelection] = None) -> list:
+    """process_datasets(classify=False) per dataset, loading datasets whose parse fingerprint is cached."""
+    parsed = {}
+    for data_type, key in parse_keys.items():
+        parsed[data_type] = cache.load(f"parse-{data_type}", key)
+        if parsed[data_type] is not None:
+            print(f"  [{data_type}] Cached ({len(parsed[data_type])} foods, parse {key[:12]}).")
+    missing = [data_type for data_type in sources if parsed[data_type] is None]
+
+    if workers > 1 and len(missing) > 1:
+        print(f"  Processing {len(missing)} datasets in {min(workers, len(missing))} worker processes...")
+        profile = build_profile.worker_settings()
+        with ProcessPoolExecutor(max_workers=min(workers, len(missing))) as pool:
+            futures = {data_type: pool.submit(build_profile.worker_call, profile, process_dataset_compact,
+                                              data_type, sources[data_type], brands, False)
+                       for data_type in missing}
+            for data_type, future in futures.items():
+                rows, stages = future.result()
+                build_profile.PROFILER.merge(stages)
+                parsed[data_type] = [dict(zip(FOOD_FIELDS, row)) for row in rows]
+    else:
+        for data_type in missing:
+            parsed[data_type] = process_dataset(data_type, sources[data_type], brands, classify=False)
+    for data_type in missing:
+        cache.store(f"parse-{data_type}", parse_keys[data_type], parsed[data_type])
+
+    # Concatenate in `sources` order, as process_datasets does.
+    return [food for data_type in sources for food in parsed[data_type]]
+
+
+def run_pipeline(sources: dict, write_inputs: dict, cache: StageCache, workers: int = 1,
+                 brands: Optional[BrandSelection] = None, output_db: Optional[Path] = None) -> tuple:
+    """
+    Steps 2-3 of main() through the stage cache (parse -> dedup -> categorize).
+
+    Returns (foods, write_key): the deduplicated, categorized foods, and the
+    write stage's fingerprint for cache.record_write once they are written
+    with `write_inputs`. foods is None if output_db already holds exactly
+    that write. A source without a zip checksum can't be fingerprinted, so
+    then every stage runs and nothing is cached.
+    """
+    output_db = output_db or OUTPUT_DB
+    parse_keys = {}
+    for data_type, source in sources.items():
+        checksum = source_checksum(source)
+        parse_keys[data_type] = stage_fingerprint("parse", {
+            "dataset": data_type,
+            "source_sha256": checksum,
+            "brands": brand_inputs(brands) if data_type == "branded" else None,
+        }) if checksum else None
+
+    deduped_key = categorized_key = write_key = None
+    if all(parse_keys.values()):
+        deduped_key = stage_fingerprint("dedup", list(parse_keys.values()))
+        categorized_key = stage_fingerprint("categorize", deduped_key)
+        write_key = stage_fingerprint("write", {"foods": categorized_key, "options": write_inputs,
+                                                "output": output_db})
+    if cache.write_is_current(write_key, output_db):
+        return None, write_key
+
+    foods = cache.load("categorize", categorized_key)
+    if foods is not None:
+        print(f"\n2-3. Using cached categorized foods ({len(foods)} foods, categorize {categorized_key[:12]}).")
+        return foods, write_key
+
+    unique_foods = cache.load("dedup", deduped_key)
+    if unique_foods is not None:
+        print(f"\n2-3. Using cached deduplicated foods ({len(unique_foods)} foods, dedup {deduped_key[:12]}).")
+    else:
+        print(f"\n2. Processing datasets (stage cache: {cache.cache_dir})...")
+        all_foods = parse_stage(sources, parse_keys, cache, workers, brands)
+        print(f"\n3. Deduplicating {len(all_foods)} total foods...")
+        unique_foods = dedup_foods(all_foods)
+        print(f"  After dedup: {len(unique_foods)} unique foods.")
+        cache.store("dedup", deduped_key, unique_foods)
+
+    print(f"  Categorizing {len(unique_foods)} foods...")
+    with build_profile.stage("categorize") as stage:
+        classify_deferred(unique_foods)
+        stage.rows = len(unique_foods)
+    cache.store("categorize", categorized_key, unique_foods)
+    return unique_foods, write_key
+
+
+# Query kinds from benchmark_search that the FTS stage answers on its own.
+FTS_PROFILE_QUERY_KINDS = ("prefix", "multiword", "brand")
+
+
+def compare_fts_profiles(db_path: Path, profiles: Optional[list] = None, queries: int = 2000, seed: int = 0,
+                         repeat: int = 3) -> list:
+    """
+    Rebuild foods_fts of a finished database under each FTS profile and
+    replay the app's prefix searches (benchmark_search corpus, best of
+    `repeat` runs per query) against it.
+
+    Prints each profile's file size and latency against the baseline layout
+    and returns one {"profile", "size_bytes", "summary"} dict per profile.
+    """
+    db_path = Path(db_path)
+    profiles = list(profiles or FTS_PROFILES)
+    if DEFAULT_FTS_PROFILE not in profiles:
+        profiles.insert(0, DEFAULT_FTS_PROFILE)
+    print(f"\n  Comparing FTS profiles on {db_path} ({', '.join(profiles)})...")
+
+    src = sqlite3.connect(str(db_path))
+    corpus = [entry for entry in benchmark_search.generate_corpus(src, queries, seed)
+              if entry[0] in FTS_PROFILE_QUERY_KINDS]
+    results = []
+    with tempfile.TemporaryDirectory(dir=db_path.parent) as tmp:
+        for name in profiles:
+            path = Path(tmp) / f"{name}.sqlite"
+            src.execute("VACUUM INTO ?", (str(path),))
+            conn = sqlite3.connect(str(path))
+            cursor = conn.cursor()
+            for trigger in ("foods_ai", "foods_ad", "foods_au"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            cursor.execute("DROP TABLE IF EXISTS foods_fts")
+            create_fts_index(cursor, name)
+            cursor.execute("INSERT INTO foods_fts(foods_fts) VALUES('optimize')")
+            conn.commit()
+            cursor.execute("VACUUM")
+            samples = benchmark_search.replay(conn, corpus, repeat=repeat, measure=False)
+            conn.close()
+            results.append({
+                "profile": name,
+                "size_bytes": path.stat().st_size,
+                "summary": benchmark_search.summarize(samples),
+            })
+    src.close()
+
+    base = next(r for r in results if r["profile"] == DEFAULT_FTS_PROFILE)
+    print(f"    {'profile':<12} {'size MB':>8} {'size +%':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'p50 gain':>9} {'p95 gain':>9} {'fallback':>9}")
+    for r in results:
+        s, b = r["summary"], base["summary"]
+        growth = (r["size_bytes"] / base["size_bytes"] - 1) * 100
+        gain50 = b["p50_ms"] / s["p50_ms"] if s["p50_ms"] else float("inf")
+        gain95 = b["p95_ms"] / s["p95_ms"] if s["p95_ms"] else float("inf")
+        print(f"    {r['profile']:<12} {r['size_bytes'] / (1024 * 1024):>8.1f} {growth:>+7.1f}% "
+              f"{s['p50_ms']:>8.3f} {s['p95_ms']:>8.3f} {s['p99_ms']:>8.3f} "
+              f"{'x' + format(gain50, '.2f'):>9} {'x' + format(gain95, '.2f'):>9} {s['fallback_rate']:>8.1%}")
+    print(f"    ({len(corpus)} {'/'.join(FTS_PROFILE_QUERY_KINDS)} queries from benchmark_search)")
+    return results
+
+
+# Query kinds from benchmark_search that usually miss FTS and hit the fallback.
+FALLBACK_QUERY_KINDS = ("typo", "infix")
+
+
+def compare_fallback_search(db_path: Path, queries: int = 2000, seed: int = 0) -> dict:
+    """
+    Replay the queries that reach the app's fallback (typos, mid-word
+    substrings) with the LIKE scan and with foods_trigram, and print the
+    query plans, latency, rows scanned and whether both return the same rows.
+    """
+    db_path = Path(db_path)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'foods_trigram'").fetchone():
+            print(f"  {db_path} has no foods_trigram table (build with --trigram).")
+            return {}
+        corpus = [entry for entry in benchmark_search.generate_corpus(conn, queries, seed)
+                  if entry[0] in FALLBACK_QUERY_KINDS]
+        print(f"\n  Fallback search: LIKE scan vs foods_trigram ({len(corpus)} typo/infix queries)")
+
+        for label, sql, params in (
+            ("LIKE", benchmark_search.LIKE_SEARCH_SQL, ("%milk%", "%milk%", "milk", "milk", 50)),
+            ("trigram", benchmark_search.TRIGRAM_SEARCH_SQL, ('"milk"', "milk", "milk", 50)),
+        ):
+            print(f"    {label} plan:")
+            for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params):
+                print(f"      {row[-1]}")
+
+        summaries = {}
+        answers = {}
+        for label, stages in (("LIKE", benchmark_search.APP_SEARCH), ("trigram", benchmark_search.TRIGRAM_SEARCH)):
+            samples = benchmark_search.replay(conn, corpus, stages=stages)
+            summaries[label] = benchmark_search.summarize(samples)
+            answers[label] = [benchmark_search.search_foods(conn, query, stages=stages)[0] for _, query in corpus]
+    finally:
+        conn.close()
+
+    print_latency_summaries("fallback", summaries)
+    same = sum(1 for a, b in zip(answers["LIKE"], answers["trigram"]) if a == b)
+    print(f"    identical results: {same}/{len(corpus)} queries")
+    return summaries
+
+
+def print_latency_summaries(title: str, summaries: dict):
+    """One row per {label: benchmark_search.summarize()} with p50/p95/p99, speedup vs the first row and work."""
+    print(f"    {title:<9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'p50 gain':>9} {'p95 gain':>9} "
+          f"{'rows scanned':>13} {'VM steps':>10}")
+    base = next(iter(summaries.values()))
+    for label, s in summaries.items():
+        gain50 = base["p50_ms"] / s["p50_ms"] if s["p50_ms"] else float("inf")
+        gain95 = base["p95_ms"] / s["p95_ms"] if s["p95_ms"] else float("inf")
+        print(f"    {label:<9} {s['p50_ms']:>8.3f} {s['p95_ms']:>8.3f} {s['p99_ms']:>8.3f} "
+              f"{'x' + format(gain50, '.2f'):>9} {'x' + format(gain95, '.2f'):>9} "
+              f"{s['rows_scanned_mean']:>13,.0f} {s['vm_steps_mean']:>10,}")
+
+
+def compare_ranked_search(db_path: Path, queries: int = 2000, seed: int = 0, repeat: int = 3) -> dict:
+    """
+    Replay the FTS-answered queries (prefix, multiword, brand) with the app's
+    ranked search and with the priority-tier search, and print latency and
+    whether both return the same rows in the same order.
+    """
+    db_path = Path(db_path)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        corpus = [entry for entry in benchmark_search.generate_corpus(conn, queries, seed)
+                  if entry[0] in FTS_PROFILE_QUERY_KINDS]
+        print(f"\n  Ranked search: app ORDER BY vs priority tiers ({len(corpus)} prefix/multiword/brand queries)")
+        summaries = {}
+        answers = {}
+        for label, stages in (("app", benchmark_search.APP_SEARCH), ("priority", benchmark_search.RANKED_SEARCH)):
+            samples = benchmark_search.replay(conn, corpus, repeat=repeat, stages=stages)
+            summaries[label] = benchmark_search.summarize(samples)
+            answers[label] = [benchmark_search.search_foods(conn, query, stages=stages)[0] for _, query in corpus]
+    finally:
+        conn.close()
+
+    print_latency_summaries("search", summaries)
+    same = sum(1 for a, b in zip(answers["app"], answers["priority"]) if a == b)
+    print(f"    identical results: {same}/{len(corpus)} queries")
+    return summaries
+
+
+def compare_typeahead_search(db_path: Path, queries: int = 2000, seed: int = 0, repeat: int = 3) -> dict:
+    """
+    Replay the single-word prefix queries through the app's FTS search and
+    through the typeahead table (FTS for prefixes it doesn't hold), and print
+    latency, how many queries the table answered and whether results match.
+    """
+    db_path = Path(db_path)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'typeahead'").fetchone():
+            print(f"  {db_path} has no typeahead table (build with --typeahead).")
+            return {}
+        corpus = [entry for entry in benchmark_search.generate_corpus(conn, queries, seed) if entry[0] == "prefix"]
+        print(f"\n  Keystroke search: FTS vs typeahead table ({len(corpus)} prefix queries)")
+        summaries = {}
+        answers = {}
+        answered_by_table = 0
+        for label, stages in (("FTS", benchmark_search.APP_SEARCH), ("typeahead", benchmark_search.TYPEAHEAD_SEARCH)):
+            samples = benchmark_search.replay(conn, corpus, repeat=repeat, stages=stages)
+            summaries[label] = benchmark_search.summarize(samples)
+            answers[label] = [benchmark_search.search_foods(conn, query, stages=stages)[0] for _, query in corpus]
+            if label == "typeahead":
+                answered_by_table = sum(1 for sample in samples if sample["stage"] == 0 and sample["rows"])
+    finally:
+        conn.close()
+
+    print_latency_summaries("search", summaries)
+    same = sum(1 for a, b in zip(answers["FTS"], answers["typeahead"]) if a == b)
+    print(f"    answered from the table: {answered_by_table}/{len(corpus)}; identical results: {same}/{len(corpus)}")
+    return summaries
+
+
+def compare_spelling(db_path: Path, queries: int = 1000, seed: int = 0) -> dict:
+    """
+    Check the "did you mean" index on a typo corpus: how often the intended
+    word is the top (or a top-5) suggestion, how long a suggestion takes,
+    and the app's search on the typos with and without the corrected-spelling
+    stage ahead of the LIKE scan.
+    """
+    db_path = Path(db_path)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'spell_deletes'").fetchone():
+            print(f"  {db_path} has no spelling tables (build with --spelling).")
+            return {}
+        typos = benchmark_search.generate_typo_corpus(conn, queries, seed)
+        print(f"\n  Spelling suggestions ({len(typos)} single-edit typos)")
+        settings = benchmark_search.spelling_settings(conn)
+        top1 = top5 = 0
+        latencies = []
+        for typo, word in typos:
+            start = time.perf_counter()
+            suggestions = benchmark_search.suggest(conn, typo, 5, settings)
+            latencies.append({"ms": (time.perf_counter() - start) * 1000, "rows_scanned": len(suggestions),
+                              "rows": len(suggestions), "vm_steps": 0, "stage": None})
+            terms = [t for t, _, _ in suggestions]
+            top1 += bool(terms) and terms[0] == word
+            top5 += word in terms
+        s = benchmark_search.summarize(latencies)
+        print(f"    suggest(): p50 {s['p50_ms']:.3f} ms, p95 {s['p95_ms']:.3f} ms, p99 {s['p99_ms']:.3f} ms")
+        print(f"    intended word first: {top1 / len(typos):.1%}, in top 5: {top5 / len(typos):.1%}")
+
+        corpus = [["typo", typo] for typo, _ in typos]
+        summaries = {}
+        for label, stages in (("app", benchmark_search.APP_SEARCH), ("spelling", benchmark_search.SPELL_SEARCH)):
+            summaries[label] = benchmark_search.summarize(benchmark_search.replay(conn, corpus, stages=stages))
+    finally:
+        conn.close()
+
+    print_latency_summaries("search", summaries)
+    for label, summary in summaries.items():
+        print(f"    {label:<9} no results for {summary['empty_rate']:.1%} of typo queries")
+    return {"top1": top1 / len(typos), "top5": top5 / len(typos), "suggest": s, **summaries}
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Build food_database.sqlite from USDA FoodData Central CSVs.")
+    parser.add_argument("--extract", action="store_true",
+                        help="Extract each dataset zip to usda_data/<dataset>/ instead of reading CSVs from the zip")
+    parser.add_argument("--connections", type=int, default=1,
+                        help="Parallel HTTP range connections per dataset download (default: 1)")
+    parser.add_argument("--parquet-cache", action="store_true",
+                        help="Convert each dataset's CSVs to typed Parquet once (keyed by zip checksum) and read that")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Process datasets in this many worker processes (default: 1, sequential)")
+    parser.add_argument("--bulk-load", choices=BULK_LOAD_MODES,
+                        help="Build in memory or a temp file with journaling off, then VACUUM INTO the output")
+    parser.add_argument("--fts-profile", choices=list(FTS_PROFILES), default=DEFAULT_FTS_PROFILE,
+                        help="foods_fts layout: prefix indexes, detail level, column sizes (default: baseline)")
+    parser.add_argument("--compare-fts-profiles", action="store_true",
+                        help="After the build, report every FTS profile's size and prefix-search latency")
+    parser.add_argument("--compare-ranked-search", action="store_true",
+                        help="After the build, compare the app's ranked search with the foods.priority tier search")
+    parser.add_argument("--typeahead", action="store_true",
+                        help="Precompute a prefix -> top-k fdcIds table for keystroke search and benchmark it against FTS")
+    parser.add_argument("--typeahead-prefix-len", type=int, default=TypeaheadOptions().max_prefix_len,
+                        help="Longest prefix stored in the typeahead table (default: 4)")
+    parser.add_argument("--typeahead-k", type=int, default=TypeaheadOptions().top_k,
+                        help="fdcIds kept per prefix (default: 50, the app's search LIMIT)")
+    parser.add_argument("--typeahead-budget-mb", type=float, default=TypeaheadOptions().budget_mb,
+                        help="Size budget for the typeahead table (default: 2.0)")
+    parser.add_argument("--spelling", action="store_true",
+                        help="Build a SymSpell \"did you mean\" index from the FTS vocabulary and benchmark it on typos")
+    parser.add_argument("--spell-distance", type=int, default=SpellingOptions().max_edit_distance,
+                        help="Largest edit distance the spelling index corrects (default: 2)")
+    parser.add_argument("--trigram", action="store_true",
+                        help="Add a foods_trigram substring index for the search fallback and compare it to the LIKE scan")
+    parser.add_argument("--plan-gate", choices=PLAN_GATE_MODES, default="warn",
+                        help="Fail or warn when an app query's plan scans foods or uses a temp b-tree (default: warn)")
+    parser.add_argument("--top-brands", type=int,
+                        help="Pick the N brand owners with the most products instead of TOP_BRAND_OWNERS "
+                             f"(written to usda_data/{BRAND_MANIFEST_NAME})")
+    parser.add_argument("--brand-weight", choices=BRAND_WEIGHTS,
+                        help="What --top-brands counts: every product (default), or only active (not discontinued) ones")
+    parser.add_argument("--brand-manifest", type=Path,
+                        help="Reuse the brands chosen by an earlier --top-brands build")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Apply only the inserted, updated and deleted foods to an existing food_database.sqlite")
+    parser.add_argument("--reproducible", action="store_true",
+                        help="Byte-identical output for identical inputs, with a build manifest; "
+                             "skips the build when the manifest shows nothing changed")
+    parser.add_argument("--stage-cache", action="store_true",
+                        help="Cache each pipeline stage's output under usda_data/stage_cache/ by a fingerprint "
+                             "of its inputs and code, and rerun only the stages whose fingerprint changed")
+    parser.add_argument("--profile", type=Path, metavar="REPORT",
+                        help="Record wall/CPU time, peak RSS, top allocators (tracemalloc) and rows/sec per stage "
+                             "to this JSON report; compare two with build_profile.py compare")
+    parser.add_argument("--profile-no-tracemalloc", action="store_true",
+                        help="With --profile, skip tracemalloc (no allocator report, near-native timings)")
+    parser.add_argument("--max-size-mb", type=float,
+                        help="Keep the highest-utility foods that fit this on-disk size and report what was cut")
+    args = parser.parse_args()
+    if args.incremental and args.max_size_mb:
+        parser.error("--incremental and --max-size-mb can't be combined")
+    if args.incremental and args.reproducible:
+        parser.error("--incremental and --reproducible can't be combined (an updated file depends on its history)")
+    if args.brand_manifest and (args.top_brands or args.brand_weight):
+        parser.error("--brand-manifest reuses an earlier selection; it can't be combined with --top-brands/--brand-weight")
+    if args.brand_weight and not args.top_brands:
+        parser.error("--brand-weight only applies with --top-brands")
+    args.brand_weight = args.brand_weight or "products"
+
+    if args.profile:
+        build_profile.PROFILER.enable(trace=not args.profile_no_tracemalloc)
+        atexit.register(build_profile.PROFILER.write, args.profile, "build_food_database")
+
     print("=" * 60)
     print("USDA FoodData Central -> SQLite Database Builder")
     print("=" * 60)
 
     DATA_DIR.mkdir(parents=True, exist_ok=True)
 
-    all_foods = []
-
-    # Step 1: Download and process each dataset
+    # Step 1: Download each dataset
     print("\n1. Downloading USDA datasets...")
+    sources = {}
     for data_type, url in USDA_DOWNLOADS.items():
-        base_dir = download_and_extract(data_type, url)
-
-        print(f"\n2. Processing {data_type} foods...")
-        if data_type == "branded":
-            foods = process_branded(base_dir)
-        else:
-            foods = process_foundation_and_legacy(data_type, base_dir)
-
-        all_foods.extend(foods)
-
-    # Step 2: Global deduplication
-    print(f"\n3. Deduplicating {len(all_foods)} total foods...")
-    seen = {}
-    unique_foods = []
-    for food in all_foods:
-        key = food["name"].lower()
-        if food["brand"]:
-            key += f"|{food['brand'].lower()}"
-        if key not in seen:
-            seen[key] = food
-            unique_foods.append(food)
+        sources[data_type] = download_and_extract(data_type, url, extract=args.extract, connections=args.connections)
+        if args.parquet_cache:
+            sources[data_type] = build_parquet_cache(data_type, sources[data_type])
+
+    inputs = None
+    if args.reproducible:
+        inputs = build_inputs(sources, vars(args), args.brand_manifest)
+        if build_is_current(OUTPUT_DB, inputs):
+            print(f"\n{OUTPUT_DB.name} is up to date with {build_manifest_path(OUTPUT_DB).name}, nothing to build.")
+            return
+
+    # Step 2: Process datasets (in parallel with --workers > 1)
+    brands = None
+    if args.brand_manifest:
+        brands = BrandSelection(manifest=args.brand_manifest, reuse=True)
+    elif args.top_brands:
+        brands = BrandSelection(args.top_brands, args.brand_weight, DATA_DIR / BRAND_MANIFEST_NAME)
+    cache = write_key = None
+    if args.stage_cache:
+        cache = StageCache(STAGE_CACHE_DIR)
+        write_inputs = {k: getattr(args, k) for k in BUILD_OUTPUT_OPTIONS + ("incremental", "reproducible")}
+        unique_foods, write_key = run_pipeline(sources, write_inputs, cache, workers=args.workers, brands=brands)
+        if unique_foods is None:
+            print(f"\n{OUTPUT_DB.name} is up to date with the stage cache, nothing to build.")
+            return
+    else:
+        all_foods = process_datasets(sources, workers=args.workers, brands=brands)
+
+        # Step 3: Global deduplication
+        print(f"\n3. Deduplicating {len(all_foods)} total foods...")
+        unique_foods = dedup_foods(all_foods)
+        print(f"  After dedup: {len(unique_foods)} unique foods.")
+
+    # Step 4: Build SQLite database
+    typeahead = None
+    if args.typeahead:
+        typeahead = TypeaheadOptions(args.typeahead_prefix_len, args.typeahead_k, args.typeahead_budget_mb)
+    spelling = SpellingOptions(max_edit_distance=args.spell_distance) if args.spelling else None
+    build_options = dict(bulk_load=args.bulk_load, fts_profile=args.fts_profile, trigram=args.trigram,
+                         typeahead=typeahead, spelling=spelling, plan_gate=args.plan_gate)
+    if args.reproducible:
+        build_options["reproducible"] = True
+    try:
+        if args.max_size_mb:
+            build_within_budget(unique_foods, args.max_size_mb, **build_options)
+        elif args.incremental:
+            update_database(unique_foods, **build_options)
         else:
-            # Prefer branded over generic, newer over older
-            existing = seen[key]
-            # Prefer entries with more complete nutrition data
-            new_score = sum(1 for k in ["calories", "protein", "carbs", "fat", "fiber", "sugar", "sodium"] if food.get(k))
-            old_score = sum(1 for k in ["calories", "protein", "carbs", "fat", "fiber", "sugar", "sodium"] if existing.get(k))
-            if new_score > old_score:
-                idx = unique_foods.index(existing)
-                unique_foods[idx] = food
-                seen[key] = food
-
-    print(f"  After dedup: {len(unique_foods)} unique foods.")
-
-    # Step 3: Build SQLite database
-    build_database(unique_foods)
+            build_database(unique_foods, **build_options)
+    except QueryPlanError as e:
+        print(f"\nBuild failed: {e}")
+        sys.exit(1)
+    if inputs is not None:
+        write_build_manifest(OUTPUT_DB, inputs)
+    if cache is not None:
+        cache.record_write(write_key, OUTPUT_DB)
+    if args.compare_fts_profiles:
+        compare_fts_profiles(OUTPUT_DB)
+    if args.trigram:
+        compare_fallback_search(OUTPUT_DB)
+    if args.compare_ranked_search:
+        compare_ranked_search(OUTPUT_DB)
+    if args.typeahead:
+        compare_typeahead_search(OUTPUT_DB)
+    if args.spelling:
+        compare_spelling(OUTPUT_DB)
 
     print("\nDone! Copy food_database.sqlite to your Xcode project bundle.")
 
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Per-stage timing and memory instrumentation for the database builders.
+
+Used by build_food_database.py and process_parquet_efficient.py (--profile).
+Each stage records:
+
+- wall time and CPU time (this process only; worker processes report their
+  own stages, see worker_call)
+- peak RSS during the stage. On Linux the kernel's high-water mark is reset
+  at every stage boundary; elsewhere only the process-lifetime peak is
+  available, and rss_scope says which one was measured.
+- tracemalloc's peak traced memory and the top allocating lines (by net
+  bytes allocated over the stage)
+- rows processed and rows per second, when the stage reports a row count
+
+Stages nest ("process_branded > load_nutrients"). The JSON report lists
+every stage run plus a per-name summary, which is what `compare` diffs.
+
+Usage:
+    python3 build_profile.py compare BASELINE.json CANDIDATE.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from typing import Optional
+
+# Frames kept per tracemalloc allocation; the report names the innermost one.
+TRACEMALLOC_FRAMES = 1
+TOP_ALLOCATORS = 10
+PROC_STATUS = Path("/proc/self/status")
+PROC_CLEAR_REFS = Path("/proc/self/clear_refs")
+# Allocations by these files are the profiler's own, not the stage's.
+IGNORED_FILES = {tracemalloc.__file__, __file__}
+# ru_maxrss is in KiB on Linux and bytes on macOS.
+MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def _read_hwm() -> Optional[int]:
+    """Peak RSS since the last _reset_hwm(), in bytes, or None without /proc."""
+    try:
+        for line in PROC_STATUS.read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_hwm() -> bool:
+    """Reset the kernel's RSS high-water mark (Linux); False if it can't be."""
+    try:
+        PROC_CLEAR_REFS.write_text("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss() -> tuple:
+    """(bytes, scope): the RSS peak since the last reset ("stage") or over the process ("process")."""
+    hwm = _read_hwm()
+    if hwm is not None:
+        return hwm, "stage"
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT, "process"
+
+
+class Stage:
+    """
+    One run of a stage; set `rows` (input rows processed) inside the `with`
+    body to get a rows/sec figure, and put any other tallies (e.g. rows kept)
+    in `counts`.
+    """
+
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self.rows = None
+        self.counts = {}
+        self.peak_rss = 0
+        self.traced_peak = 0
+        self.snapshot = None
+
+
+class StageProfiler:
+    """Collects Stage records; does nothing (and costs nothing) until enable()."""
+
+    def __init__(self):
+        self.enabled = False
+        self.top_allocators = TOP_ALLOCATORS
+        self.records = []
+        self.stack = []
+        self.rss_resettable = False
+        self.started = None
+
+    def enable(self, top_allocators: int = TOP_ALLOCATORS, trace: bool = True):
+        """
+        Start recording. trace=False skips tracemalloc, which slows
+        allocation-heavy code several times over: only compare timings between
+        reports with the same "tracemalloc" setting.
+        """
+        self.enabled = True
+        self.top_allocators = top_allocators if trace else 0
+        self.records = []
+        self.stack = []
+        self.rss_resettable = _reset_hwm()
+        self.started = (time.perf_counter(), time.process_time())
+        if trace and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    def _fold_peaks(self):
+        """Carry the peaks measured so far into every open stage before they are reset."""
+        rss, _ = peak_rss()
+        traced = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+        for open_stage in self.stack:
+            open_stage.peak_rss = max(open_stage.peak_rss, rss)
+            open_stage.traced_peak = max(open_stage.traced_peak, traced)
+
+    def _reset_peaks(self):
+        if self.rss_resettable:
+            _reset_hwm()
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Record the `with` body as stage `name`, nested under any open stage."""
+        if not self.enabled:
+            yield Stage(name, name)
+            return
+        path = " > ".join([s.name for s in self.stack] + [name])
+        current = Stage(name, path)
+        self._fold_peaks()
+        self._reset_peaks()
+        if self.top_allocators:
+            current.snapshot = tracemalloc.take_snapshot()
+        self.stack.append(current)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield current
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            self._fold_peaks()
+            self.stack.pop()
+            self.records.append(self._record(current, wall, cpu))
+
+    def _record(self, stage: Stage, wall: float, cpu: float) -> dict:
+        record = {
+            "stage": stage.name,
+            "path": stage.path,
+            "pid": os.getpid(),
+            "wall_s": round(wall, 6),
+            "cpu_s": round(cpu, 6),
+            "peak_rss_bytes": stage.peak_rss,
+            "rss_scope": "stage" if self.rss_resettable else "process",
+            "rows": stage.rows,
+            "rows_per_s": round(stage.rows / wall, 1) if stage.rows is not None and wall > 0 else None,
+        }
+        if stage.counts:
+            record["counts"] = stage.counts
+        if tracemalloc.is_tracing():
+            record["traced_peak_bytes"] = stage.traced_peak
+        if stage.snapshot is not None:
+            record["top_allocators"] = top_allocators(stage.snapshot, tracemalloc.take_snapshot(),
+                                                      self.top_allocators)
+        return record
+
+    def merge(self, records: list):
+        """Add stage records returned from a worker process (see worker_call)."""
+        self.records.extend(records)
+
+    def report(self, tool: str) -> dict:
+        wall, cpu = time.perf_counter() - self.started[0], time.process_time() - self.started[1]
+        return {
+            "tool": tool,
+            "argv": sys.argv[1:],
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(time.time() - wall)),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "tracemalloc": tracemalloc.is_tracing(),
+            "total": {
+                "wall_s": round(wall, 6),
+                "cpu_s": round(cpu, 6),
+                "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT,
+            },
+            "summary": summarize(self.records),
+            "stages": self.records,
+        }
+
+    def write(self, path: Path, tool: str):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.report(tool), indent=1))
+        print(f"  Profile report: {path}")
+
+
+def top_allocators(before, after, limit: int) -> list:
+    """The `limit` source lines that allocated the most net memory between two snapshots."""
+    result = []
+    # Skipping the profiler's own lines here rather than with
+    # Snapshot.filter_traces, which walks every trace in Python.
+    for d in after.compare_to(before, "lineno"):
+        if len(result) == limit or d.size_diff <= 0:
+            break
+        frame = d.traceback[0]
+        if frame.filename in IGNORED_FILES or frame.filename.startswith("<frozen "):
+            continue
+        result.append({"where": f"{frame.filename}:{frame.lineno}",
+                       "size_diff_bytes": d.size_diff, "count_diff": d.count_diff})
+    return result
+
+
+def summarize(records: list) -> dict:
+    """Totals per stage name: calls, wall/CPU time, rows, counts and the largest peak RSS."""
+    summary = {}
+    for record in records:
+        entry = summary.setdefault(record["stage"], {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "rows": None,
+                                                     "peak_rss_bytes": 0})
+        entry["calls"] += 1
+        entry["wall_s"] = round(entry["wall_s"] + record["wall_s"], 6)
+        entry["cpu_s"] = round(entry["cpu_s"] + record["cpu_s"], 6)
+        entry["peak_rss_bytes"] = max(entry["peak_rss_bytes"], record["peak_rss_bytes"])
+        if record["rows"] is not None:
+            entry["rows"] = (entry["rows"] or 0) + record["rows"]
+        for name, count in record.get("counts", {}).items():
+            entry.setdefault("counts", {})
+            entry["counts"][name] = entry["counts"].get(name, 0) + count
+    for entry in summary.values():
+        entry["rows_per_s"] = round(entry["rows"] / entry["wall_s"], 1) if entry["rows"] and entry["wall_s"] else None
+    return summary
+
+
+# The profiler the builders report to; main() enables it for --profile.
+PROFILER = StageProfiler()
+
+
+def stage(name: str):
+    """PROFILER.stage(name): `with stage("insert") as s: ...; s.rows = n`."""
+    return PROFILER.stage(name)
+
+
+def profiled(name: str, rows=None):
+    """Decorator: record every call as stage `name`; `rows(result)` gives its row count."""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with PROFILER.stage(name) as current:
+                result = fn(*args, **kwargs)
+                if rows is not None:
+                    current.rows = rows(result)
+                return result
+        return wrapper
+    return decorate
+
+
+def worker_settings() -> Optional[dict]:
+    """What a worker process needs to profile like this one, or None when profiling is off."""
+    if not PROFILER.enabled:
+        return None
+    return {"top_allocators": PROFILER.top_allocators, "trace": tracemalloc.is_tracing()}
+
+
+def worker_call(settings: Optional[dict], fn, *args):
+    """
+    Process-pool entry point: run fn(*args) and return (result, stage records).
+
+    The worker starts a fresh profiler (a forked child would otherwise carry
+    the parent's open stages); the parent passes the records to PROFILER.merge.
+    """
+    if settings is None:
+        return fn(*args), []
+    PROFILER.enable(**settings)
+    result = fn(*args)
+    return result, PROFILER.records
+
+
+def compare(baseline: dict, candidate: dict):
+    """Print each stage's wall time, rows/sec and peak RSS side by side for two reports."""
+    def mb(n):
+        return f"{n / (1024 * 1024):.0f}" if n else "-"
+
+    print(f"{'stage':<24} {'wall A':>9} {'wall B':>9} {'B/A':>6} {'rows/s A':>11} {'rows/s B':>11} "
+          f"{'RSS A MB':>9} {'RSS B MB':>9}")
+    names = list(baseline["summary"]) + [n for n in candidate["summary"] if n not in baseline["summary"]]
+    for name in names:
+        a, b = baseline["summary"].get(name), candidate["summary"].get(name)
+        ratio = f"{b['wall_s'] / a['wall_s']:.2f}" if a and b and a["wall_s"] else "-"
+        print(f"{name:<24} {a['wall_s'] if a else '-':>9} {b['wall_s'] if b else '-':>9} {ratio:>6} "
+              f"{(a or {}).get('rows_per_s') or '-':>11} {(b or {}).get('rows_per_s') or '-':>11} "
+              f"{mb((a or {}).get('peak_rss_bytes')):>9} {mb((b or {}).get('peak_rss_bytes')):>9}")
+    a, b = baseline["total"], candidate["total"]
+    print(f"{'total':<24} {a['wall_s']:>9} {b['wall_s']:>9} {b['wall_s'] / a['wall_s']:>6.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two --profile reports")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("compare", help="Per-stage wall time, throughput and peak RSS of two reports")
+    p.add_argument("baseline", type=Path)
+    p.add_argument("candidate", type=Path)
+    args = parser.parse_args()
+    compare(json.loads(args.baseline.read_text()), json.loads(args.candidate.read_text()))
+
+
+if __name__ == "__main__":
+    main()
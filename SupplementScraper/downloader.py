@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Resumable, checksum-verified downloads for the large dataset archives.
+
+Used by build_food_database.py (USDA FoodData Central zips) and
+openfoodfacts_parquet.py (Open Food Facts Parquet dumps).
+
+- Interrupted downloads resume from the `.part` file with HTTP Range requests
+  instead of restarting from zero.
+- Large files can be fetched over several connections at once, one byte
+  range per connection. Segment progress is kept next to the `.part` file
+  so a segmented download also resumes.
+- Every completed file's SHA-256 is recorded in a manifest
+  (`download_manifest.json` in the destination directory) and re-checked
+  before a cached file is reused.
+
+Usage:
+    python3 downloader.py URL DEST [--connections 4] [--sha256 HEX]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import requests
+
+MANIFEST_NAME = "download_manifest.json"
+CHUNK_SIZE = 1024 * 1024
+# Files smaller than this are never split across connections.
+MIN_SEGMENT_SIZE = 16 * 1024 * 1024
+
+
+class DownloadError(Exception):
+    """A download could not be completed or failed checksum verification."""
+
+
+def sha256_file(path: Path) -> str:
+    """Stream a file through SHA-256 and return the hex digest."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(manifest_path: Path) -> dict:
+    if not manifest_path.exists():
+        return {}
+    try:
+        return json.loads(manifest_path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest_path: Path, manifest: dict):
+    tmp = manifest_path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    os.replace(tmp, manifest_path)
+
+
+def forget(dest: Path, manifest_path: Optional[Path] = None):
+    """Delete a downloaded file, its partial state and its manifest entry (e.g. after a bad zip)."""
+    manifest_path = manifest_path or dest.parent / MANIFEST_NAME
+    for path in (dest, part_path(dest), segments_path(dest)):
+        if path.exists():
+            path.unlink()
+    manifest = load_manifest(manifest_path)
+    if manifest.pop(dest.name, None) is not None:
+        save_manifest(manifest_path, manifest)
+
+
+def part_path(dest: Path) -> Path:
+    return dest.with_name(dest.name + ".part")
+
+
+def segments_path(dest: Path) -> Path:
+    return dest.with_name(dest.name + ".part.json")
+
+
+class _Progress:
+    """Thread-safe byte counter that prints a single updating progress line."""
+
+    def __init__(self, label: str, total: int, done: int = 0):
+        self.label = label
+        self.total = total
+        self.done = done
+        self.lock = threading.Lock()
+        self.last_print = 0.0
+
+    def add(self, n: int):
+        with self.lock:
+            self.done += n
+            now = time.monotonic()
+            if now - self.last_print < 0.5 and self.done < self.total:
+                return
+            self.last_print = now
+        if self.total > 0:
+            pct = self.done * 100 // self.total
+            print(f"\r  [{self.label}] {pct}% ({self.done // (1024*1024)} MB)", end="", flush=True)
+
+
+def probe(session: requests.Session, url: str, timeout: int) -> tuple:
+    """Return (size, accepts_ranges, validator) for `url`; size is 0 if unknown."""
+    try:
+        resp = session.head(url, allow_redirects=True, timeout=timeout)
+        resp.raise_for_status()
+    except requests.RequestException:
+        return 0, False, None
+    size = int(resp.headers.get("content-length", 0) or 0)
+    accepts_ranges = resp.headers.get("accept-ranges", "").lower() == "bytes"
+    validator = resp.headers.get("etag") or resp.headers.get("last-modified")
+    return size, accepts_ranges, validator
+
+
+def _fetch_range(session, url, part, start, end, validator, progress, timeout, state=None, state_lock=None, index=None):
+    """
+    Download bytes [start, end] (inclusive; end=None means to EOF) into `part`
+    at offset `start`. Returns the number of bytes written. Raises
+    DownloadError if the server ignores the Range header on a non-zero start.
+    """
+    headers = {}
+    if start > 0 or end is not None:
+        headers["Range"] = f"bytes={start}-" + ("" if end is None else str(end))
+        if validator:
+            headers["If-Range"] = validator
+
+    written = 0
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as resp:
+        resp.raise_for_status()
+        if headers and resp.status_code != 206:
+            raise DownloadError("server did not honour Range request")
+        with open(part, "r+b") as f:
+            f.seek(start)
+            for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                if not chunk:
+                    continue
+                f.write(chunk)
+                written += len(chunk)
+                progress.add(len(chunk))
+                if state is not None:
+                    with state_lock:
+                        state["segments"][index][2] += len(chunk)
+    return written
+
+
+def _download_single(session, url, part, size, accepts_ranges, validator, label, timeout, retries):
+    """One connection, resuming from the current length of `part`."""
+    if not part.exists() or not accepts_ranges:
+        part.write_bytes(b"")
+    offset = part.stat().st_size
+    if size and offset > size:
+        part.write_bytes(b"")
+        offset = 0
+    if offset:
+        print(f"  [{label}] Resuming at {offset // (1024*1024)} MB")
+    progress = _Progress(label, size, offset)
+
+    for attempt in range(retries + 1):
+        try:
+            if size and offset >= size:
+                break
+            _fetch_range(session, url, part, offset, None, validator if offset else None, progress, timeout)
+            break
+        except DownloadError:
+            if attempt == retries:
+                raise
+            # Range ignored: start over from byte 0.
+            part.write_bytes(b"")
+            offset = 0
+            progress = _Progress(label, size, 0)
+        except requests.RequestException as e:
+            if attempt == retries or not accepts_ranges:
+                raise DownloadError(str(e)) from e
+            time.sleep(2 ** attempt)
+            offset = part.stat().st_size
+            print(f"\n  [{label}] {e}; resuming at {offset // (1024*1024)} MB")
+    print()
+
+
+def _download_segmented(session, url, dest, size, validator, connections, label, timeout, retries):
+    """Several connections, each filling one byte range of a preallocated `.part` file."""
+    part = part_path(dest)
+    state_file = segments_path(dest)
+    state = None
+    if part.exists() and state_file.exists():
+        try:
+            state = json.loads(state_file.read_text())
+        except ValueError:
+            state = None
+        if state and (state.get("size") != size or state.get("validator") != validator):
+            state = None
+    if state is None:
+        step = -(-size // connections)
+        state = {
+            "size": size,
+            "validator": validator,
+            # [start, end (inclusive), bytes done]
+            "segments": [[s, min(s + step, size) - 1, 0] for s in range(0, size, step)],
+        }
+        with open(part, "wb") as f:
+            f.truncate(size)
+
+    done = sum(seg[2] for seg in state["segments"])
+    if done:
+        print(f"  [{label}] Resuming at {done // (1024*1024)} MB over {len(state['segments'])} connections")
+    progress = _Progress(label, size, done)
+    state_lock = threading.Lock()
+    stop = threading.Event()
+
+    def checkpoint():
+        with state_lock:
+            snapshot = json.dumps(state)
+        state_file.write_text(snapshot)
+
+    def saver():
+        while not stop.wait(2.0):
+            checkpoint()
+
+    def worker(index):
+        start, end, _ = state["segments"][index]
+        for attempt in range(retries + 1):
+            offset = start + state["segments"][index][2]
+            if offset > end:
+                return
+            try:
+                _fetch_range(session, url, part, offset, end, validator, progress, timeout,
+                             state=state, state_lock=state_lock, index=index)
+                return
+            except requests.RequestException as e:
+                if attempt == retries:
+                    raise DownloadError(str(e)) from e
+                time.sleep(2 ** attempt)
+
+    saver_thread = threading.Thread(target=saver, daemon=True)
+    saver_thread.start()
+    try:
+        with ThreadPoolExecutor(max_workers=len(state["segments"])) as pool:
+            for future in [pool.submit(worker, i) for i in range(len(state["segments"]))]:
+                future.result()
+    finally:
+        stop.set()
+        saver_thread.join()
+        checkpoint()
+    print()
+
+    if any(seg[0] + seg[2] <= seg[1] for seg in state["segments"]):
+        raise DownloadError("segmented download incomplete")
+
+
+def download(url: str, dest: Path, connections: int = 1, expected_sha256: Optional[str] = None,
+             label: Optional[str] = None, timeout: int = 300, retries: int = 3,
+             manifest_path: Optional[Path] = None) -> Path:
+    """
+    Download `url` to `dest`, resuming a previous partial download.
+
+    With connections > 1 and a server that supports Range requests, the file
+    is fetched as that many parallel byte ranges. The SHA-256 of the finished
+    file is checked against `expected_sha256` (if given) and recorded in the
+    manifest; an existing `dest` is reused only if it still matches the
+    manifest entry. Raises DownloadError on failure.
+    """
+    dest = Path(dest)
+    label = label or dest.name
+    manifest_path = manifest_path or dest.parent / MANIFEST_NAME
+    dest.parent.mkdir(parents=True, exist_ok=True)
+
+    manifest = load_manifest(manifest_path)
+    entry = manifest.get(dest.name)
+    if dest.exists() and entry:
+        digest = sha256_file(dest)
+        if digest == entry.get("sha256") and (not expected_sha256 or digest == expected_sha256):
+            print(f"  [{label}] Already downloaded, checksum OK.")
+            return dest
+        print(f"  [{label}] Checksum mismatch for cached file, downloading again.")
+        forget(dest, manifest_path)
+    elif dest.exists() and not entry:
+        # Downloaded before the manifest existed: adopt it.
+        digest = sha256_file(dest)
+        if expected_sha256 and digest != expected_sha256:
+            forget(dest, manifest_path)
+        else:
+            manifest[dest.name] = {"url": url, "size": dest.stat().st_size, "sha256": digest}
+            save_manifest(manifest_path, manifest)
+            print(f"  [{label}] Already downloaded, recorded checksum.")
+            return dest
+
+    part = part_path(dest)
+    start = time.perf_counter()
+    with requests.Session() as session:
+        size, accepts_ranges, validator = probe(session, url, timeout)
+        try:
+            if connections > 1 and accepts_ranges and size >= MIN_SEGMENT_SIZE:
+                print(f"  [{label}] Downloading {size // (1024*1024)} MB over {connections} connections...")
+                _download_segmented(session, url, dest, size, validator, connections, label, timeout, retries)
+            else:
+                print(f"  [{label}] Downloading...")
+                if segments_path(dest).exists():
+                    # Leftover segmented state cannot be resumed as a single stream.
+                    segments_path(dest).unlink()
+                    part.write_bytes(b"")
+                _download_single(session, url, part, size, accepts_ranges, validator, label, timeout, retries)
+        except requests.RequestException as e:
+            raise DownloadError(str(e)) from e
+
+    if size and part.stat().st_size != size:
+        raise DownloadError(f"expected {size} bytes, got {part.stat().st_size}")
+
+    digest = sha256_file(part)
+    if expected_sha256 and digest != expected_sha256:
+        part.unlink()
+        raise DownloadError(f"SHA-256 mismatch: expected {expected_sha256}, got {digest}")
+
+    os.replace(part, dest)
+    if segments_path(dest).exists():
+        segments_path(dest).unlink()
+    manifest = load_manifest(manifest_path)
+    manifest[dest.name] = {"url": url, "size": dest.stat().st_size, "sha256": digest}
+    save_manifest(manifest_path, manifest)
+
+    elapsed = time.perf_counter() - start
+    print(f"  [{label}] Done: {dest.stat().st_size // (1024*1024)} MB in {elapsed:.1f}s, sha256 {digest[:12]}...")
+    return dest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resumable, checksum-verified download")
+    parser.add_argument("url")
+    parser.add_argument("dest")
+    parser.add_argument("--connections", type=int, default=1, help="Parallel byte-range connections")
+    parser.add_argument("--sha256", help="Expected SHA-256 hex digest")
+    args = parser.parse_args()
+    try:
+        download(args.url, Path(args.dest), connections=args.connections, expected_sha256=args.sha256)
+    except DownloadError as e:
+        print(f"Download failed: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Row-level delta packages between two builds of food_database.sqlite.
+
+Instead of shipping a whole new multi-MB database with every app update,
+`diff` compares two built databases and writes a small changeset, and
+`apply` patches a copy of the old database into the new one:
+
+- Every ordinary table (foods, typeahead, spell_*) is diffed row by row on
+  its primary key (or rowid): changed and new rows are shipped whole as
+  upserts, removed rows as deleted keys.
+- FTS5 tables are not shipped at all. foods_fts / foods_trigram follow
+  foods through their sync triggers, or, when the delta touches a large
+  share of foods, the package hints that they should be rebuilt in one go.
+- The package records a content checksum of the base and of the target
+  database (schema plus every ordinary table's rows, independent of page
+  layout). `apply` refuses a database that isn't the base, and checks the
+  result against the target checksum and the FTS integrity-check.
+
+Package layout: MAGIC, a big-endian uint16 format version, then
+xz-compressed JSON. BLOB values are stored as {"$b": base64}.
+
+Usage:
+    python3 food_delta.py diff old.sqlite new.sqlite update.fooddelta
+    python3 food_delta.py apply old.sqlite update.fooddelta --output patched.sqlite
+    python3 food_delta.py info update.fooddelta
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import lzma
+import shutil
+import sqlite3
+import struct
+import sys
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+MAGIC = b"FOODDELTA"
+FORMAT_VERSION = 1
+# Rebuild the FTS indexes instead of updating them row by row through the
+# triggers once the delta changes more than this share of foods.
+FTS_REBUILD_RATIO = 0.25
+FTS_SHADOW_SUFFIXES = ("_data", "_idx", "_content", "_docsize", "_config")
+
+
+class DeltaError(Exception):
+    """A delta could not be built, read, or applied to the given database."""
+
+
+class ContentTable(NamedTuple):
+    """An ordinary table carried by deltas: its key columns, then all columns in select order."""
+    name: str
+    key: tuple
+    columns: tuple
+
+
+def _encode(value):
+    if isinstance(value, bytes):
+        return {"$b": base64.b64encode(value).decode("ascii")}
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        return base64.b64decode(value["$b"])
+    return value
+
+
+def _canonical(row) -> bytes:
+    return json.dumps([_encode(v) for v in row], separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def fts_tables(conn: sqlite3.Connection) -> list:
+    """Names of the FTS5 virtual tables in the database."""
+    return sorted(name for name, sql in conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table'")
+                  if sql and sql.upper().startswith("CREATE VIRTUAL TABLE") and "FTS5" in sql.upper())
+
+
+def content_tables(conn: sqlite3.Connection) -> list:
+    """Every ordinary table except SQLite's own and FTS5 shadow tables, by name."""
+    virtual = fts_tables(conn)
+    shadow = {v + suffix for v in virtual for suffix in FTS_SHADOW_SUFFIXES}
+    tables = []
+    for name, sql in conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table' ORDER BY name"):
+        if name.startswith("sqlite_") or name in shadow or name in virtual:
+            continue
+        info = conn.execute(f"PRAGMA table_info({name})").fetchall()
+        columns = tuple(row[1] for row in info)
+        key = tuple(row[1] for row in sorted(info, key=lambda r: r[5]) if row[5] > 0)
+        if not key:
+            key, columns = ("rowid",), ("rowid",) + columns
+        tables.append(ContentTable(name, key, columns))
+    return tables
+
+
+def schema_entries(conn: sqlite3.Connection) -> list:
+    """(type, name, sql) of every schema object except SQLite's own and FTS5 shadow tables."""
+    virtual = fts_tables(conn)
+    shadow = {v + suffix for v in virtual for suffix in FTS_SHADOW_SUFFIXES}
+    return [row for row in conn.execute("SELECT type, name, sql FROM sqlite_master ORDER BY type, name")
+            if not row[1].startswith("sqlite_") and row[1] not in shadow]
+
+
+def table_rows(conn: sqlite3.Connection, table: ContentTable) -> dict:
+    """{key tuple: row tuple} for one content table."""
+    key_positions = [table.columns.index(k) for k in table.key]
+    rows = {}
+    for row in conn.execute(f"SELECT {', '.join(table.columns)} FROM {table.name}"):
+        rows[tuple(row[i] for i in key_positions)] = row
+    return rows
+
+
+def content_checksum(conn: sqlite3.Connection) -> str:
+    """
+    SHA-256 over the schema and every content table's rows in key order.
+    Two databases with the same checksum hold the same data whatever their
+    page layout, so a patched database can be checked against a fresh build.
+    """
+    digest = hashlib.sha256()
+    for entry in schema_entries(conn):
+        digest.update(_canonical(entry))
+    for table in content_tables(conn):
+        digest.update(_canonical([table.name, *table.columns]))
+        rows = table_rows(conn, table)
+        for key in sorted(rows, key=_canonical):
+            digest.update(_canonical(rows[key]))
+    return digest.hexdigest()
+
+
+def diff_databases(old_path: Path, new_path: Path) -> dict:
+    """Build the delta (as a dict) that turns the database at old_path into the one at new_path."""
+    old = sqlite3.connect(f"file:{old_path}?mode=ro", uri=True)
+    new = sqlite3.connect(f"file:{new_path}?mode=ro", uri=True)
+    try:
+        if schema_entries(old) != schema_entries(new):
+            raise DeltaError("schemas differ; ship the full database for this update")
+        tables = {}
+        foods_changed = 0
+        for table in content_tables(new):
+            old_rows = table_rows(old, table)
+            new_rows = table_rows(new, table)
+            upserts = [row for key, row in new_rows.items() if old_rows.get(key) != row]
+            deletes = [key for key in old_rows if key not in new_rows]
+            if table.name == "foods":
+                foods_changed = len(upserts) + len(deletes)
+            if upserts or deletes:
+                tables[table.name] = {
+                    "key": list(table.key),
+                    "columns": list(table.columns),
+                    "upserts": [[_encode(v) for v in row] for row in upserts],
+                    "deletes": [[_encode(v) for v in key] for key in deletes],
+                }
+        foods_total = new.execute("SELECT COUNT(*) FROM foods").fetchone()[0] if "foods" in tables else 0
+        rebuild = foods_total > 0 and foods_changed / foods_total > FTS_REBUILD_RATIO
+        return {
+            "format": FORMAT_VERSION,
+            "base_checksum": content_checksum(old),
+            "target_checksum": content_checksum(new),
+            "tables": tables,
+            "fts": {
+                "tables": fts_tables(new) if foods_changed else [],
+                "mode": "rebuild" if rebuild else "triggers",
+            },
+            "analyze": bool(tables) and new.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is not None,
+        }
+    finally:
+        old.close()
+        new.close()
+
+
+def write_delta(delta: dict, path: Path):
+    payload = lzma.compress(json.dumps(delta, separators=(",", ":"), ensure_ascii=False).encode(), preset=9)
+    path.write_bytes(MAGIC + struct.pack(">H", delta["format"]) + payload)
+
+
+def read_delta(path: Path) -> dict:
+    data = path.read_bytes()
+    if not data.startswith(MAGIC):
+        raise DeltaError(f"{path} is not a food database delta")
+    (version,) = struct.unpack_from(">H", data, len(MAGIC))
+    if version != FORMAT_VERSION:
+        raise DeltaError(f"{path} is format version {version}; this applier reads version {FORMAT_VERSION}")
+    try:
+        return json.loads(lzma.decompress(data[len(MAGIC) + 2:]))
+    except (lzma.LZMAError, ValueError) as e:
+        raise DeltaError(f"{path} is corrupt: {e}") from e
+
+
+def apply_delta(db_path: Path, delta: dict, output: Optional[Path] = None) -> Path:
+    """
+    Patch the database at db_path (or a copy of it at `output`) with `delta`.
+    The base checksum is checked first and the target checksum and FTS
+    integrity-check after; on any failure the changes are rolled back (and
+    the copy removed) and DeltaError is raised. Returns the patched path.
+    """
+    target = Path(output) if output else Path(db_path)
+    if output:
+        shutil.copyfile(db_path, target)
+    conn = sqlite3.connect(str(target), isolation_level=None)
+    try:
+        if content_checksum(conn) != delta["base_checksum"]:
+            raise DeltaError(f"{db_path} is not the database this delta was built from")
+
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        fts = delta["fts"]
+        triggers = []
+        if fts["mode"] == "rebuild":
+            # Drop the foods sync triggers so rows aren't indexed one by one; the
+            # FTS tables are rebuilt from foods once everything is applied.
+            triggers = cursor.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'foods'").fetchall()
+            for name, _ in triggers:
+                cursor.execute(f"DROP TRIGGER {name}")
+
+        for name, table in delta["tables"].items():
+            key_positions = [table["columns"].index(k) for k in table["key"]]
+            where = " AND ".join(f"{k} = ?" for k in table["key"])
+            upserts = [[_decode(v) for v in row] for row in table["upserts"]]
+            # Changed rows are deleted and re-inserted, after the removed ones, so
+            # no UNIQUE constraint sees the old and new versions of a row at once.
+            doomed = [[_decode(v) for v in key] for key in table["deletes"]]
+            doomed += [[row[i] for i in key_positions] for row in upserts]
+            cursor.executemany(f"DELETE FROM {name} WHERE {where}", doomed)
+            cursor.executemany(
+                f"INSERT INTO {name} ({', '.join(table['columns'])}) "
+                f"VALUES ({', '.join('?' * len(table['columns']))})",
+                upserts,
+            )
+
+        for name in fts["tables"]:
+            cursor.execute(f"INSERT INTO {name}({name}) VALUES(?)", ("rebuild" if triggers else "optimize",))
+        for _, sql in triggers:
+            cursor.execute(sql)
+        if delta["analyze"]:
+            cursor.execute("ANALYZE")
+
+        if content_checksum(conn) != delta["target_checksum"]:
+            raise DeltaError("patched database does not match the delta's target checksum")
+        for name in fts_tables(conn):
+            cursor.execute(f"INSERT INTO {name}({name}) VALUES('integrity-check')")
+        cursor.execute("COMMIT")
+    except (DeltaError, sqlite3.DatabaseError) as e:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        conn.close()
+        if output:
+            target.unlink()
+        if isinstance(e, DeltaError):
+            raise
+        raise DeltaError(str(e)) from e
+    conn.execute("VACUUM")
+    conn.close()
+    return target
+
+
+def summarize(delta: dict) -> str:
+    lines = [f"  format {delta['format']}, base {delta['base_checksum'][:12]}..., "
+             f"target {delta['target_checksum'][:12]}..."]
+    for name, table in delta["tables"].items():
+        lines.append(f"  {name:<16} {len(table['upserts']):>7} upserts {len(table['deletes']):>7} deletes")
+    if delta["fts"]["tables"]:
+        lines.append(f"  FTS: {', '.join(delta['fts']['tables'])} ({delta['fts']['mode']})")
+    return "\n".join(lines)
+
+
+def cmd_diff(args) -> int:
+    old_path, new_path, out = Path(args.old), Path(args.new), Path(args.output)
+    try:
+        delta = diff_databases(old_path, new_path)
+    except DeltaError as e:
+        print(f"Diff failed: {e}")
+        return 1
+    write_delta(delta, out)
+    size = out.stat().st_size
+    full = new_path.stat().st_size
+    print(summarize(delta))
+    print(f"  Delta: {out} ({size / 1024:.1f} KB, {size / full:.1%} of the {full / (1024 * 1024):.1f} MB database)")
+    return 0
+
+
+def cmd_apply(args) -> int:
+    try:
+        path = apply_delta(Path(args.database), read_delta(Path(args.delta)), args.output)
+    except DeltaError as e:
+        print(f"Apply failed: {e}")
+        return 1
+    print(f"  Patched {path}, content checksum verified.")
+    return 0
+
+
+def cmd_info(args) -> int:
+    try:
+        print(summarize(read_delta(Path(args.delta))))
+    except DeltaError as e:
+        print(e)
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Row-level delta packages for food_database.sqlite")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("diff", help="Write the delta that turns OLD into NEW")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("output")
+    p.set_defaults(func=cmd_diff)
+
+    p = sub.add_parser("apply", help="Patch a database with a delta and verify the result")
+    p.add_argument("database")
+    p.add_argument("delta")
+    p.add_argument("--output", type=Path, help="Write the patched database here instead of patching in place")
+    p.set_defaults(func=cmd_apply)
+
+    p = sub.add_parser("info", help="Summarize a delta")
+    p.add_argument("delta")
+    p.set_defaults(func=cmd_info)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,10 +8,12 @@ import pandas as pd
 import pyarrow.parquet as pq
 import sqlite3
 import logging
+from pathlib import Path
 from typing import List, Dict
-import requests
 import os
 
+from downloader import DownloadError, download
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -23,10 +25,12 @@ class OpenFoodFactsParquet:
         self.parquet_url = "https://static.openfoodfacts.org/data/openfoodfacts-products.parquet"
         self.local_parquet = "openfoodfacts-products.parquet"
 
-    def download_parquet(self, supplements_only: bool = True):
+    def download_parquet(self, supplements_only: bool = True, connections: int = 1):
         """
         Download Open Food Facts Parquet file.
-        Note: Full file is ~2-3GB
+        Note: Full file is ~2-3GB. Interrupted downloads resume, `connections`
+        > 1 fetches byte ranges in parallel, and the SHA-256 is recorded in
+        download_manifest.json (see downloader.py).
         """
         if supplements_only:
             # Download smaller supplements subset
@@ -36,25 +40,14 @@ class OpenFoodFactsParquet:
             url = self.parquet_url
             filename = self.local_parquet
 
-        if os.path.exists(filename):
-            logger.info(f"File {filename} already exists")
-            return filename
-
         logger.info(f"Downloading {url}...")
         logger.info("This may take a few minutes...")
 
-        response = requests.get(url, stream=True)
-        total_size = int(response.headers.get('content-length', 0))
-
-        with open(filename, 'wb') as file:
-            downloaded = 0
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    file.write(chunk)
-                    downloaded += len(chunk)
-                    if total_size > 0:
-                        percent = (downloaded / total_size) * 100
-                        print(f"\rProgress: {percent:.1f}%", end='')
+        try:
+            download(url, Path(filename), connections=connections)
+        except DownloadError as e:
+            logger.error(f"Download failed: {e}")
+            return None
 
         print("\n✅ Download complete!")
         return filename
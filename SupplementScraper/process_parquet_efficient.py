@@ -2,8 +2,12 @@
 """
 Efficiently Process Open Food Facts Parquet File for Supplements
 Uses chunked reading to handle large files
+
+Usage:
+    python3 process_parquet_efficient.py [PARQUET_FILE] [--profile REPORT.json [--profile-no-tracemalloc]]
 """
 
+import argparse
 import pandas as pd
 import pyarrow.parquet as pq
 import sqlite3
@@ -11,6 +15,8 @@ import json
 import logging
 from pathlib import Path
 
+import build_profile
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 logger = logging.getLogger(__name__)
 
@@ -57,25 +63,36 @@ def process_supplements_efficiently(parquet_path: str):
     
     logger.info("Processing file in batches...")
     
-    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=available_columns):
-        batch_num += 1
-        df = batch.to_pandas()
+    rows_scanned = 0
+    with build_profile.stage("process_supplements") as process_stage:
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=available_columns):
+            batch_num += 1
+            with build_profile.stage("to_pandas") as stage:
+                df = batch.to_pandas()
+                stage.rows = len(df)
         
-        logger.info(f"Processing batch {batch_num} ({len(df):,} rows)...")
+            logger.info(f"Processing batch {batch_num} ({len(df):,} rows)...")
         
-        # Filter for supplements
-        supplements = filter_supplements(df)
+            # Filter for supplements
+            with build_profile.stage("filter_supplements") as stage:
+                supplements = filter_supplements(df)
+                stage.rows = len(df)
         
-        if len(supplements) > 0:
-            # Save to database
-            save_batch_to_db(supplements, conn)
-            total_supplements += len(supplements)
-            logger.info(f"  Found {len(supplements)} supplements in this batch (total: {total_supplements})")
+            if len(supplements) > 0:
+                # Save to database
+                with build_profile.stage("insert") as stage:
+                    save_batch_to_db(supplements, conn)
+                    stage.rows = len(supplements)
+                total_supplements += len(supplements)
+                logger.info(f"  Found {len(supplements)} supplements in this batch (total: {total_supplements})")
         
-        # Stop after finding enough supplements
-        if total_supplements >= 10000:
-            logger.info(f"Reached {total_supplements} supplements. Stopping.")
-            break
+            # Stop after finding enough supplements
+            if total_supplements >= 10000:
+                logger.info(f"Reached {total_supplements} supplements. Stopping.")
+                break
+        # rows/sec counts rows scanned, like the other stages; supplements found go under counts.
+        process_stage.rows = rows_scanned
+        process_stage.counts["found"] = total_supplements
     
     conn.commit()
     conn.close()
@@ -269,7 +286,16 @@ def analyze_database():
 
 
 if __name__ == "__main__":
-    parquet_file = "/Users/mocha/Downloads/food.parquet"
+    parser = argparse.ArgumentParser(description="Extract supplements from an Open Food Facts Parquet dump")
+    parser.add_argument("parquet_file", nargs="?", default="/Users/mocha/Downloads/food.parquet")
+    parser.add_argument("--profile", type=Path, metavar="REPORT",
+                        help="Record wall/CPU time, peak RSS, top allocators and rows/sec per stage to this JSON report")
+    parser.add_argument("--profile-no-tracemalloc", action="store_true",
+                        help="With --profile, skip tracemalloc (no allocator report, near-native timings)")
+    args = parser.parse_args()
+    parquet_file = args.parquet_file
+    if args.profile:
+        build_profile.PROFILER.enable(trace=not args.profile_no_tracemalloc)
     
     if Path(parquet_file).exists():
         logger.info("Starting efficient supplement extraction...")
@@ -278,4 +304,6 @@ if __name__ == "__main__":
         # Analyze the results
         analyze_database()
     else:
-        logger.error(f"File not found: {parquet_file}")
\ No newline at end of file
+        logger.error(f"File not found: {parquet_file}")
+    if args.profile:
+        build_profile.PROFILER.write(args.profile, "process_parquet_efficient")
\ No newline at end of file
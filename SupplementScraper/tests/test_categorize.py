@@ -0,0 +1,98 @@
+"""The KeywordMatcher classifiers against the baseline keyword tests (benchmark_food_database)."""
+
+import random
+
+import pytest
+
+import benchmark_food_database as bench
+import build_food_database as builder
+
+# (name, USDA category): overlapping keywords where the first matching rule
+# has to win, the category-before-name fallback, and case handling.
+CORPUS = [
+    ("Apple", ""),
+    ("APPLE JUICE", ""),
+    ("Pineapple chunks", ""),
+    ("Peanut butter cookie", ""),          # "pea" (Vegetables) before "butter" and "cookie"
+    ("Buttermilk pancakes", ""),           # "pancake" (Grains) before "milk"
+    ("Chocolate milk", ""),                # "milk" (Dairy) before "chocolate"
+    ("Steak sauce", ""),                   # "steak" (Protein) before "tea" and "sauce"
+    ("Water chestnuts", ""),               # "water" (Beverages) before "nuts"
+    ("Hamburger", ""),                     # "burger"; common through "ham"
+    ("Sub sandwich", ""),
+    ("Subway", ""),
+    ("Hot dog", ""),
+    ("Trail mix", ""),
+    ("Olive oil", ""),
+    ("Honey", ""),
+    ("Greek yogurt, vanilla", ""),
+    ("Egg nog", ""),
+    ("Plain soda crackers", ""),
+    ("Crème brûlée", ""),
+    ("Quinoa", ""),
+    ("Xanthan gum", ""),
+    ("", ""),
+    ("Orange", "Beverages"),               # the category decides before the name
+    ("Cranberry juice cocktail", "Fruit Juices"),      # "fruit" before "juice"
+    ("Almond butter", "Nut and Seed Products"),        # "nut" (Protein) before "butter"
+    ("Vanilla ice cream", "Frozen Dairy Desserts"),    # "dairy" before "dessert"
+    ("Dinner rolls", "Baked Products"),
+    ("Fish sandwich", "Fast Foods, fish"),             # "fish" (Protein) before "fast food"
+    ("French fries", "Restaurant Foods"),
+    ("Ranch", "Salad Dressings and Mayonnaise"),
+    ("Taco seasoning", "Spices and Herbs"),
+    ("Margarine spread", "Margarine & Butter"),
+    ("Pretzels", "Snacks, pretzels"),
+    ("Candy bar", "Candy"),
+    ("Tea", "Coffee & Tea"),
+    ("Lentil soup", "Legumes and Legume Products"),
+    ("Chicken breast", "Other Foods"),               # no category keyword: falls back to the name
+    ("Chicken breast", None),
+]
+
+
+def keyword_corpus(n: int = 2000, seed: int = 0) -> list:
+    """Names and categories stitched together from the keyword tables, so most contain several keywords."""
+    rng = random.Random(seed)
+    words = [kw for _, kws in builder.NAME_KEYWORDS for kw in kws] + sorted(builder.COMMON_FOOD_TERMS)
+    cats = [""] + [kw.title() for _, kws in builder.CATEGORY_KEYWORDS for kw in kws] + ["Other Foods"]
+    return [
+        (" ".join(rng.choice(words) for _ in range(rng.randint(1, 4))), rng.choice(cats))
+        for _ in range(n)
+    ]
+
+
+@pytest.mark.parametrize("corpus", [CORPUS, keyword_corpus()], ids=["fixed", "keywords"])
+def test_batch_matchers_match_baseline(corpus):
+    names = [name for name, _ in corpus]
+    categories = [category for _, category in corpus]
+    assert builder.categorize_foods(names, categories) == [
+        bench.legacy_categorize_food(name, category) for name, category in corpus
+    ]
+    assert builder.is_common_foods(names) == [bench.legacy_is_common_food(name) for name in names]
+
+
+@pytest.mark.parametrize("name,category", CORPUS)
+def test_single_matchers_match_baseline(name, category):
+    assert builder.categorize_food(name, category) == bench.legacy_categorize_food(name, category)
+    assert builder.is_common_food(name) == bench.legacy_is_common_food(name)
+
+
+def test_classify_foods_matches_baseline():
+    foods = [{"name": name} for name, _ in CORPUS]
+    builder.classify_foods(foods, [category for _, category in CORPUS])
+    for food, (name, category) in zip(foods, CORPUS):
+        assert food["category"] == bench.legacy_categorize_food(name, category), name
+        assert food["isCommon"] == bench.legacy_is_common_food(name), name
+
+
+@pytest.mark.parametrize("name,category,expected", [
+    ("Peanut butter cookie", "", "Vegetables"),
+    ("Chocolate milk", "", "Dairy"),
+    ("Almond butter", "Nut and Seed Products", "Protein Foods"),
+    ("Orange", "Beverages", "Beverages"),
+    ("Xanthan gum", "", "Other"),
+])
+def test_rule_order(name, category, expected):
+    assert bench.legacy_categorize_food(name, category) == expected
+    assert builder.categorize_foods([name], [category]) == [expected]
@@ -0,0 +1,194 @@
+"""downloader.download against a local HTTP server with Range and ETag support."""
+
+import hashlib
+import http.server
+import json
+import random
+import re
+import threading
+
+import pytest
+
+import downloader
+
+PAYLOAD = random.Random(0).randbytes(256 * 1024)
+ETAG = '"v1"'
+
+
+class FileServer(http.server.ThreadingHTTPServer):
+    """Serves PAYLOAD at every path and logs the Range header of each GET."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), RangeHandler)
+        self.payload = PAYLOAD
+        # Answer Range requests with the whole file (while still advertising
+        # Accept-Ranges), like a misconfigured mirror.
+        self.ignore_range = False
+        # Cut the first GET off after this many body bytes.
+        self.drop_after = None
+        self.drops = 0
+        self.gets = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/food.zip"
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _headers(self, status: int, length: int, content_range: str = None):
+        self.send_response(status)
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", ETAG)
+        if content_range:
+            self.send_header("Content-Range", content_range)
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._headers(200, len(self.server.payload))
+
+    def do_GET(self):
+        server = self.server
+        payload = server.payload
+        requested = self.headers.get("Range")
+        with server.lock:
+            server.gets.append(requested)
+            drop = server.drop_after is not None and server.drops == 0
+            server.drops += drop
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", requested or "")
+        if_range = self.headers.get("If-Range")
+        if match and not server.ignore_range and if_range in (None, ETAG):
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(payload) - 1
+            body = payload[start:end + 1]
+            self._headers(206, len(body), f"bytes {start}-{end}/{len(payload)}")
+        else:
+            body = payload
+            self._headers(200, len(body))
+        if drop:
+            self.wfile.write(body[:server.drop_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    srv = FileServer()
+    thread = threading.Thread(target=srv.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(downloader.time, "sleep", lambda seconds: None)
+
+
+def manifest_entry(dest):
+    return json.loads((dest.parent / downloader.MANIFEST_NAME).read_text())[dest.name]
+
+
+def test_download_records_manifest(server, tmp_path):
+    dest = tmp_path / "food.zip"
+    downloader.download(server.url, dest)
+    assert dest.read_bytes() == PAYLOAD
+    assert manifest_entry(dest) == {"url": server.url, "size": len(PAYLOAD),
+                                    "sha256": hashlib.sha256(PAYLOAD).hexdigest()}
+    assert not downloader.part_path(dest).exists()
+
+
+def test_resume_from_truncated_part(server, tmp_path):
+    dest = tmp_path / "food.zip"
+    downloader.part_path(dest).write_bytes(PAYLOAD[:100_000])
+    downloader.download(server.url, dest)
+    assert server.gets == ["bytes=100000-"]
+    assert dest.read_bytes() == PAYLOAD
+
+
+def test_resume_after_dropped_connection(server, tmp_path, monkeypatch):
+    # Small chunks, so the bytes received before the drop reach the .part file.
+    monkeypatch.setattr(downloader, "CHUNK_SIZE", 8192)
+    dest = tmp_path / "food.zip"
+    server.drop_after = 50_000
+    downloader.download(server.url, dest)
+    assert server.gets == [None, f"bytes={50_000 // 8192 * 8192}-"]
+    assert dest.read_bytes() == PAYLOAD
+
+
+def test_segmented_download(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "MIN_SEGMENT_SIZE", 1024)
+    dest = tmp_path / "food.zip"
+    downloader.download(server.url, dest, connections=4)
+    step = -(-len(PAYLOAD) // 4)
+    assert sorted(server.gets) == sorted(
+        f"bytes={start}-{min(start + step, len(PAYLOAD)) - 1}" for start in range(0, len(PAYLOAD), step)
+    )
+    assert dest.read_bytes() == PAYLOAD
+    assert not downloader.segments_path(dest).exists()
+
+
+def test_segmented_download_resumes(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "MIN_SEGMENT_SIZE", 1024)
+    dest = tmp_path / "food.zip"
+    half = len(PAYLOAD) // 2
+    # First segment finished, second one 1000 bytes in.
+    part = bytearray(len(PAYLOAD))
+    part[:half + 1000] = PAYLOAD[:half + 1000]
+    downloader.part_path(dest).write_bytes(bytes(part))
+    downloader.segments_path(dest).write_text(json.dumps({
+        "size": len(PAYLOAD), "validator": ETAG,
+        "segments": [[0, half - 1, half], [half, len(PAYLOAD) - 1, 1000]],
+    }))
+    downloader.download(server.url, dest, connections=2)
+    assert server.gets == [f"bytes={half + 1000}-{len(PAYLOAD) - 1}"]
+    assert dest.read_bytes() == PAYLOAD
+
+
+def test_bad_checksum(server, tmp_path):
+    dest = tmp_path / "food.zip"
+    with pytest.raises(downloader.DownloadError, match="SHA-256 mismatch"):
+        downloader.download(server.url, dest, expected_sha256="0" * 64)
+    assert not dest.exists()
+    assert not downloader.part_path(dest).exists()
+    assert not (tmp_path / downloader.MANIFEST_NAME).exists()
+
+
+def test_manifest_reuse(server, tmp_path):
+    dest = tmp_path / "food.zip"
+    sha256 = hashlib.sha256(PAYLOAD).hexdigest()
+    downloader.download(server.url, dest, expected_sha256=sha256)
+    server.gets.clear()
+    downloader.download(server.url, dest, expected_sha256=sha256)
+    assert server.gets == []
+
+    # A cached file that no longer matches its manifest entry is fetched again.
+    dest.write_bytes(b"corrupt")
+    downloader.download(server.url, dest)
+    assert server.gets == [None]
+    assert dest.read_bytes() == PAYLOAD
+
+
+def test_ignored_range_restarts_single_download(server, tmp_path):
+    dest = tmp_path / "food.zip"
+    downloader.part_path(dest).write_bytes(PAYLOAD[:100_000])
+    server.ignore_range = True
+    downloader.download(server.url, dest)
+    assert server.gets == ["bytes=100000-", None]
+    assert dest.read_bytes() == PAYLOAD
+
+
+def test_ignored_range_fails_segmented_download(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "MIN_SEGMENT_SIZE", 1024)
+    dest = tmp_path / "food.zip"
+    server.ignore_range = True
+    with pytest.raises(downloader.DownloadError, match="did not honour Range"):
+        downloader.download(server.url, dest, connections=4)
+    assert not dest.exists()